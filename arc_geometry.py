@@ -0,0 +1,149 @@
+import math
+
+# Geometry of the arcs of a SimpleBrep. An arc is a tuple (cx, cy, r, start,
+# end): the part of the circle of center (cx, cy) and radius r > 0 going
+# counterclockwise from the angle start to the angle end, in degrees, with
+# 0 <= start < 360 and start < end < start + 360 (see normalize_arc).
+#
+# The points where an arc meets something are computed in floating point, so
+# points on arcs are compared up to tolerance(r) instead of exactly.
+
+TOLERANCE = 1e-9
+
+def tolerance(r):
+    return TOLERANCE * max(1.0, r)
+
+def point_tolerance(x, y):
+    # The distance within which points near (x, y) are the same point: the
+    # error of a computed point grows with the size of its coordinates.
+    return tolerance(max(abs(x), abs(y)))
+
+def angle_margin(r):
+    # tolerance(r) as an angle on a circle of radius r, in degrees.
+    return math.degrees(tolerance(r) / r)
+
+def normalize_arc(cx, cy, r, start, end):
+    # The arc as stored, or None if it is not a valid arc. end may be given as
+    # any angle: the arc always goes counterclockwise from start to end.
+    if not all(math.isfinite(v) for v in (cx, cy, r, start, end)):
+        return None
+    sweep = (end - start) % 360.0
+    if r <= 0 or sweep == 0:
+        return None
+    start = start % 360.0
+    return (float(cx), float(cy), float(r), start, start + sweep)
+
+def direction(theta):
+    # (cos, sin) of theta in degrees, exact at the multiples of 90 degrees so
+    # that arcs starting or ending there meet lines exactly.
+    quarter, rest = divmod(theta, 90.0)
+    if rest == 0:
+        return [(1.0, 0.0), (0.0, 1.0), (-1.0, 0.0), (0.0, -1.0)][int(quarter) % 4]
+    t = math.radians(theta)
+    return math.cos(t), math.sin(t)
+
+def arc_point(arc, theta):
+    cx, cy, r = arc[:3]
+    c, s = direction(theta)
+    return cx + r * c, cy + r * s
+
+def arc_endpoints(arc):
+    return arc_point(arc, arc[3]), arc_point(arc, arc[4])
+
+def arc_angle(arc, x, y):
+    # The angle of (x, y) seen from the center, in [start, start + 360).
+    cx, cy, _, start, _ = arc
+    theta = math.degrees(math.atan2(y - cy, x - cx))
+    return start + (theta - start) % 360.0
+
+def arc_box(arc):
+    # The bounding box (x0, y0, x1, y1): the endpoints, and the extreme points
+    # of the circle at the multiples of 90 degrees the arc passes.
+    points = list(arc_endpoints(arc))
+    k = math.floor(arc[3] / 90.0) + 1
+    while 90.0 * k < arc[4]:
+        points.append(arc_point(arc, 90.0 * k))
+        k += 1
+    eps = tolerance(arc[2])
+    xs = [p[0] for p in points]
+    ys = [p[1] for p in points]
+    return (min(xs) - eps, min(ys) - eps, max(xs) + eps, max(ys) + eps)
+
+def strictly_inside(arc, x, y):
+    # Whether the angle of (x, y) is inside the arc, further than the
+    # tolerance from both of its endpoints.
+    margin = angle_margin(arc[2])
+    theta = arc_angle(arc, x, y)
+    return theta - arc[3] > margin and arc[4] - theta > margin
+
+def arc_contains(arc, x, y):
+    # Whether (x, y) lies on the arc, but not at its endpoints.
+    cx, cy, r = arc[:3]
+    if abs(math.hypot(x - cx, y - cy) - r) > tolerance(r):
+        return False
+    return strictly_inside(arc, x, y)
+
+def line_crossings(arc, t, fixed, lo, hi):
+    """
+    Input an arc, and the line of type t at the fixed coordinate from lo to hi
+    Output the points where they meet, strictly inside both, sorted along the
+    line. A tangent line meets the arc once.
+    """
+    cx, cy, r = arc[:3]
+    center_fixed, center_along = (cy, cx) if t == 'h' else (cx, cy)
+    d = fixed - center_fixed
+    eps = tolerance(r)
+    if abs(d) > r + eps:
+        return []
+    # Tangency is decided on the distance, as h = sqrt(r^2 - d^2) blows a
+    # rounding error in d up to far more than the tolerance.
+    h = 0.0 if abs(abs(d) - r) <= eps else math.sqrt(max(r * r - d * d, 0.0))
+    found = []
+    for along in ([center_along - h, center_along + h] if h else [center_along]):
+        if not lo + eps < along < hi - eps:
+            continue
+        x, y = (along, fixed) if t == 'h' else (fixed, along)
+        if strictly_inside(arc, x, y):
+            found.append((x, y))
+    return found
+
+def arc_crossings(arc1, arc2):
+    """
+    Input two arcs
+    Output the points where they meet, strictly inside both. Arcs of the same
+    circle never cross, see arcs_overlap.
+    """
+    (x1, y1, r1), (x2, y2, r2) = arc1[:3], arc2[:3]
+    dx, dy = x2 - x1, y2 - y1
+    d = math.hypot(dx, dy)
+    eps = tolerance(max(r1, r2))
+    if d <= eps or d > r1 + r2 + eps or d < abs(r1 - r2) - eps:
+        return []
+    # The points lie on the chord at distance m from the first center, h away
+    # from the line between the centers on both sides.
+    m = (r1 * r1 - r2 * r2 + d * d) / (2 * d)
+    # As in line_crossings, tangent circles are told by their distance.
+    tangent = abs(d - (r1 + r2)) <= eps or abs(d - abs(r1 - r2)) <= eps
+    h = 0.0 if tangent else math.sqrt(max(r1 * r1 - m * m, 0.0))
+    px, py = x1 + m * dx / d, y1 + m * dy / d
+    if h:
+        points = [(px - h * dy / d, py + h * dx / d), (px + h * dy / d, py - h * dx / d)]
+    else:
+        points = [(px, py)]
+    return [p for p in points if strictly_inside(arc1, *p) and strictly_inside(arc2, *p)]
+
+def arcs_overlap(arc1, arc2):
+    # Whether two arcs of the same circle share more than an endpoint.
+    eps = tolerance(max(arc1[2], arc2[2]))
+    if math.hypot(arc2[0] - arc1[0], arc2[1] - arc1[1]) > eps or abs(arc2[2] - arc1[2]) > eps:
+        return False
+    margin = math.degrees(eps / arc1[2])
+    for shift in (-360.0, 0.0, 360.0):
+        if min(arc1[4], arc2[4] + shift) - max(arc1[3], arc2[3] + shift) > margin:
+            return True
+    return False
+
+def arc_polyline(arc, step=5.0):
+    # Points along the arc, at most step degrees apart, for drawing it.
+    n = max(2, int(math.ceil((arc[4] - arc[3]) / step)))
+    return [arc_point(arc, arc[3] + (arc[4] - arc[3]) * i / n) for i in range(n + 1)]
@@ -0,0 +1,389 @@
+import sys
+import os
+import json
+import time
+import random
+import shutil
+import tempfile
+import platform
+import argparse
+import subprocess
+import tracemalloc
+import numpy as np
+from model import SimpleBrep, same_model
+
+# Scaling benchmarks for SimpleBrep.
+#
+#   python benchmark.py generate grid 16 grid16.lang    (or grid16.brep)
+#   python benchmark.py run -o before.json
+#   python benchmark.py compare before.json after.json
+#   python benchmark.py startup -o startup.json
+#
+# A workload is a list of segments (type, x, y, length) built by one of the
+# generators below; it is written as a .lang file with one line command per
+# segment, and as the .brep file that compiling it gives.
+
+def grid(n):
+    # n horizontal and n vertical full-length lines: n^2 crossings.
+    segments = [('h', 0, i, n - 1) for i in range(n)]
+    segments += [('v', i, 0, n - 1) for i in range(n)]
+    return segments
+
+def staircase(n):
+    # n steps, each sharing its endpoints with the next one.
+    segments = []
+    for i in range(n):
+        segments.append(('h', i, i, 1))
+        segments.append(('v', i + 1, i, 1))
+    return segments
+
+def nested(n):
+    # n concentric squares.
+    segments = []
+    for k in range(1, n + 1):
+        segments.append(('h', -k, -k, 2 * k))
+        segments.append(('h', -k, k, 2 * k))
+        segments.append(('v', -k, -k, 2 * k))
+        segments.append(('v', k, -k, 2 * k))
+    return segments
+
+def random_segments(n, seed=0):
+    # n segments of random positions and lengths, crossing and touching each
+    # other. Each one has a row (column) of its own, as the language rejects
+    # lines lying on part of another one.
+    rng = random.Random(seed)
+    size = max(4, n)
+    fixed = {'h': rng.sample(range(size), size), 'v': rng.sample(range(size), size)}
+    segments = []
+    for i in range(n):
+        t = 'hv'[i % 2]
+        x, y = rng.randrange(size), fixed[t].pop()
+        if t == 'v':
+            x, y = y, x
+        segments.append((t, x, y, rng.randint(1, size // 2)))
+    return segments
+
+def pathological(n):
+    # n short vertical lines and one horizontal line crossing all of them.
+    segments = [('v', i, 0, 1) for i in range(n)]
+    segments.append(('h', -1, 0.5, n + 1))
+    return segments
+
+WORKLOADS = {
+    'grid': grid,
+    'staircase': staircase,
+    'nested': nested,
+    'random': random_segments,
+    'pathological': pathological,
+}
+
+DEFAULT_SIZES = {
+    'grid': [4, 8, 16, 32],
+    'staircase': [16, 64, 256, 1024],
+    'nested': [8, 32, 128, 512],
+    'random': [16, 64, 256, 1024],
+    'pathological': [16, 64, 256, 1024],
+}
+
+def to_lang(segments):
+    return ''.join('a{} {} start {} {} end {}\n'.format(i, t, x, y, length)
+                   for i, (t, x, y, length) in enumerate(segments))
+
+def write_lang(segments, lang_file_name):
+    with open(lang_file_name, 'w') as f:
+        f.write(to_lang(segments))
+
+def write_brep(segments, brep_file_name):
+    with tempfile.TemporaryDirectory() as tmp:
+        lang_file_name = os.path.join(tmp, 'workload.lang')
+        write_lang(segments, lang_file_name)
+        model = SimpleBrep()
+        model.execute_command_file(lang_file_name)
+        model.save_brep(brep_file_name)
+
+def unresolved_model(segments, **options):
+    # A model holding the segments as they are, before any crossing between
+    # them has been resolved.
+    model = SimpleBrep(**options)
+    def vertex(x, y):
+        name = model.index.vertex_at(x, y)
+        if name is None:
+            name = model.new_name()
+            model.add_vertex(name, x, y)
+        return name
+    for i, (t, x, y, length) in enumerate(segments):
+        x1, y1 = (x + length, y) if t == 'h' else (x, y + length)
+        model.add_line('a{}'.format(i), vertex(x, y), vertex(x1, y1), t, model.new_slot())
+    return model
+
+# Each operation is a setup, which is not timed, and a run timed on what the
+# setup returned. Files are those of the workload being measured.
+
+def setup_empty(files, options):
+    return SimpleBrep(**options)
+
+def setup_loaded(files, options):
+    model = SimpleBrep(**options)
+    model.load_brep(files['brep'])
+    return model
+
+def setup_pair(files, options):
+    compiled = SimpleBrep(**options)
+    compiled.execute_command_file(files['lang'])
+    return compiled, setup_loaded(files, options)
+
+OPERATIONS = {
+    'execute_command_file': (setup_empty, lambda m, files: m.execute_command_file(files['lang'])),
+    'load_brep': (setup_empty, lambda m, files: m.load_brep(files['brep'])),
+    'save_brep': (setup_loaded, lambda m, files: m.save_brep(files['out'])),
+    'check_brep': (setup_loaded, lambda m, files: m.check_brep()),
+    'resolve_cross_lines': (lambda files, options: unresolved_model(files['segments'], **options),
+                            lambda m, files: m.resolve_cross_lines()),
+    'same_model': (setup_pair, lambda pair, files: same_model(*pair)),
+}
+
+def measure(op, files, options, repeat, memory):
+    setup, run = OPERATIONS[op]
+    times = []
+    for _ in range(repeat):
+        target = setup(files, options)
+        start = time.perf_counter()
+        run(target, files)
+        times.append(time.perf_counter() - start)
+    peak = None
+    if memory:
+        # A separate run, as tracing allocations slows everything down.
+        target = setup(files, options)
+        tracemalloc.start()
+        try:
+            run(target, files)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return min(times), peak
+
+def fit_exponent(ns, times):
+    # The k of the best fit of time ~ c n^k, in log-log space. n is the number
+    # of segments of the workload, not its size parameter.
+    points = [(n, t) for n, t in zip(ns, times) if n > 0 and t > 0]
+    if len(set(n for n, _ in points)) < 2:
+        return None
+    slope, _ = np.polyfit(np.log([n for n, _ in points]), np.log([t for _, t in points]), 1)
+    return round(float(slope), 3)
+
+def predict_time(rows, n):
+    # Extrapolate the time at n from the rows measured so far, assuming linear
+    # growth until there are two of them.
+    exponent = fit_exponent([r['n'] for r in rows], [r['time'] for r in rows])
+    last = rows[-1]
+    return last['time'] * (float(n) / last['n']) ** (1.0 if exponent is None else exponent)
+
+def run_benchmarks(workloads, sizes, ops, options, repeat=3, memory=True, budget=5.0, log=None):
+    # Operations predicted to take more than budget seconds at a size are
+    # skipped from there on (the pairwise check_brep grows quickly).
+    results = []
+    tmp = tempfile.mkdtemp()
+    try:
+        for workload in workloads:
+            for size in sizes or DEFAULT_SIZES[workload]:
+                segments = WORKLOADS[workload](size)
+                files = {
+                    'segments': segments,
+                    'lang': os.path.join(tmp, 'workload.lang'),
+                    'brep': os.path.join(tmp, 'workload.brep'),
+                    'out': os.path.join(tmp, 'out.brep'),
+                }
+                write_lang(segments, files['lang'])
+                write_brep(segments, files['brep'])
+                for op in ops:
+                    rows = [r for r in results if r['workload'] == workload and r['op'] == op]
+                    if rows and predict_time(rows, len(segments)) > budget:
+                        if log:
+                            log('{:<14}{:>6}  {:<22}   skipped'.format(workload, size, op))
+                        continue
+                    seconds, peak = measure(op, files, options, repeat, memory)
+                    results.append({'workload': workload, 'size': size, 'n': len(segments),
+                                    'op': op, 'time': seconds, 'peak_memory': peak})
+                    if log:
+                        log('{:<14}{:>6}  {:<22}{:>10.4f}s{}'.format(
+                            workload, size, op, seconds,
+                            '' if peak is None else '{:>10.1f} KiB'.format(peak / 1024.0)))
+    finally:
+        shutil.rmtree(tmp)
+
+    fits = []
+    for workload in workloads:
+        for op in ops:
+            rows = [r for r in results if r['workload'] == workload and r['op'] == op]
+            fits.append({'workload': workload, 'op': op,
+                         'exponent': fit_exponent([r['n'] for r in rows], [r['time'] for r in rows])})
+    return {
+        'meta': {
+            'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'machine': platform.machine(),
+            'options': options,
+            'repeat': repeat,
+            'budget': budget,
+        },
+        'results': results,
+        'fits': fits,
+    }
+
+def compare(old, new, threshold=1.25, min_time=1e-3, exponent_slack=0.25):
+    """
+    Input two result dicts of run_benchmarks
+    Output a list of regressions found in new, as strings
+    """
+    regressions = []
+    old_times = dict(((r['workload'], r['size'], r['op']), r['time']) for r in old['results'])
+    for r in new['results']:
+        key = (r['workload'], r['size'], r['op'])
+        if key not in old_times:
+            continue
+        before, after = old_times[key], r['time']
+        # Ignore the noise of very fast operations.
+        if after > min_time and after > threshold * max(before, min_time):
+            regressions.append('{} {} {}: {:.4f}s -> {:.4f}s ({:.2f}x)'.format(
+                key[0], key[1], key[2], before, after, after / max(before, 1e-9)))
+    old_fits = dict(((f['workload'], f['op']), f['exponent']) for f in old['fits'])
+    for f in new['fits']:
+        before = old_fits.get((f['workload'], f['op']))
+        if before is not None and f['exponent'] is not None and f['exponent'] > before + exponent_slack:
+            regressions.append('{} {}: complexity n^{} -> n^{}'.format(
+                f['workload'], f['op'], before, f['exponent']))
+    return regressions
+
+# Start-up benchmarks: fresh interpreters running the entry points that short
+# jobs go through, whose time is mostly spent importing. None of them may
+# import the modules of HEAVY_MODULES (see model.py).
+HEAVY_MODULES = ['numpy', 'matplotlib']
+
+def startup_commands(lang_file_name):
+    # (op, interpreter arguments), run from the directory of model.py.
+    return [
+        ('python', ['-c', 'pass']),
+        ('import model', ['-c', 'import model']),
+        ('import play', ['-c', 'import play']),
+        ('compile', ['model.py', lang_file_name, '-j', '1']),
+    ]
+
+def imported_modules(args, cwd):
+    # The top-level packages a run imports, from python -X importtime.
+    result = subprocess.run([sys.executable, '-X', 'importtime'] + args, cwd=cwd,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, check=True)
+    modules = set()
+    for line in result.stderr.splitlines():
+        if line.startswith('import time:'):
+            modules.add(line.rsplit('|', 1)[-1].strip().split('.')[0])
+    return modules
+
+def run_startup(repeat=10, log=None):
+    # The best of repeat runs of each start-up command, as results that
+    # compare takes like those of run_benchmarks.
+    here = os.path.dirname(os.path.abspath(__file__))
+    results = []
+    tmp = tempfile.mkdtemp()
+    try:
+        lang_file_name = os.path.join(tmp, 'workload.lang')
+        write_lang(staircase(8), lang_file_name)
+        for op, args in startup_commands(lang_file_name):
+            times = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                subprocess.run([sys.executable] + args, cwd=here, stdout=subprocess.DEVNULL, check=True)
+                times.append(time.perf_counter() - start)
+            heavy = sorted(imported_modules(args, here).intersection(HEAVY_MODULES))
+            results.append({'workload': 'startup', 'size': 0, 'n': 1, 'op': op, 'time': min(times),
+                            'peak_memory': None, 'heavy_imports': heavy})
+            if log:
+                log('{:<14}{:>10.4f}s  {}'.format(op, min(times), ' '.join(heavy)))
+    finally:
+        shutil.rmtree(tmp)
+    return {
+        'meta': {
+            'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'repeat': repeat,
+        },
+        'results': results,
+        'fits': [],
+    }
+
+def write_results(results, output):
+    text = json.dumps(results, indent=1)
+    if output:
+        with open(output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Benchmark SimpleBrep on synthetic workloads.')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    p = commands.add_parser('generate', help='write a workload as a .lang or .brep file')
+    p.add_argument('workload', choices=sorted(WORKLOADS))
+    p.add_argument('size', type=int)
+    p.add_argument('file_name', help='ends with .lang or .brep')
+
+    p = commands.add_parser('run', help='time the operations and write the results as JSON')
+    p.add_argument('-o', '--output', help='JSON file to write (default: print)')
+    p.add_argument('--workloads', nargs='+', choices=sorted(WORKLOADS), default=sorted(WORKLOADS))
+    p.add_argument('--sizes', nargs='+', type=int, help='sizes for every workload')
+    p.add_argument('--ops', nargs='+', choices=sorted(OPERATIONS), default=sorted(OPERATIONS))
+    p.add_argument('--storage', choices=['dict', 'python', 'columnar'], default='dict')
+    p.add_argument('-j', '--jobs', type=int,
+                   help='run the operations over whole models on tiles, in this many processes')
+    p.add_argument('--repeat', type=int, default=3)
+    p.add_argument('--no-memory', action='store_true', help='do not measure peak memory')
+    p.add_argument('--budget', type=float, default=5.0,
+                   help='skip sizes predicted to take longer than this many seconds')
+
+    p = commands.add_parser('startup', help='time the start-up of short jobs and write the results as JSON')
+    p.add_argument('-o', '--output', help='JSON file to write (default: print)')
+    p.add_argument('--repeat', type=int, default=10)
+
+    p = commands.add_parser('compare', help='flag regressions between two result files')
+    p.add_argument('old')
+    p.add_argument('new')
+    p.add_argument('--threshold', type=float, default=1.25,
+                   help='slowdown ratio flagged as a regression')
+
+    args = parser.parse_args(argv)
+    if args.command == 'generate':
+        segments = WORKLOADS[args.workload](args.size)
+        if args.file_name.endswith('.brep'):
+            write_brep(segments, args.file_name)
+        else:
+            write_lang(segments, args.file_name)
+    elif args.command == 'run':
+        log = lambda line: print(line, file=sys.stderr)
+        results = run_benchmarks(args.workloads, args.sizes, args.ops, {'storage': args.storage, 'jobs': args.jobs},
+                                 args.repeat, not args.no_memory, args.budget, log)
+        write_results(results, args.output)
+    elif args.command == 'startup':
+        log = lambda line: print(line, file=sys.stderr)
+        results = run_startup(args.repeat, log)
+        write_results(results, args.output)
+        # Compare the times with an earlier run; the imports are checked here.
+        heavy = [r for r in results['results'] if r['heavy_imports']]
+        for r in heavy:
+            print('REGRESSION {} imports {}'.format(r['op'], ', '.join(r['heavy_imports'])), file=sys.stderr)
+        return 1 if heavy else 0
+    else:
+        with open(args.old) as f:
+            old = json.load(f)
+        with open(args.new) as f:
+            new = json.load(f)
+        regressions = compare(old, new, args.threshold)
+        for line in regressions:
+            print('REGRESSION', line)
+        print('{} regression(s)'.format(len(regressions)))
+        return 1 if regressions else 0
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
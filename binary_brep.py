@@ -0,0 +1,127 @@
+import os
+import mmap
+import zlib
+import struct
+import numpy as np
+
+# A binary companion to the text .brep format, written by
+# SimpleBrep.save_brep_binary and read by SimpleBrep.load_brep_binary. All
+# numbers are little-endian:
+#
+#   header      magic, version, flags, number of vertices nv, number of lines
+#               nl, number of arcs na, size of the name table in bytes, and
+#               the CRC-32 of everything after the header
+#   coords      nv x 2 float64, the (x, y) of each vertex
+#   arcs        na x 5 float64, the (cx, cy, r, start, end) of each arc
+#   ends        nl x 2 int32, the vertex rows of the endpoints of each line
+#   types       nl int32, the type code of each line (see storage.TYPE_CODES)
+#   arc ends    na x 2 int32, the vertex rows of the endpoints of each arc
+#   names       utf-8, the vertex names, the line names and then the arc names,
+#               separated by newlines (names never contain whitespace)
+#
+# Vertices, lines and arcs are in the same order as in the text format, so
+# converting between the two keeps the files equivalent. The blocks are
+# 8-byte (float64) or 4-byte (int32) aligned, and read_brep_binary maps them
+# instead of reading them. Version 1 files have no arcs, and no na in their
+# header; version 2 files have no checksum and no flags.
+#
+# The CHECKED flag says that the file was saved from a model known to be valid,
+# so loading it can skip check_brep (when the checksum still matches).
+
+MAGIC = b'BREPBIN\0'
+VERSION = 3
+HEADER = struct.Struct('<8sIIqqqqq')
+HEADER_V2 = struct.Struct('<8sIIqqqq')
+HEADER_V1 = struct.Struct('<8sIIqqq')
+CHECKED = 1
+COORD_TYPE = np.dtype('<f8')
+INDEX_TYPE = np.dtype('<i4')
+
+def write_brep_binary(brep_file_name, vertex_names, xy, line_names, ends, types,
+                      arc_names=(), arc_ends=(), arcs=(), checked=False):
+    """
+    vertex_names: n names, xy: n x 2 coordinates
+    line_names: m names, ends: m x 2 vertex rows, types: m type codes
+    arc_names: k names, arc_ends: k x 2 vertex rows, arcs: k x 5 arcs
+    checked: whether this is a valid model, with normalized lines
+    """
+    names = '\n'.join(list(vertex_names) + list(line_names) + list(arc_names)).encode('utf-8')
+    xy = np.ascontiguousarray(xy, dtype=COORD_TYPE).reshape(-1, 2)
+    ends = np.ascontiguousarray(ends, dtype=INDEX_TYPE).reshape(-1, 2)
+    types = np.ascontiguousarray(types, dtype=INDEX_TYPE).reshape(-1)
+    arc_ends = np.ascontiguousarray(arc_ends, dtype=INDEX_TYPE).reshape(-1, 2)
+    arcs = np.ascontiguousarray(arcs, dtype=COORD_TYPE).reshape(-1, 5)
+    assert len(xy) == len(vertex_names) and len(ends) == len(types) == len(line_names)
+    assert len(arc_ends) == len(arcs) == len(arc_names)
+    # Models may still map the file being replaced, and truncating a mapped
+    # file makes their next access fail, so write a new file and rename it.
+    temp_name = brep_file_name + '.tmp'
+    blocks = [xy.tobytes(), arcs.tobytes(), ends.tobytes(), types.tobytes(), arc_ends.tobytes(), names]
+    checksum = 0
+    for block in blocks:
+        checksum = zlib.crc32(block, checksum)
+    flags = CHECKED if checked else 0
+    with open(temp_name, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, flags, len(xy), len(ends), len(arcs), len(names), checksum))
+        for block in blocks:
+            f.write(block)
+    os.replace(temp_name, brep_file_name)
+
+def read_brep_binary(brep_file_name):
+    """
+    Input a binary .brep file
+    Output (vertex names, n x 2 coordinates, line names, m x 2 endpoint rows,
+    m type codes, arc names, k x 2 endpoint rows, k x 5 arcs, checked). The
+    arrays are copy-on-write views of the mapped file: they can be modified,
+    but the file never is. checked tells whether the file has the CHECKED flag
+    and an intact checksum.
+    Raise ValueError if the file is not a valid binary .brep file
+    """
+    with open(brep_file_name, 'rb') as f:
+        if len(f.read(HEADER_V1.size)) < HEADER_V1.size:
+            raise ValueError('truncated header')
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+    magic, version = HEADER_V1.unpack_from(data)[:2]
+    if magic != MAGIC:
+        raise ValueError('not a binary .brep file')
+    if version > VERSION:
+        raise ValueError('unsupported version: {}'.format(version))
+    flags, checksum = 0, None
+    if version == 1:
+        _, _, _, nv, nl, names_size = HEADER_V1.unpack_from(data)
+        na, offset = 0, HEADER_V1.size
+    elif version == 2:
+        if len(data) < HEADER_V2.size:
+            raise ValueError('truncated header')
+        _, _, _, nv, nl, na, names_size = HEADER_V2.unpack_from(data)
+        offset = HEADER_V2.size
+    else:
+        if len(data) < HEADER.size:
+            raise ValueError('truncated header')
+        _, _, flags, nv, nl, na, names_size, checksum = HEADER.unpack_from(data)
+        offset = HEADER.size
+    if min(nv, nl, na, names_size) < 0:
+        raise ValueError('invalid header')
+    size = offset + 16 * nv + 40 * na + 12 * nl + 8 * na + names_size
+    if len(data) != size:
+        raise ValueError('expected {} bytes, found {}'.format(size, len(data)))
+    checked = bool(flags & CHECKED) and zlib.crc32(memoryview(data)[offset:]) == checksum
+
+    xy = np.frombuffer(data, COORD_TYPE, 2 * nv, offset).reshape(nv, 2)
+    offset += 16 * nv
+    arcs = np.frombuffer(data, COORD_TYPE, 5 * na, offset).reshape(na, 5)
+    offset += 40 * na
+    ends = np.frombuffer(data, INDEX_TYPE, 2 * nl, offset).reshape(nl, 2)
+    offset += 8 * nl
+    types = np.frombuffer(data, INDEX_TYPE, nl, offset)
+    offset += 4 * nl
+    arc_ends = np.frombuffer(data, INDEX_TYPE, 2 * na, offset).reshape(na, 2)
+    offset += 8 * na
+    names = data[offset:].decode('utf-8').split('\n') if nv + nl + na else []
+    if len(names) != nv + nl + na:
+        raise ValueError('expected {} names, found {}'.format(nv + nl + na, len(names)))
+    if nl and (ends.min() < 0 or ends.max() >= nv or types.min() < 0 or types.max() > 2):
+        raise ValueError('invalid line')
+    if na and (arc_ends.min() < 0 or arc_ends.max() >= nv):
+        raise ValueError('invalid arc')
+    return names[:nv], xy, names[nv:nv + nl], ends, types, names[nv + nl:], arc_ends, arcs, checked
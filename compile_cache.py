@@ -0,0 +1,193 @@
+import os
+import time
+import pickle
+import hashlib
+from collections import OrderedDict
+
+# Incremental recompilation of .lang files.
+#
+# Compiling a program through a CompileCache checkpoints the model every
+# interval commands. A checkpoint is keyed by a hash chained over the commands
+# before it, so it only matches programs starting with exactly those commands.
+# Recompiling an edited program resumes from the checkpoint of its longest
+# unchanged prefix, and only executes the commands after it.
+#
+# A checkpoint is not a copy of the model but what changed since the previous
+# one: the undo logs of the transactions in between (see
+# SimpleBrep.enable_history). Taking one costs as much as the commands it
+# covers, and resuming replays the logs of all the checkpoints before, which is
+# much cheaper than executing their commands again.
+#
+# Checkpoints are kept in memory, and with a directory also on disk, each
+# bounded in bytes with the least recently used checkpoints evicted first. A
+# checkpoint is useless without the ones before it, so each compile marks the
+# checkpoints of its program as used from the last one to the first.
+# Checkpoints on disk are pickles: only use directories nobody else writes to.
+
+# Part of every key: change it whenever the model state changes meaning.
+CACHE_VERSION = 1
+
+class CompileCache(object):
+    def __init__(self, interval=1024, max_bytes=256 << 20, directory=None, max_disk_bytes=1 << 30):
+        self.interval = interval
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.max_disk_bytes = max_disk_bytes
+        # Key -> pickled checkpoint, least recently used first.
+        self.memory = OrderedDict()
+        self.memory_bytes = 0
+        # The number of commands skipped by the last compile, and totals.
+        self.resumed = 0
+        self.hits = 0
+        self.misses = 0
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    def prefix_keys(self, program, model):
+        # (k, key of the first k commands) for every multiple k of interval.
+        h = hashlib.sha1('{} {} {} {}'.format(CACHE_VERSION, model.storage, model.reserve_prefix,
+                                              model.resolution).encode('utf-8'))
+        keys = []
+        for i, command in enumerate(program.commands):
+            h.update(command.to_lang().encode('utf-8') + b'\n')
+            if (i + 1) % self.interval == 0:
+                keys.append((i + 1, h.hexdigest()))
+        return keys
+
+    def compile(self, program, model, batch=True):
+        """
+        Input a Program and an empty SimpleBrep
+        Execute the program on the model, resuming from the longest prefix of
+        it that was checkpointed. Each interval is executed as a transaction
+        (or each command, without batch) and checkpointed in turn; as commands
+        can never make an invalid model valid again, this fails exactly when
+        executing the whole program at once does
+        """
+        assert not model.vertices and not model.lines and not model.arcs, 'the model must be empty'
+        keys = self.prefix_keys(program, model)
+        # Checkpoint k needs all the ones before it.
+        deltas = []
+        for k, key in keys:
+            delta = self.get(key)
+            if delta is None:
+                break
+            deltas.append(pickle.loads(delta))
+        start = len(deltas) * self.interval
+        for log, (next_slot, name_counter) in deltas:
+            model.replay(log)
+        if deltas:
+            model.next_slot, model.name_counter = next_slot, name_counter
+            model.touched_vertices, model.touched_lines, model.touched_arcs = set(), set(), set()
+        self.resumed = start
+        if start:
+            self.hits += 1
+        else:
+            self.misses += 1
+
+        history, redo_history = model.history, model.redo_history
+        model.enable_history()
+        try:
+            commands = program.commands
+            for k, key in keys[len(deltas):] + [(len(commands), None)]:
+                if start >= k:
+                    continue
+                if batch:
+                    with model.transaction():
+                        for i in range(start, k):
+                            model.execute_command(commands[i], program.source(i))
+                else:
+                    for i in range(start, k):
+                        with model.transaction():
+                            model.execute_command(commands[i], program.source(i))
+                if key is not None:
+                    log = [entry for transaction in model.history for entry in transaction[0]]
+                    delta = (log, (model.next_slot, model.name_counter))
+                    self.put(key, pickle.dumps(delta, pickle.HIGHEST_PROTOCOL))
+                model.history = []
+                start = k
+        finally:
+            model.history, model.redo_history = history, redo_history
+            self.touch([key for _, key in keys])
+        return model
+
+    def touch(self, keys):
+        # Mark the checkpoints as used, the first one most recently.
+        now = time.time()
+        for i, key in enumerate(reversed(keys)):
+            if key in self.memory:
+                self.memory.move_to_end(key)
+            if self.directory is not None:
+                t = now - 1e-3 * (len(keys) - 1 - i)
+                try:
+                    os.utime(self.path(key), (t, t))
+                except OSError:
+                    pass
+
+    def get(self, key):
+        delta = self.memory.get(key)
+        if delta is not None:
+            self.memory.move_to_end(key)
+            return delta
+        if self.directory is None:
+            return None
+        try:
+            with open(self.path(key), 'rb') as f:
+                delta = f.read()
+        except OSError:
+            return None
+        self.remember(key, delta)
+        return delta
+
+    def put(self, key, delta):
+        self.remember(key, delta)
+        if self.directory is not None:
+            # Write a new file and rename it, so that readers never see part of
+            # a checkpoint.
+            path = self.path(key)
+            temp_name = '{}.{}.tmp'.format(path, os.getpid())
+            with open(temp_name, 'wb') as f:
+                f.write(delta)
+            os.replace(temp_name, path)
+            self.evict_disk()
+
+    def remember(self, key, delta):
+        if key in self.memory:
+            self.memory_bytes -= len(self.memory.pop(key))
+        self.memory[key] = delta
+        self.memory_bytes += len(delta)
+        while self.memory_bytes > self.max_bytes and self.memory:
+            _, evicted = self.memory.popitem(last=False)
+            self.memory_bytes -= len(evicted)
+
+    def path(self, key):
+        return os.path.join(self.directory, key + '.ckpt')
+
+    def evict_disk(self):
+        # Remove the least recently used checkpoints until the rest fit.
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith('.ckpt'):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+    def clear(self):
+        self.memory.clear()
+        self.memory_bytes = 0
+        if self.directory is not None:
+            for name in os.listdir(self.directory):
+                if name.endswith('.ckpt'):
+                    os.remove(os.path.join(self.directory, name))
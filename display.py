@@ -1,23 +1,171 @@
-import matplotlib.pyplot as plt
-import os
-import sys
+import argparse
 import numpy as np
 from model import SimpleBrep
+from arc_geometry import arc_polyline
 
-def display_brep(model):
-    vertices = model.vertices
-    lines = model.lines
-    for _, (x, y) in vertices.items():
-        plt.plot(x, y, 'bo')
-    for _, (v0, v1, t) in lines.items():
-        x0, y0 = vertices[v0]
-        x1, y1 = vertices[v1]
-        color = 'r' if t == 'v' else 'g'
-        plt.plot([x0, x1], [y0, y1], color)
-    plt.title('red: vertical lines; green: horizontal lines; blue: vertices')
+# matplotlib is only imported by display_brep, so that the helpers below can
+# be used (e.g. by play.py) without paying for it until something is drawn.
+
+# Colors of the vertices, of the horizontal and vertical lines, and of arcs.
+VERTEX_COLOR = 'b'
+LINE_COLORS = {'h': 'g', 'v': 'r'}
+ARC_COLOR = 'k'
+
+def model_geometry(model):
+    """
+    Input a SimpleBrep
+    Output the vertex coordinates as an n x 2 array, and a dict from line type
+    to the segments of the lines of that type as an m x 2 x 2 array
+    """
+    xy = model.coordinates()
+    rows = dict(zip(model.vertices, range(len(xy))))
+    ends = np.array([(rows[v0], rows[v1]) for v0, v1, _ in model.lines.values()], dtype=np.int64).reshape(-1, 2)
+    types = np.array([t for _, _, t in model.lines.values()], dtype='U1')
+    return xy, dict((t, xy[ends[types == t]]) for t in LINE_COLORS)
+
+def model_arcs(model):
+    # The arcs of the model as polylines (k x 2 arrays), drawn together by one
+    # LineCollection.
+    return [np.array(arc_polyline(arc)) for _, _, arc in model.arcs.values()]
+
+def visible_arcs(arcs, view, size):
+    # The level of detail of the arcs: those meeting the view and larger than
+    # a pixel. Smaller ones are where their vertices are drawn anyway.
+    vx0, vx1, vy0, vy1 = view
+    px = (vx1 - vx0) / max(size[0], 1.0)
+    py = (vy1 - vy0) / max(size[1], 1.0)
+    shown = []
+    for path in arcs:
+        (x0, y0), (x1, y1) = path.min(axis=0), path.max(axis=0)
+        if x1 < vx0 or x0 > vx1 or y1 < vy0 or y0 > vy1:
+            continue
+        if x1 - x0 < px and y1 - y0 < py:
+            continue
+        shown.append(path)
+    return shown
+
+def set_view(ax, xy):
+    # Fit the view to the points, with a margin.
+    if not len(xy):
+        return
+    lo, hi = xy.min(axis=0), xy.max(axis=0)
+    margin = np.maximum((hi - lo) * 0.05, 0.5)
+    ax.set_xlim(lo[0] - margin[0], hi[0] + margin[0])
+    ax.set_ylim(lo[1] - margin[1], hi[1] + margin[1])
+
+# Level of detail: models with more vertices and lines than this are drawn
+# simplified to what the screen can show (see level_of_detail), unless
+# display_brep is told otherwise.
+LOD_THRESHOLD = 20000
+# At most one vertex marker is drawn per square cell of this many pixels.
+MARKER_CELL = 4
+
+def merge_runs(fixed, start, end):
+    # fixed, start, end: integer pixel coordinates of segments along rows.
+    # Merge the segments of each row that touch or overlap into runs.
+    if not len(fixed):
+        return fixed, start, end
+    order = np.lexsort((start, fixed))
+    fixed, start, end = fixed[order], start[order], end[order]
+    # The furthest end so far within each row: rows are sorted, so offsetting
+    # each row above the previous ones makes one running maximum do.
+    offset = (fixed - fixed[0]) * (end.max() - start.min() + 2)
+    reach = np.maximum.accumulate(end + offset) - offset
+    new_run = np.ones(len(fixed), dtype=bool)
+    new_run[1:] = (fixed[1:] != fixed[:-1]) | (start[1:] > reach[:-1])
+    starts = np.flatnonzero(new_run)
+    return fixed[starts], start[starts], np.maximum.reduceat(end, starts)
+
+def level_of_detail(xy, segments, view, size):
+    """
+    Input the output of model_geometry, the view (x0, x1, y0, y1), and its size
+    in pixels (width, height)
+    Output the same, restricted to the view and simplified to its pixels: the
+    segments are snapped to the pixel grid and merged into runs, so pieces
+    smaller than a pixel disappear into the runs they belong to, and at most
+    one vertex is kept per MARKER_CELL pixels
+    """
+    vx0, vx1, vy0, vy1 = view
+    px = (vx1 - vx0) / max(size[0], 1.0)
+    py = (vy1 - vy0) / max(size[1], 1.0)
+
+    x, y = xy[:, 0], xy[:, 1]
+    inside = (x >= vx0) & (x <= vx1) & (y >= vy0) & (y <= vy1)
+    cells = np.floor((xy[inside] - (vx0, vy0)) / (px * MARKER_CELL, py * MARKER_CELL)).astype(np.int64)
+    _, keep = np.unique(cells, axis=0, return_index=True)
+    thinned = xy[inside][np.sort(keep)]
+
+    simplified = {}
+    for t, seg in segments.items():
+        # Work along rows: (fixed, start, end) with start <= end.
+        fixed_idx = 1 if t == 'h' else 0
+        fixed, start, end = seg[:, 0, fixed_idx], seg[:, 0, 1 - fixed_idx], seg[:, 1, 1 - fixed_idx]
+        lo, hi = (vy0, vy1) if t == 'h' else (vx0, vx1)
+        along_lo, along_hi = (vx0, vx1) if t == 'h' else (vy0, vy1)
+        p, q = (py, px) if t == 'h' else (px, py)
+        sel = (fixed >= lo) & (fixed <= hi) & (end >= along_lo) & (start <= along_hi)
+        rows = np.round((fixed[sel] - lo) / p).astype(np.int64)
+        n = int(size[0 if t == 'h' else 1]) + 1
+        a = np.clip(np.floor((start[sel] - along_lo) / q), -1, n).astype(np.int64)
+        b = np.clip(np.ceil((end[sel] - along_lo) / q), -1, n).astype(np.int64)
+        rows, a, b = merge_runs(rows, a, b)
+        fixed = lo + rows * p
+        start, end = along_lo + a * q, along_lo + b * q
+        if t == 'h':
+            simplified[t] = np.stack([np.stack([start, fixed], 1), np.stack([end, fixed], 1)], 1)
+        else:
+            simplified[t] = np.stack([np.stack([fixed, start], 1), np.stack([fixed, end], 1)], 1)
+    return thinned, simplified
+
+def display_brep(model, lod=None):
+    # Draw the model with one scatter for the vertices, one LineCollection per
+    # line type and one for all the arcs. With lod (the default for models larger than
+    # LOD_THRESHOLD), only what the view can show is drawn, and it is
+    # recomputed when the view is zoomed or panned.
+    import matplotlib.pyplot as plt
+    from matplotlib.collections import LineCollection
+    xy, segments = model_geometry(model)
+    arcs = model_arcs(model)
+    if lod is None:
+        lod = len(xy) + sum(len(s) for s in segments.values()) + len(arcs) > LOD_THRESHOLD
+    fig, ax = plt.subplots()
+    scatter = ax.scatter([], [], c=VERTEX_COLOR, zorder=2)
+    collections = {}
+    for t, color in LINE_COLORS.items():
+        collections[t] = LineCollection([], colors=color)
+        ax.add_collection(collections[t])
+    arc_collection = LineCollection([], colors=ARC_COLOR)
+    ax.add_collection(arc_collection)
+
+    def draw(*args):
+        if lod:
+            view = ax.get_xlim() + ax.get_ylim()
+            size = (ax.bbox.width, ax.bbox.height)
+            shown_xy, shown_segments = level_of_detail(xy, segments, view, size)
+            shown_arcs = visible_arcs(arcs, view, size)
+        else:
+            shown_xy, shown_segments, shown_arcs = xy, segments, arcs
+        scatter.set_offsets(shown_xy)
+        for t in LINE_COLORS:
+            collections[t].set_segments(shown_segments[t])
+        arc_collection.set_segments(shown_arcs)
+
+    set_view(ax, np.concatenate([xy] + arcs) if arcs else xy)
+    draw()
+    if lod:
+        ax.callbacks.connect('xlim_changed', draw)
+        ax.callbacks.connect('ylim_changed', draw)
+    plt.title('red: vertical lines; green: horizontal lines; black: arcs; blue: vertices')
     plt.show()
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Display a .brep file.')
+    parser.add_argument('brep_file_name')
+    parser.add_argument('--lod', dest='lod', action='store_true', default=None,
+                        help='draw a simplified model (default for large models)')
+    parser.add_argument('--no-lod', dest='lod', action='store_false',
+                        help='draw every vertex and line')
+    args = parser.parse_args()
     model = SimpleBrep()
-    model.load_brep(sys.argv[1])
-    display_brep(model)
+    model.load_brep(args.brep_file_name)
+    display_brep(model, args.lod)
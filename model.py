@@ -1,11 +1,29 @@
 import sys
 import os
-import numpy as np
+import argparse
+import re
+import glob
+import time
+import math
+from contextlib import contextmanager
+from functools import lru_cache
+from spatial_index import SpatialIndex
+from sweep import find_crossings
+from profiler import Profiler
+from arc_geometry import (tolerance, point_tolerance, angle_margin, normalize_arc, arc_endpoints, arc_angle,
+                          arc_box, arc_contains, line_crossings, arc_crossings, arcs_overlap)
+
+# NumPy (and the columnar storage and binary format built on it) is only
+# imported by the functions that need it, as is compile_cache.py. With
+# storage='python', compiling a .lang file into a .brep file never imports
+# NumPy, which would take most of the start-up time of short runs.
 
 class TaoExcept(Exception):
     pass
 
-np_type = np.float64
+# With a resolution, coordinates are integers of at most this magnitude, so
+# that they convert to float64 and back exactly.
+QUANTIZED_LIMIT = 1 << 53
 
 def is_number(value):
     try:
@@ -19,7 +37,203 @@ def is_valid_name(value):
         if not ('0' <= c <= '9' or 'a' <= c <= 'z' or 'A' <= c <= 'Z'): return False
     return True
 
+def is_generated_name(value):
+    # Names like n0, n1, ... are generated by the modeling language.
+    return len(value) > 1 and value[0] == 'n' and all('0' <= c <= '9' for c in value[1:])
+
+def parse_value(token):
+    # A number, or the name of the vertex or line to take it from.
+    try:
+        return float(token)
+    except ValueError:
+        return token
+
+class VertexCommand(object):
+    # <name> <x> <y>. x and y are floats, or the names of the vertices or lines
+    # (or <line>_<left|right|top|bottom> endpoints) to take them from.
+    __slots__ = ('name', 'x', 'y')
+
+    def __init__(self, name, x, y):
+        self.name = name
+        self.x = x
+        self.y = y
+
+    @property
+    def form(self):
+        # The play.py form: v0 (x y), v1 (ref ref), v2 (x ref) or v3 (ref y).
+        x_num, y_num = isinstance(self.x, float), isinstance(self.y, float)
+        if x_num and y_num: return 'v0'
+        if not x_num and not y_num: return 'v1'
+        return 'v2' if x_num else 'v3'
+
+    def to_lang(self):
+        return '{} {} {}'.format(self.name, self.x, self.y)
+
+    def to_play(self):
+        return '{} {}'.format(self.form, self.to_lang())
+
+class LineCommand(object):
+    # <name> <v|h> start <start> end <end>. start is an (x, y) tuple of floats
+    # or the name of a vertex (or line endpoint); end is a float length, or the
+    # name of a vertex, line endpoint or line.
+    __slots__ = ('name', 'type', 'start', 'end')
+
+    def __init__(self, name, type, start, end):
+        self.name = name
+        self.type = type
+        self.start = start
+        self.end = end
+
+    @property
+    def form(self):
+        # The play.py form: l0 (x y length), l1 (vertex ref), l2 (x y ref) or
+        # l3 (vertex length).
+        start_num, end_num = isinstance(self.start, tuple), isinstance(self.end, float)
+        if start_num and end_num: return 'l0'
+        if not start_num and not end_num: return 'l1'
+        return 'l2' if start_num else 'l3'
+
+    def start_text(self):
+        if isinstance(self.start, tuple):
+            return '{} {}'.format(*self.start)
+        return self.start
+
+    def to_lang(self):
+        return '{} {} start {} end {}'.format(self.name, self.type, self.start_text(), self.end)
+
+    def to_play(self):
+        return '{} {} {} {} {}'.format(self.form, self.name, self.type, self.start_text(), self.end)
+
+class ArcCommand(object):
+    # <name> a <x> <y> <r> start <theta_start> end <theta_end>: the arc of the
+    # circle of center (x, y) and radius r going counterclockwise from
+    # theta_start to theta_end, in degrees. All of them are floats.
+    __slots__ = ('name', 'x', 'y', 'r', 'start', 'end')
+
+    # The play.py form: a0 <name> <x> <y> <r> <theta_start> <theta_end>.
+    form = 'a0'
+
+    def __init__(self, name, x, y, r, start, end):
+        self.name = name
+        self.x = x
+        self.y = y
+        self.r = r
+        self.start = start
+        self.end = end
+
+    def to_lang(self):
+        return '{} a {} {} {} start {} end {}'.format(self.name, self.x, self.y, self.r, self.start, self.end)
+
+    def to_play(self):
+        return '{} {} {} {} {} {} {}'.format(self.form, self.name, self.x, self.y, self.r, self.start, self.end)
+
+VERTEX_FORMS = ['v0', 'v1', 'v2', 'v3']
+LINE_FORMS = ['l0', 'l1', 'l2', 'l3']
+
+@lru_cache(maxsize=1 << 16)
+def parse_command_text(command):
+    # Memoized by the command text; the returned nodes must not be modified.
+    tokens = command.split()
+    if len(tokens) == 3:
+        # <name> <x> <y>
+        return VertexCommand(tokens[0], parse_value(tokens[1]), parse_value(tokens[2]))
+    if len(tokens) in [6, 7] and tokens[2] == 'start':
+        # <name> <v|h> start <start> end <end>
+        if tokens[-2] != 'end':
+            #print('invalid token. expect to see end:', tokens[-2])
+            raise TaoExcept()
+        return parse_line(tokens[0], tokens[1], tokens[3:-2], tokens[-1])
+    if len(tokens) == 9 and tokens[1] == 'a':
+        # <name> a <x> <y> <r> start <theta_start> end <theta_end>
+        if tokens[5] != 'start' or tokens[7] != 'end':
+            #print('invalid arc syntax:', command)
+            raise TaoExcept()
+        return parse_arc(tokens[0], tokens[2:5] + [tokens[6], tokens[8]])
+    if len(tokens) == 7 and tokens[0] == ArcCommand.form:
+        # a0 <name> <x> <y> <r> <theta_start> <theta_end>
+        return parse_arc(tokens[1], tokens[2:])
+    if len(tokens) == 4 and tokens[0] in VERTEX_FORMS:
+        # v<k> <name> <x> <y>
+        return VertexCommand(tokens[1], parse_value(tokens[2]), parse_value(tokens[3]))
+    if len(tokens) in [5, 6] and tokens[0] in LINE_FORMS:
+        # l<k> <name> <v|h> <start> <end>
+        return parse_line(tokens[1], tokens[2], tokens[3:-1], tokens[-1])
+    #print('invalid command:', command)
+    raise TaoExcept()
+
+def parse_line(name, t, start, end):
+    if t not in ['v', 'h']:
+        #print('invalid line type:', t)
+        raise TaoExcept()
+    start = [parse_value(token) for token in start]
+    if len(start) == 2 and isinstance(start[0], float) and isinstance(start[1], float):
+        start = tuple(start)
+    elif len(start) == 1 and not isinstance(start[0], float):
+        start = start[0]
+    else:
+        #print('invalid start point:', start)
+        raise TaoExcept()
+    return LineCommand(name, t, start, parse_value(end))
+
+def parse_arc(name, values):
+    if not all(is_number(token) for token in values):
+        #print('invalid arc values:', values)
+        raise TaoExcept()
+    return ArcCommand(name, *[float(token) for token in values])
+
+class Program(object):
+    # A parsed command file. It can be executed against any number of models
+    # without parsing it again. sources holds the (line number, text) each
+    # command was parsed from, for the profiler's trace.
+    def __init__(self, commands, sources=None):
+        self.commands = commands
+        self.sources = sources
+
+    @staticmethod
+    def from_lines(lines):
+        commands = []
+        sources = []
+        for number, line in enumerate(lines, 1):
+            line = line.strip()
+            text = line
+
+            # Ignore comments.
+            if '#' in line:
+                line = line[:line.find('#')].strip()
+
+            # Ignore empty lines.
+            if not line: continue
+            commands.append(parse_command_text(line))
+            sources.append((number, text))
+        return Program(commands, sources)
+
+    @staticmethod
+    def from_file(command_file_name):
+        with open(command_file_name, 'r') as f:
+            return Program.from_lines(f)
+
+    def source(self, i):
+        return self.sources[i] if self.sources is not None else None
+
+    def execute(self, model, batch=True):
+        # In batch mode the program is one transaction: it is validated once at
+        # the end, and the model is left untouched if any command fails.
+        if batch:
+            with model.transaction():
+                self.execute(model, batch=False)
+            return
+        for i, command in enumerate(self.commands):
+            model.execute_command(command, self.source(i))
+
 def same_model(model1, model2):
+    # Models are compared through their cached canonical forms, so comparing
+    # many models against the same target only builds its form once.
+    if model1.fingerprint() != model2.fingerprint():
+        return False
+    return model1.canonical_form() == model2.canonical_form()
+
+def same_model_pairwise(model1, model2):
+    # Reference implementation of same_model.
     # First, check if they have the same set of vertices.
     v2_names = set([v for v in model2.vertices])
     v1to2 = {}
@@ -47,25 +261,340 @@ def same_model(model1, model2):
                 l2_names.remove(l2)
                 break
         if not found: return False
-    return not l2_names
+    if l2_names: return False
+    # Finally, the arcs: same endpoints, in the same direction, on the same circle.
+    a2_names = set(model2.arcs)
+    for a1, (s1, e1, arc1) in model1.arcs.items():
+        s1 = v1to2[s1]
+        e1 = v1to2[e1]
+        found = False
+        for a2 in a2_names:
+            s2, e2, arc2 = model2.arcs[a2]
+            if s1 == s2 and e1 == e2 and arc1[:3] == arc2[:3]:
+                found = True
+                a2_names.remove(a2)
+                break
+        if not found: return False
+    return not a2_names
+
+# Records are written in chunks of this many lines.
+WRITE_CHUNK = 1 << 16
+
+def write_records(f, records, template='%s %s %s\n'):
+    # One "a b c" line per record. Floats are written as str(float), which is
+    # also what formatting the float64 coordinates would give.
+    for i in range(0, len(records), WRITE_CHUNK):
+        f.write(''.join([template % r for r in records[i:i + WRITE_CHUNK]]))
+
+# An arc record: name, start and end vertex, and the five numbers of the arc.
+ARC_TEMPLATE = '%s %s %s %s %s %s %s %s\n'
+
+def parse_arc_record(tokens):
+    # (name, start vertex, end vertex, arc) of an arc record.
+    if not all(is_number(token) for token in tokens[3:]):
+        #print('invalid arc:', ' '.join(tokens))
+        raise TaoExcept()
+    arc = tuple(float(token) for token in tokens[3:])
+    if normalize_arc(*arc) != arc:
+        #print('invalid arc:', ' '.join(tokens))
+        raise TaoExcept()
+    return (tokens[0], tokens[1], tokens[2], arc)
+
+def maybe_number(token):
+    # False only if float(token) must fail. Valid names are ascii letters and
+    # digits, so this is cheap for the names that are not numbers.
+    c = token[0]
+    if c in '0123456789+-.' or not c.isascii():
+        return True
+    return c in 'iInN' and token.lower() in ('inf', 'infinity', 'nan')
+
+def read_brep_records(brep_file_name, as_array=True):
+    """
+    Input a .brep file
+    Output (vertex names, coordinates, line names, line endpoint name pairs,
+    arcs as (name, start vertex, end vertex, arc)), in file order. The
+    coordinates are an (n, 2) float64 array, or without as_array a list of
+    (x, y) float pairs
+    """
+    with open(brep_file_name, 'r') as f:
+        text = f.read()
+    # Ignore comments and empty lines.
+    if '#' in text:
+        text = re.sub('#[^\n]*', '', text)
+    records = [tokens for tokens in map(str.split, text.split('\n')) if tokens]
+    arcs = [parse_arc_record(tokens) for tokens in records if len(tokens) == 8]
+    if arcs:
+        records = [tokens for tokens in records if len(tokens) != 8]
+    if all(len(tokens) == 3 for tokens in records):
+        is_vertex = [maybe_number(tokens[1]) for tokens in records]
+        vertex_records = [r for r, v in zip(records, is_vertex) if v]
+        try:
+            if as_array:
+                # All coordinates in one conversion.
+                import numpy as np
+                xy = np.array([r[1:] for r in vertex_records], dtype=np.float64).reshape(-1, 2)
+            else:
+                xy = [(float(r[1]), float(r[2])) for r in vertex_records]
+        except ValueError:
+            pass
+        else:
+            line_records = [r for r, v in zip(records, is_vertex) if not v]
+            return ([r[0] for r in vertex_records], xy,
+                    [r[0] for r in line_records], [r[1:] for r in line_records], arcs)
+
+    # Something is off: go through the records one by one to fail on the first
+    # bad one (or to classify the names that look like numbers).
+    vertex_names, coords, line_names, ends = [], [], [], []
+    for tokens in records:
+        # Ignore invalid number of tokens.
+        if len(tokens) != 3:
+            #print('invalid syntax:', ' '.join(tokens))
+            raise TaoExcept()
+
+        # Check if it is a vertex or a line.
+        if is_number(tokens[1]):
+            vertex_names.append(tokens[0])
+            coords.append((float(tokens[1]), float(tokens[2])))
+        else:
+            line_names.append(tokens[0])
+            ends.append(tokens[1:])
+    if as_array:
+        import numpy as np
+        coords = np.array(coords, dtype=np.float64).reshape(-1, 2)
+    return vertex_names, coords, line_names, ends, arcs
+
+def brep_text_to_binary(text_file_name, binary_file_name):
+    # Convert a .brep file to the binary format without building a model. Lines
+    # keep the undefined type, load_brep_binary determines it.
+    from storage import TYPE_CODES
+    from binary_brep import write_brep_binary
+    vertex_names, xy, line_names, ends, arcs = read_brep_records(text_file_name)
+    rows = dict(zip(vertex_names, range(len(vertex_names))))
+    xy = xy[list(rows.values())]
+    rows = dict(zip(rows, range(len(rows))))
+    lines = dict(zip(line_names, ends))
+    arcs = dict((a, (v0, v1, arc)) for a, v0, v1, arc in arcs)
+    try:
+        ends = [(rows[v0], rows[v1]) for v0, v1 in lines.values()]
+        arc_ends = [(rows[v0], rows[v1]) for v0, v1, _ in arcs.values()]
+    except KeyError:
+        #print('line or arc uses undefined vertex')
+        raise TaoExcept()
+    types = [TYPE_CODES['u']] * len(lines)
+    write_brep_binary(binary_file_name, list(rows), xy, list(lines), ends, types,
+                      list(arcs), arc_ends, [arc for _, _, arc in arcs.values()])
+
+def brep_binary_to_text(binary_file_name, text_file_name):
+    # Convert a binary .brep file to the text format without building a model.
+    from binary_brep import read_brep_binary
+    try:
+        vertex_names, xy, line_names, ends, _, arc_names, arc_ends, arcs, _ = read_brep_binary(binary_file_name)
+    except ValueError:
+        #print('invalid binary brep file:', binary_file_name)
+        raise TaoExcept()
+    vertex_records = list(zip(vertex_names, xy[:, 0].tolist(), xy[:, 1].tolist()))
+    line_records = [(l, vertex_names[v0], vertex_names[v1])
+                    for l, (v0, v1) in zip(line_names, ends.tolist())]
+    arc_records = [(a, vertex_names[v0], vertex_names[v1]) + tuple(arc)
+                   for a, (v0, v1), arc in zip(arc_names, arc_ends.tolist(), arcs.tolist())]
+    with open(text_file_name, 'w') as f:
+        write_records(f, vertex_records)
+        write_records(f, line_records)
+        write_records(f, arc_records, ARC_TEMPLATE)
+
+def check_geometry(x, y, s, e, types):
+    """
+    Input the coordinates of the vertices, and the endpoint rows and type
+    codes (see storage.py) of normalized lines, as arrays
+    Raise TaoExcept if two vertices are at the same position, two lines are
+    the same, a vertex lies inside a line, or two lines cross
+    """
+    import numpy as np
+    from storage import TYPE_CODES
+    # For vertices, all positions must be unique.
+    order = np.lexsort((x, y))
+    if np.any((x[order][1:] == x[order][:-1]) & (y[order][1:] == y[order][:-1])):
+        #print('two same vertices.')
+        raise TaoExcept()
+    if not len(s):
+        return
+
+    # Next, we will check if two lines are the same.
+    order = np.lexsort((e, s))
+    if np.any((s[order][1:] == s[order][:-1]) & (e[order][1:] == e[order][:-1])):
+        #print('duplicated lines.')
+        raise TaoExcept()
+
+    # Next, we check if a line crosses a vertex. With the coordinates
+    # replaced by their ranks, the vertices strictly inside a horizontal
+    # line are the keys strictly between the keys of its endpoints.
+    _, rx = np.unique(x, return_inverse=True)
+    _, ry = np.unique(y, return_inverse=True)
+    rx, ry = rx.astype(np.int64), ry.astype(np.int64)
+    nx, ny = rx.max() + 1, ry.max() + 1
+    h, v = TYPE_CODES['h'], TYPE_CODES['v']
+    for t, keys in ((h, ry * nx + rx), (v, rx * ny + ry)):
+        sel = types == t
+        sorted_keys = np.sort(keys)
+        lo = np.searchsorted(sorted_keys, keys[s[sel]], 'right')
+        hi = np.searchsorted(sorted_keys, keys[e[sel]], 'left')
+        if np.any(hi > lo):
+            #print('should have splitted a line with a vertex.')
+            raise TaoExcept()
+
+    # Finally, check if two lines cross each other.
+    sel = types == h
+    hsegs = list(zip(y[s[sel]].tolist(), x[s[sel]].tolist(), x[e[sel]].tolist()))
+    sel = types == v
+    vsegs = list(zip(x[s[sel]].tolist(), y[s[sel]].tolist(), y[e[sel]].tolist()))
+    if find_crossings(hsegs, vsegs):
+        #print('lines cross.')
+        raise TaoExcept()
 
 class SimpleBrep(object):
-    def __init__(self):
-        self.vertices = {}
-        self.lines = {}
+    def __init__(self, paranoid=False, debug_check=False, storage='dict', reserve_prefix=False, resolution=None,
+                 jobs=None):
+        # storage is 'dict' (a dict entry per vertex and line, vertices as
+        # 2-element float64 arrays), 'python' (the same, vertices as (x, y)
+        # float tuples, without NumPy) or 'columnar' (see storage.py). All three
+        # give the same results to the bit.
+        assert storage in ['dict', 'python', 'columnar'], 'unknown storage: ' + storage
+        self.storage = storage
+        # With a resolution, the model works on a grid: every coordinate of
+        # the commands and files is snapped to the nearest multiple of it, and
+        # stored as that multiple, an integer (int64 arrays with 'dict'
+        # storage, ints with 'python', and integral float64 with 'columnar').
+        # Positions are then equal exactly when they are on the same grid
+        # point, however they were computed (e.g. by chains of relative
+        # lengths). model.vertices holds the integers; the files, coordinates
+        # and canonical_form are in the units of the commands. Arcs are not
+        # supported on a grid.
+        self.resolution = resolution
+        self.scale = None
+        if resolution is not None:
+            assert 0 < resolution < float('inf'), 'invalid resolution: ' + str(resolution)
+            # Dividing by an integral 1 / resolution (e.g. 1000 for 0.001) gives
+            # back the decimal values of the commands exactly.
+            scale = 1.0 / resolution
+            if abs(scale - round(scale)) <= 1e-9 * scale:
+                self.scale = int(round(scale))
+        self.vertices, self.lines = self.make_storage({}, {})
+        # Arc name -> (start vertex, end vertex, arc), see arc_geometry.py. Arcs
+        # go counterclockwise from their start to their end vertex.
+        self.arcs = {}
         self.used_names = set()
+        # new_name hands out n<k> from a counter that only moves forward,
+        # skipping names already in use. With reserve_prefix, commands may not
+        # use such names themselves, so nothing needs to be skipped.
+        self.reserve_prefix = reserve_prefix
+        self.name_counter = 0
+        # The SpatialIndex of the model, or None until index is first used.
+        self.spatial_index = SpatialIndex()
+        # Lines are stored in a dict, but splitting a line must keep its pieces
+        # where the line used to be when the model is saved. Every line created
+        # by a command (or loaded from a file) gets a new slot, and its pieces
+        # inherit it. Lines are ordered by slot, then along the line. Arcs get
+        # slots the same way.
+        self.line_slots = {}
+        self.next_slot = 0
+        # Commands only validate what they touched, see check_brep_incremental.
+        # paranoid runs the full check_brep instead; debug_check runs both and
+        # asserts that they agree.
+        self.paranoid = paranoid
+        self.debug_check = debug_check
+        # With jobs, the operations over the whole model (check_brep, loading,
+        # and resolve_overlap_lines, resolve_cross_lines and find_cross_lines
+        # without lines) run on tiles of the plane in a pool of that many
+        # processes, see tiles.py. The results are the same.
+        self.jobs = jobs
+        self.touched_vertices = set()
+        self.touched_lines = set()
+        self.touched_arcs = set()
+        # (canonical form, fingerprint), reset by every mutation.
+        self.canonical_cache = None
+        # Inside a transaction, every mutation is recorded here so that it can
+        # be undone; see begin.
+        self.undo_log = None
+        # See enable_profiling.
+        self.profiler = None
+        # Committed and undone transactions, see enable_history.
+        self.history = None
+        self.redo_history = None
     
     @staticmethod
     def parse_command(some_string):
         """
-        Input a string
-        Output an AST object
+        Input a string, in the .lang syntax or the v0-v3/l0-l3 syntax of play.py
+        Output an AST object: a VertexCommand, a LineCommand or an ArcCommand
         """
         assert type(some_string) == type(""), "you crazy"
-        # TODO: write this
-        raise NotImplementedError
+        return parse_command_text(some_string)
+
+    def make_storage(self, vertices, lines):
+        if self.storage == 'columnar':
+            from storage import to_columnar
+            return to_columnar(vertices, lines)
+        return vertices, lines
+
+    def make_point(self, x, y):
+        # The value of model.vertices for a vertex at (x, y).
+        if self.storage == 'python':
+            if self.resolution is not None:
+                return (int(x), int(y))
+            return (float(x), float(y))
+        import numpy as np
+        return np.array([x, y], dtype=np.float64 if self.resolution is None else np.int64)
+
+    def quantize(self, value):
+        # The grid coordinate nearest to value, see resolution.
+        k = value * self.scale if self.scale else value / self.resolution
+        if not abs(k) < QUANTIZED_LIMIT:
+            #print('coordinate out of range:', value)
+            raise TaoExcept()
+        return int(round(k))
+
+    def dequantize(self, k):
+        return k / self.scale if self.scale else k * self.resolution
+
+    def quantize_points(self, xy):
+        # quantize over a list of (x, y) pairs, or over an n x 2 array.
+        if isinstance(xy, list):
+            return [(self.quantize(x), self.quantize(y)) for x, y in xy]
+        import numpy as np
+        k = xy * self.scale if self.scale else xy / self.resolution
+        if not np.all(np.abs(k) < QUANTIZED_LIMIT):
+            #print('coordinate out of range')
+            raise TaoExcept()
+        k = np.round(k)
+        return k if self.storage == 'columnar' else k.astype(np.int64)
+
+    def tiled(self):
+        return self.jobs is not None and self.jobs > 1
+
+    def columns(self):
+        # (vertex names, coordinates as an n x 2 float64 array, line names,
+        # endpoint rows, type codes) of the model, see storage.py.
+        import numpy as np
+        from storage import TYPE_CODES
+        if self.storage == 'columnar':
+            line_names, ends, types = self.lines.columns()
+            return self.vertices.names, self.vertices.coords(), line_names, ends.astype(np.int64), types
+        vertex_names = list(self.vertices)
+        rows = dict(zip(vertex_names, range(len(vertex_names))))
+        xy = np.array(list(self.vertices.values()), dtype=np.float64).reshape(-1, 2)
+        line_names = list(self.lines)
+        ends = np.array([(rows[v0], rows[v1]) for v0, v1, _ in self.lines.values()], dtype=np.int64).reshape(-1, 2)
+        types = np.array([TYPE_CODES[t] for _, _, t in self.lines.values()], dtype=np.int32)
+        return vertex_names, xy, line_names, ends, types
 
     def check_brep(self):
+        if self.storage == 'columnar':
+            # The arcs are checked through the index, which load_brep_binary
+            # only builds after check_brep_columnar.
+            self.check_brep_columnar()
+            if self.arcs:
+                self.check_arcs(self.vertices, self.lines, self.arcs)
+            return
         # First, all names must be valid and unique.
         for n in self.vertices:
             if not is_valid_name(n):
@@ -83,6 +612,21 @@ class SimpleBrep(object):
             if n in self.vertices:
                 #print('duplicated vertex and line names:', n)
                 raise TaoExcept()
+        # All coordinates must be finite: NaN equals nothing, not even itself.
+        for n, (x, y) in self.vertices.items():
+            if not (math.isfinite(x) and math.isfinite(y)):
+                #print('non-finite vertex:', n)
+                raise TaoExcept()
+        if self.tiled():
+            # The rest is check_geometry on the normalized lines, on tiles.
+            from tiles import check_geometry_tiled
+            for l in self.lines:
+                self.lines[l] = self.normalize_line(l)
+            _, xy, _, ends, types = self.columns()
+            check_geometry_tiled(xy, ends, types, self.jobs)
+            if self.arcs:
+                self.check_arcs(self.vertices, self.lines, self.arcs)
+            return
         # For vertices, all positions must be unique.
         for n1, (x1, y1) in self.vertices.items():
             for n2, (x2, y2) in self.vertices.items():
@@ -93,48 +637,8 @@ class SimpleBrep(object):
         # Now all vertices are valid.
 
         # Now check lines. First, check if they are either horizontal or vertical.
-        new_lines = {}
-        for l, (v0, v1, t) in self.lines.items():
-            if v0 == v1:
-                #print('degenerated lines:', l)
-                raise TaoExcept()
-            if v0 not in self.vertices or v1 not in self.vertices:
-                #print('line uses undefined vertex:', v0, v1)
-                raise TaoExcept()
-            x0, y0 = self.vertices[v0]
-            x1, y1 = self.vertices[v1]
-            if t == 'h':
-                if y0 != y1:
-                    #print('line', l, 'is not horizontal.')
-                    raise TaoExcept()
-                if x0 > x1:
-                    # Swap.
-                    v0, v1 = v1, v0
-                new_lines[l] = (v0, v1, t)
-            elif t == 'v':
-                if x0 != x1:
-                    #print('line', l, 'is not vertical.')
-                    raise TaoExcept()
-                if y0 > y1:
-                    v0, v1 = v1, v0
-                new_lines[l] = (v0, v1, t)
-            elif t == 'u':
-                # Determine the type now.
-                if x0 == x1:
-                    if y0 > y1:
-                        v0, v1 = v1, v0
-                    new_lines[l] = (v0, v1, 'v')
-                elif y0 == y1:
-                    if x0 > x1:
-                        v0, v1 = v1, v0
-                    new_lines[l] = (v0, v1, 'h')
-                else:
-                    #print('cannot process lines that are not horizontal or vertical:', l)
-                    raise TaoExcept()
-            else:
-                #print('undefined type:', t)
-                raise TaoExcept()
-        self.lines = new_lines
+        for l in self.lines:
+            self.lines[l] = self.normalize_line(l)
         # Now we know:
         # Each line uses two different vertices.
         # Each line is either vertical or horizontal.
@@ -162,86 +666,821 @@ class SimpleBrep(object):
         for l1, (s1, e1, t1) in self.lines.items():
             for l2, (s2, e2, t2) in self.lines.items():
                 if l1 >= l2 or t1 == t2: continue
+                hs, he, vs, ve = s1, e1, s2, e2
                 if t1 == 'v':
-                    s1, s2 = s2, s1
-                    e1, e2 = e2, e1
-                # Now (s1, e1) is horizontal and (s2, e2) is vertical.
-                x1 = self.vertices[s1][0]
-                x2 = self.vertices[e1][0]
-                x0 = self.vertices[s2][0]
-                y1 = self.vertices[s2][1]
-                y2 = self.vertices[e2][1]
-                y0 = self.vertices[s1][1]
+                    hs, he, vs, ve = s2, e2, s1, e1
+                # Now (hs, he) is horizontal and (vs, ve) is vertical.
+                x1 = self.vertices[hs][0]
+                x2 = self.vertices[he][0]
+                x0 = self.vertices[vs][0]
+                y1 = self.vertices[vs][1]
+                y2 = self.vertices[ve][1]
+                y0 = self.vertices[hs][1]
                 if x1 < x0 < x2 and y1 < y0 < y2:
                     #print('line', l1, 'and', l2, 'cross.')
                     raise TaoExcept()
 
-    def load_brep(self, brep_file_name):
-        vertices = {}
-        lines = {}
-        with open(brep_file_name, 'r') as f:
-            while True:
-                line = f.readline()
-                if not line: break
-                line = line.strip()
-    
-                # Ignore comments.
-                if '#' in line:
-                    line = line[:line.find('#')].strip()
-    
-                # Ignore empty lines.
-                if not line: continue
-                tokens = line.split()
-                if not tokens: continue
-    
-                # Ignore invalid number of tokens.
-                if len(tokens) != 3:
-                    #print('invalid syntax:', line)
-                    raise TaoExcept()
-    
-                # Check if it is a vertex or a line.
-                if is_number(tokens[1]):
-                    # Parse a vertex.
-                    v_name = tokens[0]
-                    x, y = float(tokens[1]), float(tokens[2])
-                    vertices[v_name] = np.array([x, y], dtype=np_type)
-                else:
-                    # Parse a line.
-                    l_name = tokens[0]
-                    v0_name, v1_name = tokens[1:]
-                    # 'u' stands for undefined. It will be determined in check_brep.
-                    lines[l_name] = (v0_name, v1_name, 'u')
-        self.vertices = vertices
-        self.lines = lines
-        self.check_brep()
-        self.used_names = set()
+        if self.arcs:
+            self.check_arcs(self.vertices, self.lines, self.arcs)
+
+    def check_brep_columnar(self):
+        # check_brep over the columnar arrays: the pairwise loops become sorts
+        # and vectorized comparisons.
+        import numpy as np
+        from storage import TYPE_CODES
         for n in self.vertices:
-            self.used_names.add(n)
+            if not is_valid_name(n) or n in self.lines:
+                #print('invalid or duplicated vertex name:', n)
+                raise TaoExcept()
         for n in self.lines:
-            self.used_names.add(n)
+            if not is_valid_name(n):
+                #print('invalid line name:', n)
+                raise TaoExcept()
+        xy = self.vertices.coords()
+        if not np.all(np.isfinite(xy)):
+            #print('non-finite vertices.')
+            raise TaoExcept()
+        x, y = xy[:, 0], xy[:, 1]
+        # Lines must be horizontal or vertical, and go from left to right or
+        # bottom to top.
+        _, ends, types = self.lines.columns()
+        if len(ends):
+            s, e = ends[:, 0], ends[:, 1]
+            if np.any(s == e):
+                #print('degenerated lines.')
+                raise TaoExcept()
+            same_x = x[s] == x[e]
+            same_y = y[s] == y[e]
+            h, v, u = TYPE_CODES['h'], TYPE_CODES['v'], TYPE_CODES['u']
+            undefined = types == u
+            types[undefined & same_x] = v
+            types[undefined & ~same_x & same_y] = h
+            if np.any((types == u) | ((types == h) & ~same_y) | ((types == v) & ~same_x)):
+                #print('lines that are not horizontal or vertical.')
+                raise TaoExcept()
+            swap = ((types == h) & (x[s] > x[e])) | ((types == v) & (y[s] > y[e]))
+            ends[swap] = ends[swap][:, ::-1]
+            self.lines.set_columns(ends, types)
+        if self.tiled():
+            from tiles import check_geometry_tiled
+            check_geometry_tiled(xy, ends, types, self.jobs)
+        else:
+            check_geometry(x, y, ends[:, 0], ends[:, 1], types)
+
+    def check_brep_incremental(self, vertices, lines, arcs=()):
+        # The same invariants as check_brep, but only between the given
+        # vertices, lines and arcs and the rest of the model, found through the
+        # index. This is enough as long as the model was valid before they were
+        # added.
+        lines = [l for l in lines if l in self.lines]
+        arcs = [a for a in arcs if a in self.arcs]
+        for n in vertices:
+            if not is_valid_name(n) or n in self.lines:
+                #print('invalid or duplicated vertex name:', n)
+                raise TaoExcept()
+            x, y = self.vertices[n]
+            if not (math.isfinite(x) and math.isfinite(y)):
+                #print('non-finite vertex:', n)
+                raise TaoExcept()
+            if self.index.count_vertices_at(x, y) > 1:
+                #print('two same vertices:', n)
+                raise TaoExcept()
+            if self.index.lines_containing('h', x, y) or self.index.lines_containing('v', x, y):
+                #print('should have splitted a line with vertex', n)
+                raise TaoExcept()
+        for l in lines:
+            if not is_valid_name(l) or l in self.vertices:
+                #print('invalid or duplicated line name:', l)
+                raise TaoExcept()
+            self.store(self.lines, l, self.normalize_line(l))
+        for l in lines:
+            v0, v1, t = self.lines[l]
+            if len(self.index.find_lines(t, self.vertices[v0], self.vertices[v1])) > 1:
+                #print('duplicated lines:', l)
+                raise TaoExcept()
+            fixed_idx = 1 if t == 'h' else 0
+            y = self.vertices[v0][fixed_idx]
+            x0 = self.vertices[v0][1 - fixed_idx]
+            x1 = self.vertices[v1][1 - fixed_idx]
+            if self.index.vertices_inside(t, y, x0, x1):
+                #print('should have splitted line', l)
+                raise TaoExcept()
+        if self.find_cross_lines(lines):
+            #print('lines cross.')
+            raise TaoExcept()
+        if self.arcs:
+            self.check_arcs(vertices, lines, arcs)
+
+    def check_arcs(self, vertices, lines, arcs):
+        # The invariants involving arcs, between the given vertices, lines and
+        # arcs and the rest of the model. Positions on arcs are compared up to
+        # the tolerance of arc_geometry.py.
+        for a in arcs:
+            if not is_valid_name(a) or a in self.vertices or a in self.lines:
+                #print('invalid or duplicated arc name:', a)
+                raise TaoExcept()
+            v0, v1, arc = self.arcs[a]
+            if v0 == v1 or v0 not in self.vertices or v1 not in self.vertices:
+                #print('degenerated arc or arc using undefined vertex:', a)
+                raise TaoExcept()
+            if normalize_arc(*arc) != arc:
+                #print('invalid arc:', a)
+                raise TaoExcept()
+            eps = tolerance(arc[2])
+            for v, (x, y) in zip((v0, v1), arc_endpoints(arc)):
+                vx, vy = self.vertices[v]
+                if abs(vx - x) > eps or abs(vy - y) > eps:
+                    #print('arc', a, 'does not end at vertex', v)
+                    raise TaoExcept()
+            box = arc_box(arc)
+            for x, y, v in self.index.vertices_in_box(box):
+                if arc_contains(arc, x, y):
+                    #print('should have splitted arc', a, 'with vertex', v)
+                    raise TaoExcept()
+            for t in ['h', 'v']:
+                for l in self.index.lines_in_box(t, box):
+                    if line_crossings(arc, *self.index.line_keys[l]):
+                        #print('arc', a, 'and line', l, 'cross.')
+                        raise TaoExcept()
+            for other in self.index.arcs.overlapping(box):
+                if other == a: continue
+                other_arc = self.arcs[other][2]
+                if arcs_overlap(arc, other_arc) or arc_crossings(arc, other_arc):
+                    #print('arcs', a, 'and', other, 'overlap or cross.')
+                    raise TaoExcept()
+        for n in vertices:
+            if n in self.arcs:
+                #print('duplicated vertex and arc names:', n)
+                raise TaoExcept()
+            # Commands snap points within the tolerance onto one vertex (see
+            # try_new_vertex), so two vertices that close are one point.
+            x, y = self.vertices[n]
+            eps = point_tolerance(x, y)
+            if len(self.index.vertices_in_box((x - eps, y - eps, x + eps, y + eps))) > 1:
+                #print('vertex', n, 'too close to another vertex')
+                raise TaoExcept()
+            if self.arcs_containing(x, y):
+                #print('should have splitted an arc with vertex', n)
+                raise TaoExcept()
+        for l in lines:
+            if l in self.arcs:
+                #print('duplicated line and arc names:', l)
+                raise TaoExcept()
+            key = self.index.line_keys[l]
+            for a in self.arcs_meeting_line(*key):
+                if line_crossings(self.arcs[a][2], *key):
+                    #print('arc', a, 'and line', l, 'cross.')
+                    raise TaoExcept()
+
+    def arcs_containing(self, x, y):
+        # Arcs passing through (x, y), but not ending there.
+        return [a for a in self.index.arcs.overlapping((x, y, x, y)) if arc_contains(self.arcs[a][2], x, y)]
+
+    def arcs_meeting_line(self, t, fixed, lo, hi):
+        # Arcs whose bounding box meets the line.
+        box = (lo, fixed, hi, fixed) if t == 'h' else (fixed, lo, fixed, hi)
+        return self.index.arcs.overlapping(box)
+
+    def validate(self):
+        # Check the vertices, lines and arcs touched since the last successful
+        # check.
+        vertices, lines, arcs = self.touched_vertices, self.touched_lines, self.touched_arcs
+        if self.paranoid:
+            self.check_brep()
+        elif self.debug_check:
+            try:
+                self.check_brep_incremental(vertices, lines, arcs)
+                ok = True
+            except TaoExcept:
+                ok = False
+            try:
+                self.check_brep()
+                full_ok = True
+            except TaoExcept:
+                full_ok = False
+            assert ok == full_ok, 'check_brep_incremental and check_brep disagree'
+            if not ok:
+                raise TaoExcept()
+        else:
+            self.check_brep_incremental(vertices, lines, arcs)
+        self.touched_vertices = set()
+        self.touched_lines = set()
+        self.touched_arcs = set()
+
+    def normalize_line(self, l):
+        # Orient the line from left to right (bottom to top), determining its
+        # type first if it is undefined.
+        v0, v1, t = self.lines[l]
+        if v0 == v1:
+            #print('degenerated lines:', l)
+            raise TaoExcept()
+        if v0 not in self.vertices or v1 not in self.vertices:
+            #print('line uses undefined vertex:', v0, v1)
+            raise TaoExcept()
+        x0, y0 = self.vertices[v0]
+        x1, y1 = self.vertices[v1]
+        if t == 'h':
+            if y0 != y1:
+                #print('line', l, 'is not horizontal.')
+                raise TaoExcept()
+            if x0 > x1:
+                # Swap.
+                v0, v1 = v1, v0
+            return (v0, v1, t)
+        elif t == 'v':
+            if x0 != x1:
+                #print('line', l, 'is not vertical.')
+                raise TaoExcept()
+            if y0 > y1:
+                v0, v1 = v1, v0
+            return (v0, v1, t)
+        elif t == 'u':
+            # Determine the type now.
+            if x0 == x1:
+                if y0 > y1:
+                    v0, v1 = v1, v0
+                return (v0, v1, 'v')
+            elif y0 == y1:
+                if x0 > x1:
+                    v0, v1 = v1, v0
+                return (v0, v1, 'h')
+            else:
+                #print('cannot process lines that are not horizontal or vertical:', l)
+                raise TaoExcept()
+        else:
+            #print('undefined type:', t)
+            raise TaoExcept()
+
+    def load_brep(self, brep_file_name):
+        python = self.storage == 'python'
+        vertex_names, xy, line_names, ends, arcs = read_brep_records(brep_file_name, as_array=not python)
+        if self.resolution is not None:
+            xy = self.quantize_points(xy)
+        # Later records of the same name win, as if they were stored one by one.
+        if python:
+            self.vertices = dict(zip(vertex_names, xy))
+        else:
+            rows = dict(zip(vertex_names, range(len(vertex_names))))
+            self.vertices = dict(zip(rows, xy[list(rows.values())]))
+        # 'u' stands for undefined. It will be determined by normalize_line.
+        self.lines = dict((l, (v0, v1, 'u')) for l, (v0, v1) in zip(line_names, ends))
+        for l in self.lines:
+            self.lines[l] = self.normalize_line(l)
+        self.vertices, self.lines = self.make_storage(self.vertices, self.lines)
+        self.arcs = dict((a, (v0, v1, arc)) for a, v0, v1, arc in arcs)
+        self.finish_load()
+
+    def load_brep_binary(self, brep_file_name):
+        # Load a file written by save_brep_binary (see binary_brep.py). With
+        # columnar storage, the model uses the mapped arrays as they are.
+        from storage import TYPES, wrap_columnar
+        from binary_brep import read_brep_binary
+        try:
+            vertex_names, xy, line_names, ends, types, arc_names, arc_ends, arcs, checked = read_brep_binary(brep_file_name)
+        except ValueError:
+            #print('invalid binary brep file:', brep_file_name)
+            raise TaoExcept()
+        # Files saved from a valid model need no check, unless the coordinates
+        # are quantized on the way in or every check is asked for.
+        trusted = checked and self.resolution is None and not self.paranoid and not self.debug_check
+        self.arcs = {}
+        for a, (v0, v1), arc in zip(arc_names, arc_ends.tolist(), arcs.tolist()):
+            if normalize_arc(*arc) != tuple(arc):
+                #print('invalid arc:', a)
+                raise TaoExcept()
+            self.arcs[a] = (vertex_names[v0], vertex_names[v1], tuple(arc))
+        if self.resolution is not None:
+            xy = self.quantize_points(xy)
+        unique = trusted or (len(set(vertex_names)) == len(vertex_names) and
+                             len(set(line_names)) == len(line_names))
+        if self.storage == 'columnar' and unique:
+            self.vertices, self.lines = wrap_columnar(vertex_names, xy, line_names, ends, types)
+        else:
+            # As in load_brep, later names win.
+            if self.storage == 'python':
+                self.vertices = dict(zip(vertex_names, map(tuple, xy.tolist())))
+            else:
+                self.vertices = dict(zip(vertex_names, xy))
+            self.lines = {}
+            for l, (v0, v1), t in zip(line_names, ends.tolist(), types.tolist()):
+                self.lines[l] = (vertex_names[v0], vertex_names[v1], TYPES[t])
+            self.vertices, self.lines = self.make_storage(self.vertices, self.lines)
+        if trusted:
+            self.finish_load(checked=True, trusted=True)
+        elif self.storage == 'columnar':
+            # check_brep_columnar normalizes the lines while it checks all of
+            # them, which beats checking them one by one through the index.
+            self.check_brep_columnar()
+            self.finish_load(checked=True)
+        else:
+            for l in self.lines:
+                self.lines[l] = self.normalize_line(l)
+            self.finish_load()
+
+    def finish_load(self, checked=False, trusted=False):
+        # checked: the vertices and lines were checked already; trusted: the
+        # arcs too.
+        if self.arcs and self.resolution is not None:
+            #print('arcs are not supported with a resolution')
+            raise TaoExcept()
+        self.canonical_cache = None
+        self.used_names = set(self.vertices)
+        self.used_names.update(self.lines)
+        self.used_names.update(self.arcs)
+        self.name_counter = 0
+        if self.reserve_prefix:
+            generated = [int(n[1:]) for n in self.used_names if is_generated_name(n)]
+            self.name_counter = max(generated) + 1 if generated else 0
+        self.rebuild_index()
+        if checked:
+            self.touched_vertices = set()
+            self.touched_lines = set()
+            self.touched_arcs = set() if trusted else set(self.arcs)
+            if self.touched_arcs:
+                self.validate()
+        elif self.tiled():
+            self.check_brep()
+            self.touched_vertices = set()
+            self.touched_lines = set()
+            self.touched_arcs = set()
+        else:
+            self.touched_vertices = set(self.vertices)
+            self.touched_lines = set(self.lines)
+            self.touched_arcs = set(self.arcs)
+            self.validate()
+
+    def rebuild_index(self):
+        # Give the loaded lines and arcs their slots, in order, and drop the
+        # index: it is built when first used, as models that are only checked
+        # (see check_brep_columnar), compared or saved never need it.
+        self.line_slots = dict(zip(list(self.lines) + list(self.arcs), range(len(self.lines) + len(self.arcs))))
+        self.next_slot = len(self.line_slots)
+        self.spatial_index = None
+
+    @property
+    def index(self):
+        if self.spatial_index is None:
+            self.build_index()
+        return self.spatial_index
+
+    def build_index(self):
+        index = SpatialIndex()
+        if self.storage == 'columnar':
+            # Read the columns as plain lists rather than entity by entity.
+            from storage import TYPES
+            vertex_names, xy, line_names, ends, types = self.columns()
+            vertices = dict(zip(vertex_names, map(tuple, xy.tolist())))
+            lines = [(l, vertex_names[v0], vertex_names[v1], TYPES[t])
+                     for l, (v0, v1), t in zip(line_names, ends.tolist(), types.tolist())]
+        else:
+            vertices = self.vertices
+            lines = [(l, v0, v1, t) for l, (v0, v1, t) in self.lines.items()]
+        for n, (x, y) in vertices.items():
+            index.add_vertex(n, x, y)
+        for l, v0, v1, t in lines:
+            index.add_line(l, t, vertices[v0], vertices[v1])
+            index.connect(l, v0, v1)
+        for a, (v0, v1, arc) in self.arcs.items():
+            index.arcs.add(a, arc_box(arc))
+            index.connect(a, v0, v1)
+        self.spatial_index = index
+
+    def changing(self):
+        # Every mutation starts here. The index must describe the model as it
+        # was before, so a lazy one is built first.
+        self.canonical_cache = None
+        if self.spatial_index is None:
+            self.build_index()
+
+    # Topology queries, through the incident lines and arcs of the index. Each
+    # one costs the degrees of the vertices it visits, not the size of the
+    # model. Directions are where a line goes from a vertex: 'left', 'right',
+    # 'down' or 'up' ('arc' for arcs).
+
+    def incident(self, v):
+        # The lines and arcs ending at the vertex v, sorted.
+        return sorted(self.index.incident.get(v, ()))
+
+    def degree(self, v):
+        return len(self.index.incident.get(v, ()))
+
+    def direction(self, edge, v):
+        # The direction in which the line (or arc) edge leaves its end v.
+        if edge in self.arcs:
+            return 'arc'
+        v0, v1, t = self.lines[edge]
+        along = 0 if t == 'h' else 1
+        forward = self.vertices[v1 if v == v0 else v0][along] > self.vertices[v][along]
+        if t == 'h':
+            return 'right' if forward else 'left'
+        return 'up' if forward else 'down'
+
+    def neighbours(self, v):
+        # (direction, line or arc, vertex at its other end) for everything
+        # ending at v, sorted.
+        found = []
+        for edge in self.index.incident.get(v, ()):
+            v0, v1 = (self.arcs[edge] if edge in self.arcs else self.lines[edge])[:2]
+            found.append((self.direction(edge, v), edge, v1 if v == v0 else v0))
+        return sorted(found)
+
+    def neighbour(self, v, direction):
+        # The line leaving v in the direction, or None.
+        for d, edge, _ in self.neighbours(v):
+            if d == direction:
+                return edge
+        return None
+
+    def collinear_neighbours(self, l):
+        # (the line before l, the line after l) that continue it on the same
+        # line from its ends, each None if there is none.
+        v0, v1, t = self.lines[l]
+        if t == 'h':
+            return self.neighbour(v0, 'left'), self.neighbour(v1, 'right')
+        return self.neighbour(v0, 'down'), self.neighbour(v1, 'up')
+
+    def chain(self, l):
+        # The maximal chain of collinear lines meeting end to end that holds
+        # l, in order from left to right (bottom to top).
+        before, after = [], []
+        previous, following = self.collinear_neighbours(l)
+        while previous is not None:
+            before.append(previous)
+            previous = self.collinear_neighbours(previous)[0]
+        while following is not None:
+            after.append(following)
+            following = self.collinear_neighbours(following)[1]
+        return before[::-1] + [l] + after
+
+    def component(self, v):
+        # The vertices connected to v by lines and arcs, sorted.
+        seen = set([v])
+        todo = [v]
+        while todo:
+            for _, _, other in self.neighbours(todo.pop()):
+                if other not in seen:
+                    seen.add(other)
+                    todo.append(other)
+        return sorted(seen)
+
+    def components(self):
+        # The connected components of the model, as for component, sorted.
+        found = []
+        seen = set()
+        for v in self.vertices:
+            if v not in seen:
+                found.append(self.component(v))
+                seen.update(found[-1])
+        return sorted(found)
+
+    def new_slot(self):
+        self.next_slot += 1
+        return self.next_slot - 1
+
+    def line_order_key(self, l):
+        # Lines are normalized, so their start is where v0 is.
+        return (self.line_slots[l], self.index.line_keys[l][2], l)
+
+    def ordered_lines(self):
+        if self.spatial_index is None:
+            # Nothing changed since loading: every line has a slot of its own,
+            # given in order.
+            return list(self.lines)
+        return sorted(self.lines, key=self.line_order_key)
+
+    def arc_order_key(self, a):
+        # As for lines: by slot, then along the arc.
+        return (self.line_slots[a], self.arcs[a][2][3], a)
+
+    def ordered_arcs(self):
+        return sorted(self.arcs, key=self.arc_order_key)
+
+    def canonical_form(self):
+        # The vertex positions, sorted, the lines as sorted pairs of endpoint
+        # positions, and the arcs as their endpoint positions and circles. Names
+        # play no part, so two models are the same iff their canonical forms
+        # are equal.
+        if self.canonical_cache is None:
+            if self.storage == 'columnar':
+                xy = self.coordinates()
+                _, ends, _ = self.lines.columns()
+                points = [tuple(p) for p in xy.tolist()]
+            else:
+                names = list(self.vertices)
+                points = [(float(x), float(y)) for x, y in self.vertices.values()]
+                if self.resolution is not None:
+                    points = [(self.dequantize(x), self.dequantize(y)) for x, y in points]
+                rows = dict((n, i) for i, n in enumerate(names))
+                ends = [(rows[v0], rows[v1]) for v0, v1, _ in self.lines.values()]
+            lines = []
+            for v0, v1 in ends:
+                p0, p1 = points[v0], points[v1]
+                lines.append((p0, p1) if p0 <= p1 else (p1, p0))
+            arcs = []
+            for v0, v1, arc in self.arcs.values():
+                (x0, y0), (x1, y1) = self.vertices[v0], self.vertices[v1]
+                arcs.append(((float(x0), float(y0)), (float(x1), float(y1))) + arc[:3])
+            canonical = (tuple(sorted(points)), tuple(sorted(lines)), tuple(sorted(arcs)))
+            self.canonical_cache = (canonical, hash(canonical))
+        return self.canonical_cache[0]
+
+    def fingerprint(self):
+        # A hash of the canonical form, stable across runs.
+        self.canonical_form()
+        return self.canonical_cache[1]
+
+    def use_name(self, name):
+        if self.undo_log is not None and name not in self.used_names:
+            self.undo_log.append(('name', name))
+        self.used_names.add(name)
+
+    @staticmethod
+    def store(table, name, value):
+        # table[name] = value, also for the columnar stores, which are
+        # read-only views (see storage.py).
+        if isinstance(table, dict):
+            table[name] = value
+        else:
+            table.set(name, value)
+
+    @staticmethod
+    def unstore(table, name):
+        # table.pop(name), also for the columnar stores.
+        if isinstance(table, dict):
+            return table.pop(name)
+        return table.remove(name)
+
+    def add_vertex(self, name, x, y):
+        if not (math.isfinite(x) and math.isfinite(y)):
+            # Checked before the index, which cannot hold NaN.
+            #print('non-finite vertex:', name)
+            raise TaoExcept()
+        self.changing()
+        self.store(self.vertices, name, self.make_point(x, y))
+        self.use_name(name)
+        self.index.add_vertex(name, x, y)
+        self.touched_vertices.add(name)
+        if self.undo_log is not None:
+            self.undo_log.append(('add_vertex', name, x, y))
+
+    def remove_vertex(self, name):
+        self.changing()
+        x, y = self.unstore(self.vertices, name)
+        self.index.remove_vertex(name, x, y)
+
+    def add_line(self, name, v0, v1, t, slot):
+        self.changing()
+        self.store(self.lines, name, (v0, v1, t))
+        self.line_slots[name] = slot
+        self.index.add_line(name, t, self.vertices[v0], self.vertices[v1])
+        self.index.connect(name, v0, v1)
+        self.touched_lines.add(name)
+        if self.undo_log is not None:
+            self.undo_log.append(('add_line', name, (v0, v1, t), slot))
+
+    def remove_line(self, name):
+        self.changing()
+        if self.undo_log is not None:
+            self.undo_log.append(('remove_line', name, self.lines[name], self.line_slots[name]))
+        self.index.disconnect(name, *self.lines[name][:2])
+        self.unstore(self.lines, name)
+        del self.line_slots[name]
+        self.index.remove_line(name)
+
+    def add_arc(self, name, v0, v1, arc, slot):
+        self.changing()
+        self.arcs[name] = (v0, v1, arc)
+        self.line_slots[name] = slot
+        self.index.arcs.add(name, arc_box(arc))
+        self.index.connect(name, v0, v1)
+        self.touched_arcs.add(name)
+        if self.undo_log is not None:
+            self.undo_log.append(('add_arc', name, (v0, v1, arc), slot))
+
+    def remove_arc(self, name):
+        self.changing()
+        if self.undo_log is not None:
+            self.undo_log.append(('remove_arc', name, self.arcs[name], self.line_slots[name]))
+        self.index.disconnect(name, *self.arcs[name][:2])
+        del self.arcs[name]
+        del self.line_slots[name]
+        self.index.arcs.remove(name)
+
+    def begin(self):
+        # Start a transaction. Commands executed inside it are resolved as usual
+        # (later commands may refer to the names they generate), but they are
+        # validated together by commit, and rollback undoes all of them.
+        assert self.undo_log is None, 'transactions cannot be nested'
+        self.undo_log = []
+        self.undo_state = (self.next_slot, self.name_counter, set(self.touched_vertices),
+                           set(self.touched_lines), set(self.touched_arcs))
+
+    def commit(self):
+        try:
+            self.validate()
+        except TaoExcept:
+            self.rollback()
+            raise
+        if self.history is not None:
+            self.history.append((self.undo_log, self.undo_state, (self.next_slot, self.name_counter)))
+            self.redo_history = []
+        self.undo_log = None
+
+    def rollback(self):
+        log, self.undo_log = self.undo_log, None
+        self.revert(log)
+        (self.next_slot, self.name_counter, self.touched_vertices,
+         self.touched_lines, self.touched_arcs) = self.undo_state
+
+    def revert(self, log):
+        # Undo the mutations recorded in log, latest first.
+        for entry in reversed(log):
+            if entry[0] == 'name':
+                self.used_names.discard(entry[1])
+            elif entry[0] == 'add_vertex':
+                self.remove_vertex(entry[1])
+            elif entry[0] == 'add_line':
+                self.remove_line(entry[1])
+            elif entry[0] == 'remove_line':
+                _, name, (v0, v1, t), slot = entry
+                self.add_line(name, v0, v1, t, slot)
+            elif entry[0] == 'add_arc':
+                self.remove_arc(entry[1])
+            else:
+                _, name, (v0, v1, arc), slot = entry
+                self.add_arc(name, v0, v1, arc, slot)
+
+    def replay(self, log):
+        # Redo the mutations recorded in log, in order.
+        for entry in log:
+            if entry[0] == 'name':
+                self.used_names.add(entry[1])
+            elif entry[0] == 'add_vertex':
+                _, name, x, y = entry
+                self.add_vertex(name, x, y)
+            elif entry[0] == 'add_line':
+                _, name, (v0, v1, t), slot = entry
+                self.add_line(name, v0, v1, t, slot)
+            elif entry[0] == 'remove_line':
+                self.remove_line(entry[1])
+            elif entry[0] == 'add_arc':
+                _, name, (v0, v1, arc), slot = entry
+                self.add_arc(name, v0, v1, arc, slot)
+            else:
+                self.remove_arc(entry[1])
+
+    def enable_history(self):
+        # Keep the undo log of every committed transaction, so that they can be
+        # undone and redone (see undo, redo, snapshot and restore). This costs
+        # memory in proportion to the changes made, never a copy of the model.
+        self.history = []
+        self.redo_history = []
+
+    def undo(self):
+        # Undo the last committed transaction. Returns False if there is none.
+        assert self.undo_log is None, 'cannot undo inside a transaction'
+        if not self.history:
+            return False
+        entry = self.history.pop()
+        log, (self.next_slot, self.name_counter, touched_vertices, touched_lines, touched_arcs), _ = entry
+        self.revert(log)
+        self.touched_vertices, self.touched_lines = set(touched_vertices), set(touched_lines)
+        self.touched_arcs = set(touched_arcs)
+        self.redo_history.append(entry)
+        return True
+
+    def redo(self):
+        # Redo the last undone transaction. Returns False if there is none.
+        assert self.undo_log is None, 'cannot redo inside a transaction'
+        if not self.redo_history:
+            return False
+        entry = self.redo_history.pop()
+        log, _, (self.next_slot, self.name_counter) = entry
+        self.replay(log)
+        # It was valid when it was committed.
+        self.touched_vertices = set()
+        self.touched_lines = set()
+        self.touched_arcs = set()
+        self.history.append(entry)
+        return True
+
+    def snapshot(self):
+        # An O(1) handle on the current state, for restore.
+        assert self.history is not None, 'snapshots need enable_history'
+        return len(self.history)
+
+    def restore(self, snapshot):
+        # Undo the transactions committed since snapshot was taken.
+        while len(self.history) > snapshot:
+            self.undo()
+
+    @contextmanager
+    def transaction(self):
+        self.begin()
+        try:
+            yield self
+        except BaseException:
+            self.rollback()
+            raise
+        self.commit()
+
+    def split_line(self, l, v):
+        # Replace l by two lines meeting at the vertex v.
+        v0, v1, t = self.lines[l]
+        slot = self.line_slots[l]
+        self.remove_line(l)
+        l1 = self.new_name()
+        self.add_line(l1, v0, v, t, slot)
+        l2 = self.new_name()
+        self.add_line(l2, v, v1, t, slot)
+
+    def split_arc(self, a, v):
+        # Replace a by two arcs of the same circle meeting at the vertex v.
+        # Returns them in order.
+        v0, v1, arc = self.arcs[a]
+        slot = self.line_slots[a]
+        theta = arc_angle(arc, *self.vertices[v])
+        first = normalize_arc(arc[0], arc[1], arc[2], arc[3], theta)
+        second = normalize_arc(arc[0], arc[1], arc[2], theta, arc[4])
+        if first is None or second is None:
+            #print('cannot split arc', a, 'at its end', v)
+            raise TaoExcept()
+        self.remove_arc(a)
+        a1 = self.new_name()
+        self.add_arc(a1, v0, v, first, slot)
+        a2 = self.new_name()
+        self.add_arc(a2, v, v1, second, slot)
+        return a1, a2
+
+    def coordinates(self):
+        # The (x, y) of every vertex, in order, as an n x 2 array (in the units
+        # of the commands, with a resolution).
+        import numpy as np
+        if self.storage == 'columnar':
+            xy = self.vertices.coords()
+        else:
+            xy = np.array(list(self.vertices.values()), dtype=np.float64).reshape(-1, 2)
+        if self.resolution is not None:
+            xy = xy / self.scale if self.scale else xy * self.resolution
+        return xy
 
     def save_brep(self, brep_file_name):
         with open(brep_file_name, 'w') as f:
-            for v, (x, y) in self.vertices.items():
-                f.write('{} {} {}\n'.format(v, x, y))
+            self.write_brep(f)
+
+    def write_brep(self, f):
+        # save_brep, to a file object.
+        if self.storage == 'python' and self.resolution is None:
+            vertex_records = [(n, x, y) for n, (x, y) in self.vertices.items()]
+        elif self.storage == 'python':
+            d = self.dequantize
+            vertex_records = [(n, d(x), d(y)) for n, (x, y) in self.vertices.items()]
+        else:
+            xy = self.coordinates()
+            vertex_records = list(zip(self.vertices, xy[:, 0].tolist(), xy[:, 1].tolist()))
+        line_records = [(l,) + self.lines[l][:2] for l in self.ordered_lines()]
+        arc_records = [(a,) + self.arcs[a][:2] + self.arcs[a][2] for a in self.ordered_arcs()]
+        write_records(f, vertex_records)
+        write_records(f, line_records)
+        write_records(f, arc_records, ARC_TEMPLATE)
 
-            for l, (v0, v1, _) in self.lines.items():
-                f.write('{} {} {}\n'.format(l, v0, v1))
+    def save_brep_binary(self, brep_file_name):
+        # The binary version of save_brep, see binary_brep.py.
+        from storage import TYPE_CODES
+        from binary_brep import write_brep_binary
+        rows = dict(zip(self.vertices, range(len(self.vertices))))
+        lines = self.ordered_lines()
+        ends = [(rows[v0], rows[v1]) for v0, v1, _ in map(self.lines.__getitem__, lines)]
+        types = [TYPE_CODES[self.lines[l][2]] for l in lines]
+        arcs = self.ordered_arcs()
+        arc_ends = [(rows[self.arcs[a][0]], rows[self.arcs[a][1]]) for a in arcs]
+        # The model is known to be valid outside transactions, once what the
+        # last commands touched is checked.
+        checked = self.undo_log is None and not (self.touched_vertices or self.touched_lines or self.touched_arcs)
+        write_brep_binary(brep_file_name, list(self.vertices), self.coordinates(), lines, ends, types,
+                          arcs, arc_ends, [self.arcs[a][2] for a in arcs], checked=checked)
 
     def new_name(self):
-        cnt = 0
         while True:
-            name = 'n' + str(cnt)
-            if name not in self.used_names:
-                self.used_names.add(name)
+            name = 'n' + str(self.name_counter)
+            self.name_counter += 1
+            if self.reserve_prefix or name not in self.used_names:
+                self.use_name(name)
                 return name
-            cnt += 1
 
-    def execute_vertex_command(self, tokens):
-        name = tokens[0]
+    def check_new_name(self, name):
+        if not is_valid_name(name) or name in self.vertices or name in self.lines or name in self.arcs:
+            #print('invalid or duplicated name:', name)
+            raise TaoExcept()
+        if self.reserve_prefix and is_generated_name(name):
+            #print('reserved name:', name)
+            raise TaoExcept()
+
+    def execute_vertex_command(self, command):
+        name = command.name
         def extract_coord(token, idx):
-            if is_number(token):
-                return float(token)
+            if isinstance(token, float):
+                return token if self.resolution is None else self.quantize(token)
             if token in self.vertices:
                 return self.vertices[token][idx]
             if token in self.lines:
@@ -270,61 +1509,73 @@ class SimpleBrep(object):
             raise TaoExcept()
 
         # Grab x.
-        vx = extract_coord(tokens[1], 0)
-        vy = extract_coord(tokens[2], 1)
+        vx = extract_coord(command.x, 0)
+        vy = extract_coord(command.y, 1)
 
-        # First, check if this vertex is new.
-        if not is_valid_name(name) or name in self.vertices or name in self.lines:
-            #print('invalid or duplicated name:', name)
-            raise TaoExcept()
-        for n, (x, y) in self.vertices.items():
-            if vx == x and vy == y:
-                #print('duplicated vertices:', name, n)
-                raise TaoExcept() 
-        self.vertices[name] = np.array([vx, vy], dtype=np_type)
-        self.used_names.add(name)
-        # Check if we need to further segment any lines.
-        new_lines = {}
-        for l, (v0, v1, t) in self.lines.items():
-            v0x, v0y = self.vertices[v0]
-            v1x, v1y = self.vertices[v1]
-            if t == 'h' and v0y == vy and v0x < vx < v1x:
-                # Split it into two horizontal lines.
-                l1 = self.new_name()
-                new_lines[l1] = (v0, name, 'h')
-                l2 = self.new_name()
-                new_lines[l2] = (name, v1, 'h')
-            elif t == 'v' and v0x == vx and v0y < vy < v1y:
-                # Split it into two vertical lines.
-                l1 = self.new_name()
-                new_lines[l1] = (v0, name, 'v')
-                l2 = self.new_name()
-                new_lines[l2] = (name, v1, 'v')
-            else:
-                new_lines[l] = (v0, v1, t)
-        self.lines = new_lines
-        self.check_brep()
-
-    def execute_line_command(self, tokens):
-        name = tokens[0]
-        if not is_valid_name(name) or name in self.vertices or name in self.lines:
-            #print('invalid or duplicated names:', name)
-            raise TaoExcept()
-        if tokens[1] not in ['v', 'h']:
-            #print('invalid line type:', tokens[1])
+        # First, check if this vertex is new. Once there are arcs, a vertex
+        # within the tolerance of another is that vertex.
+        self.check_new_name(name)
+        if self.arcs:
+            vx, vy, near = self.snap_point(vx, vy, point_tolerance(vx, vy))
+            if near is not None:
+                #print('duplicated vertices:', name, near)
+                raise TaoExcept()
+        if self.index.vertex_at(vx, vy) is not None:
+            #print('duplicated vertices:', name, self.index.vertex_at(vx, vy))
             raise TaoExcept() 
-        new_t = tokens[1]
-        if tokens[2] != 'start':
-            #print('invalid token, expect to see start:', tokens[2])
-            raise TaoExcept()
+        self.insert_vertex(name, vx, vy)
+        if self.undo_log is None:
+            self.validate()
+
+    def insert_vertex(self, name, x, y):
+        self.add_vertex(name, x, y)
+        # Check if we need to further segment any lines.
+        split = self.index.lines_containing('h', x, y) + self.index.lines_containing('v', x, y)
+        for l in sorted(split, key=self.line_order_key):
+            self.split_line(l, name)
+        if self.arcs:
+            for a in sorted(self.arcs_containing(x, y), key=self.arc_order_key):
+                self.split_arc(a, name)
 
-        def try_new_vertex(x, y):
-            for n, (vx, vy) in self.vertices.items():
-                if x == vx and y == vy:
-                    return n
-            n = self.new_name()
-            self.execute_vertex_command([n, x, y])
+    def try_new_vertex(self, x, y, snap=0.0):
+        # The vertex at (x, y), created if there is none. With snap, points
+        # computed on arcs join the vertex (or the lines) within that distance.
+        # Once the model has arcs, every point snaps within point_tolerance at
+        # least, as the vertices made on arcs are only that exact.
+        n = self.index.vertex_at(x, y)
+        if n is not None:
             return n
+        if snap or self.arcs:
+            x, y, n = self.snap_point(x, y, max(snap, point_tolerance(x, y)))
+            if n is None:
+                n = self.index.vertex_at(x, y)
+            if n is not None:
+                return n
+        n = self.new_name()
+        self.insert_vertex(n, x, y)
+        return n
+
+    def snap_point(self, x, y, eps):
+        # (x, y, None) moved onto the lines passing within eps of it, or the
+        # (x, y, name) of the closest vertex within eps.
+        box = (x - eps, y - eps, x + eps, y + eps)
+        near = [(abs(vx - x) + abs(vy - y), n, vx, vy) for vx, vy, n in self.index.vertices_in_box(box)]
+        if near:
+            _, n, vx, vy = min(near)
+            return vx, vy, n
+        # The nearest horizontal and the nearest vertical line.
+        ys = [self.index.line_keys[l][1] for l in self.index.lines_in_box('h', box)]
+        xs = [self.index.line_keys[l][1] for l in self.index.lines_in_box('v', box)]
+        if ys:
+            y = min(ys, key=lambda fixed: abs(fixed - y))
+        if xs:
+            x = min(xs, key=lambda fixed: abs(fixed - x))
+        return x, y, None
+
+    def execute_line_command(self, command):
+        name = command.name
+        self.check_new_name(name)
+        new_t = command.type
 
         def parse_line_endpoints(token):
             line, flag = token.split('_')
@@ -344,48 +1595,49 @@ class SimpleBrep(object):
                 raise TaoExcept()
 
         # Get the starting vertex.
-        if is_number(tokens[3]):
-            start_v = try_new_vertex(float(tokens[3]), float(tokens[4]))
+        start = command.start
+        if isinstance(start, tuple):
+            if self.resolution is not None:
+                start = (self.quantize(start[0]), self.quantize(start[1]))
+            start_v = self.try_new_vertex(start[0], start[1])
         else:
             # It must be an existing vertex.
-            if tokens[3] in self.vertices:
-                start_v = tokens[3]
-            elif '_' in tokens[3]:
-                start_v = parse_line_endpoints(tokens[3])
+            if start in self.vertices:
+                start_v = start
+            elif '_' in start:
+                start_v = parse_line_endpoints(start)
             else:
-                #print('invalid vertex name:', tokens[3])
+                #print('invalid vertex name:', start)
                 raise TaoExcept()
 
         sx, sy = self.vertices[start_v]
         ex, ey = sx, sy
         end_v = ''
         # Now get the ending point.
-        if tokens[-2] != 'end':
-            #print('invalid token. expect to see end:', tokens[-2])
-            raise TaoExcept()
-        if is_number(tokens[-1]):
-            length = float(tokens[-1])
+        end = command.end
+        if isinstance(end, float):
+            length = end if self.resolution is None else self.quantize(end)
             if new_t == 'h':
                 ex += length
             else:
                 ey += length
-            end_v = try_new_vertex(ex, ey)
-        elif tokens[-1] in self.vertices:
-            end_v = tokens[-1]
-        elif '_' in tokens[-1]:
-            end_v = parse_line_endpoints(tokens[-1])
-        elif tokens[-1] in self.lines:
-            v1, _, t = self.lines[tokens[-1]]
+            end_v = self.try_new_vertex(ex, ey)
+        elif end in self.vertices:
+            end_v = end
+        elif '_' in end:
+            end_v = parse_line_endpoints(end)
+        elif end in self.lines:
+            v1, _, t = self.lines[end]
             if new_t == t:
-                #print('cannot use the same type of lines to define the endpoint:', tokens[-1])
+                #print('cannot use the same type of lines to define the endpoint:', end)
                 raise TaoExcept()
             if new_t == 'h':
                 ex = self.vertices[v1][0]
             else:
                 ey = self.vertices[v1][1]
-            end_v = try_new_vertex(ex, ey)
+            end_v = self.try_new_vertex(ex, ey)
         else:
-            #print('invalid token:', tokens[-1])
+            #print('invalid token:', end)
             raise TaoExcept()
 
         # Now we have start_v and end_v. 
@@ -396,101 +1648,426 @@ class SimpleBrep(object):
             raise TaoExcept()
         if (new_t == 'h' and sx > ex) or (new_t == 'v' and sy > ey):
             start_v, end_v = end_v, start_v
-        self.lines[name] = (start_v, end_v, new_t)
-        self.used_names.add(name)
-        self.resolve_overlap_lines()
-        self.resolve_cross_lines()
-        self.check_brep()
-
-    def resolve_overlap_lines(self):
-        new_lines = {}
-        new_segmented_lines = {}
-        for l, (v1, v2, t) in self.lines.items():
+        self.add_line(name, start_v, end_v, new_t, self.new_slot())
+        self.use_name(name)
+        key = self.index.line_keys[name]
+        segments = self.resolve_overlap_lines([name])
+        self.resolve_cross_lines(segments)
+        if self.arcs:
+            points = []
+            for a in self.arcs_meeting_line(*key):
+                arc = self.arcs[a][2]
+                points += [(x, y, tolerance(arc[2])) for x, y in line_crossings(arc, *key)]
+            self.resolve_arc_crossings(sorted(points))
+        if self.undo_log is None:
+            self.validate()
+
+    def execute_arc_command(self, command):
+        name = command.name
+        self.check_new_name(name)
+        if self.resolution is not None:
+            #print('arcs are not supported with a resolution:', name)
+            raise TaoExcept()
+        arc = normalize_arc(command.x, command.y, command.r, command.start, command.end)
+        if arc is None:
+            #print('invalid arc:', command.to_lang())
+            raise TaoExcept()
+        eps = tolerance(arc[2])
+        (sx, sy), (ex, ey) = arc_endpoints(arc)
+        start_v = self.try_new_vertex(sx, sy, snap=eps)
+        end_v = self.try_new_vertex(ex, ey, snap=eps)
+        if start_v == end_v:
+            #print('degenerated arc:', name)
+            raise TaoExcept()
+        self.add_arc(name, start_v, end_v, arc, self.new_slot())
+        self.use_name(name)
+
+        # Split the arc at the vertices lying on it, in order along the arc.
+        # Vertices within the tolerance of the last split are the same point.
+        middle = [(arc_angle(arc, x, y), v) for x, y, v in self.index.vertices_in_box(arc_box(arc))
+                  if arc_contains(arc, x, y)]
+        piece = name
+        last = None
+        for theta, v in sorted(middle):
+            if last is not None and theta - last <= angle_margin(arc[2]):
+                continue
+            piece = self.split_arc(piece, v)[1]
+            last = theta
+
+        # Then insert a vertex wherever it crosses a line or another arc.
+        box = arc_box(arc)
+        points = []
+        for t in ['h', 'v']:
+            for l in self.index.lines_in_box(t, box):
+                points += line_crossings(arc, *self.index.line_keys[l])
+        for other in self.index.arcs.overlapping(box):
+            points += arc_crossings(arc, self.arcs[other][2])
+        points.sort(key=lambda p: arc_angle(arc, *p))
+        self.resolve_arc_crossings([(x, y, eps) for x, y in points])
+        if self.undo_log is None:
+            self.validate()
+
+    def resolve_arc_crossings(self, points):
+        # Insert a vertex at each of the (x, y, tolerance) points where an arc
+        # crosses something, splitting whatever passes through it. Points
+        # within the tolerance of an existing vertex are that vertex. Returns
+        # the points, which the profiler counts.
+        for x, y, eps in points:
+            self.try_new_vertex(x, y, snap=eps)
+        return points
+
+    def resolve_overlap_lines(self, lines=None):
+        # Split every line (or only the given ones) at the vertices lying inside
+        # it. The pieces are appended after all the other lines, and pieces
+        # duplicating an existing line are dropped. Returns the lines that now
+        # cover the given ones.
+        inside = None
+        if lines is None:
+            lines = self.ordered_lines()
+            if self.tiled():
+                # The vertices inside every line, found on tiles.
+                from tiles import vertices_inside_tiled
+                vertex_names, xy, line_names, ends, types = self.columns()
+                inside = dict((line_names[l], [vertex_names[v] for v in rows])
+                              for l, rows in vertices_inside_tiled(xy, ends, types, self.jobs).items())
+        else:
+            lines = sorted(lines, key=self.line_order_key)
+        new_segmented_lines = []
+        result = []
+        for l in lines:
+            v1, v2, t = self.lines[l]
             fixed_idx = 1 if t == 'h' else 0
             x0 = self.vertices[v1][1 - fixed_idx]
             x1 = self.vertices[v2][1 - fixed_idx]
             y = self.vertices[v1][fixed_idx]
-            middle = []
-            for vn, v in self.vertices.items():
-                vx = v[1 - fixed_idx]
-                vy = v[fixed_idx]
-                if vy == y and x0 < vx < x1:
-                    middle.append((vx, vn))
+            if inside is None:
+                middle = [v for _, v in self.index.vertices_inside(t, y, x0, x1)]
+            else:
+                middle = inside.get(l, [])
             if middle:
-                middle = sorted(middle, key=lambda v : v[0])
-                middle = [(x0, v1)] + middle + [(x1, v2)]
+                middle = [v1] + middle + [v2]
+                segments = []
                 for i in range(len(middle) - 1):
                     new_ln = self.new_name()
-                    new_segmented_lines[new_ln] = (middle[i][1], middle[i + 1][1], t)
+                    segments.append((new_ln, middle[i], middle[i + 1], t))
+                new_segmented_lines.append((l, segments))
             else:
-                new_lines[l] = (v1, v2, t)
+                result.append(l)
+        for l, _ in new_segmented_lines:
+            self.remove_line(l)
         # If a new segmented lines have not been seen before, add it.
-        for l, (s, e, t) in new_segmented_lines.items():
-            skip = False
-            for l2, (s2, e2, _) in new_lines.items():
-                if s == s2 and e == e2:
-                    skip = True
-                    break
-            if not skip:
-                new_lines[l] = (s, e, t)
-        self.lines = new_lines
-
-    def resolve_cross_lines(self):
+        for l, segments in new_segmented_lines:
+            slot = self.new_slot()
+            for new_ln, s, e, t in segments:
+                if not self.index.find_lines(t, self.vertices[s], self.vertices[e]):
+                    self.add_line(new_ln, s, e, t, slot)
+                    result.append(new_ln)
+        return result
+
+    def resolve_cross_lines(self, lines=None, pairwise=False):
+        # Insert a vertex wherever two lines cross, splitting both of them. With
+        # lines, only crossings involving those lines are resolved. All the
+        # crossings are found first and inserted in one batch; the caller
+        # validates the result.
+        if pairwise:
+            crossings = self.find_cross_lines_pairwise()
+        else:
+            crossings = self.find_cross_lines(lines)
         intersections = {}
-        for l1, (s1, e1, t1) in self.lines.items():
+        for x, y in crossings:
+            n_v = self.new_name()
+            intersections[n_v] = (x, y)
+        for n, (x, y) in intersections.items():
+            self.insert_vertex(n, x, y)
+
+    def find_cross_lines(self, lines=None):
+        # Crossing points, in the order find_cross_lines_pairwise reports them.
+        # All the lines are swept at once; given lines query the index instead.
+        pairs = []
+        if lines is None:
+            hnames, vnames = [], []
+            hsegs, vsegs = [], []
+            for l, (v0, v1, t) in self.lines.items():
+                (x0, y0), (x1, y1) = self.vertices[v0], self.vertices[v1]
+                if t == 'h':
+                    hnames.append(l)
+                    hsegs.append((y0, x0, x1))
+                else:
+                    vnames.append(l)
+                    vsegs.append((x0, y0, y1))
+            if self.tiled():
+                from tiles import find_crossings_tiled
+                crossings = find_crossings_tiled(hsegs, vsegs, self.jobs)
+            else:
+                crossings = find_crossings(hsegs, vsegs)
+            for h, v, x, y in crossings:
+                pairs.append((hnames[h], vnames[v], x, y))
+        else:
+            given = set(lines)
+            for l in lines:
+                v0, v1, t = self.lines[l]
+                fixed_idx = 1 if t == 'h' else 0
+                y = self.vertices[v0][fixed_idx]
+                lo = self.vertices[v0][1 - fixed_idx]
+                hi = self.vertices[v1][1 - fixed_idx]
+                for x, other in self.index.lines_crossing(t, y, lo, hi):
+                    if other in given and other < l:
+                        continue
+                    pairs.append((l, other) + ((x, y) if t == 'h' else (y, x)))
+        found = []
+        for l1, l2, x, y in pairs:
+            if l1 > l2:
+                l1, l2 = l2, l1
+            found.append((self.line_order_key(l1), self.line_order_key(l2), x, y))
+        found.sort()
+        return [(x, y) for _, _, x, y in found]
+
+    def find_cross_lines_pairwise(self):
+        # Reference implementation of find_cross_lines over all lines.
+        crossings = []
+        ordered = self.ordered_lines()
+        for l1 in ordered:
+            s1, e1, t1 = self.lines[l1]
             fixed_idx = 1 if t1 == 'h' else 0
             x0 = self.vertices[s1][1 - fixed_idx]
             x1 = self.vertices[e1][1 - fixed_idx]
             y = self.vertices[s1][fixed_idx]
-            for l2, (s2, e2, t2) in self.lines.items():
+            for l2 in ordered:
+                s2, e2, t2 = self.lines[l2]
                 if l1 >= l2 or t1 == t2: continue
                 y0 = self.vertices[s2][fixed_idx]
                 y1 = self.vertices[e2][fixed_idx]
                 x = self.vertices[s2][1 - fixed_idx]
                 if x0 < x < x1 and y0 < y < y1:
-                    n_v = self.new_name()
-                    intersections[n_v] = (x, y) if t1 == 'h' else (y, x)
-        for n, (x, y) in intersections.items():
-            self.execute_vertex_command([n, x, y])
-
-    def execute_command(self, command):
-        #TODO: use parse_command here
-        tokens = command.split()
-        if len(tokens) == 3:
-            # Vertex.
-            self.execute_vertex_command(tokens)
-        elif len(tokens) == 6 or len(tokens) == 7:
-            # Line.
-            self.execute_line_command(tokens)
+                    crossings.append((x, y) if t1 == 'h' else (y, x))
+        return crossings
+
+    def execute_command(self, command, source=None):
+        # command is an AST object from parse_command, or a string to parse.
+        # source, the (line number, text) it came from, is for the profiler.
+        if not isinstance(command, (VertexCommand, LineCommand, ArcCommand)):
+            command = self.parse_command(command)
+        if isinstance(command, VertexCommand):
+            self.execute_vertex_command(command)
+        elif isinstance(command, ArcCommand):
+            self.execute_arc_command(command)
         else:
-            #print('invalid command:', command)
-            raise TaoExcept() 
+            self.execute_line_command(command)
 
-    def execute_command_file(self, command_file_name):
-        with open(command_file_name, 'r') as f:
-            while True:
-                line = f.readline()
-                if not line: break
-                line = line.strip()
-    
-                # Ignore comments.
-                if '#' in line:
-                    line = line[:line.find('#')].strip()
-    
-                # Ignore empty lines.
-                if not line: continue
-                tokens = line.split()
-                if not tokens: continue
+    def execute_command_file(self, command_file_name, batch=True):
+        Program.from_file(command_file_name).execute(self, batch=batch)
+
+    def enable_profiling(self, trace=False):
+        # Time the phases of command execution from now on, and count splits,
+        # intersections and generated names. With trace, also keep a record of
+        # every command. See profiler.py.
+        if self.profiler is not None:
+            self.disable_profiling()
+        self.profiler = Profiler(trace)
+        self.profiler.attach(self)
+        return self.profiler
+
+    def disable_profiling(self):
+        profiler, self.profiler = self.profiler, None
+        profiler.detach(self)
+        return profiler
+
+def run(command_file_name, brep_name, batch=True, binary=False, profile=False, trace=None, cache=None,
+        storage='python', resolution=None):
+    # With profile, print the hot phases; with trace, write the per-command
+    # records to that file ('-' for stdout) as JSON lines. With a
+    # CompileCache, only the commands after the longest checkpointed prefix are
+    # executed (and profiled).
+    model = SimpleBrep(storage=storage, resolution=resolution)
+    if profile or trace:
+        model.enable_profiling(trace=bool(trace))
+    try:
+        if cache is None:
+            model.execute_command_file(command_file_name, batch=batch)
+        else:
+            cache.compile(Program.from_file(command_file_name), model, batch=batch)
+    finally:
+        if profile:
+            print(model.profiler.report())
+        if trace == '-':
+            model.profiler.dump_trace(sys.stdout)
+        elif trace:
+            with open(trace, 'w') as f:
+                model.profiler.dump_trace(f)
+    if binary:
+        model.save_brep_binary(brep_name)
+    else:
+        model.save_brep(brep_name)
+
+def output_name(command_file_name, binary=False):
+    # a/b.c.lang -> a/b.c.brep (or .brepb)
+    return os.path.splitext(command_file_name)[0] + ('.brepb' if binary else '.brep')
+
+def expand_inputs(patterns, manifest=None):
+    """
+    Input file names or glob patterns, and optionally a manifest file listing
+    more of them, one per line (# starts a comment)
+    Output the file names, in order and without duplicates. Patterns matching
+    nothing are kept as they are, so that they fail as missing files
+    """
+    patterns = list(patterns)
+    if manifest is not None:
+        base = os.path.dirname(manifest)
+        with open(manifest, 'r') as f:
+            for line in f:
+                line = line.split('#')[0].strip()
+                if line:
+                    patterns.append(os.path.join(base, line))
+    names = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern)) if glob.has_magic(pattern) else []
+        names.extend(matches or [pattern])
+    return list(dict.fromkeys(names))
+
+def compile_options(batch, binary, storage, resolution):
+    # The options a .brep file was compiled with, as recorded next to it.
+    return 'batch={} binary={} storage={} resolution={}\n'.format(batch, binary, storage, resolution)
+
+def options_name(brep_name):
+    return brep_name + '.options'
+
+def up_to_date(command_file_name, brep_name, options):
+    # Whether the output is newer than the source, and was compiled with the
+    # same options.
+    try:
+        if os.path.getmtime(brep_name) <= os.path.getmtime(command_file_name):
+            return False
+        with open(options_name(brep_name), 'r') as f:
+            return f.read() == options
+    except OSError:
+        return False
+
+# Checkpoint caches of this process, by directory, see compile_file.
+caches = {}
+
+def compile_file(command_file_name, brep_name, batch=True, binary=False, cache_dir=None, storage='python',
+                 resolution=None, record_options=False):
+    """
+    Input a .lang file and the output file name, and optionally the directory
+    of a checkpoint cache (see compile_cache.py). With record_options, the
+    options are written next to the output for up_to_date
+    Output (command file name, status, seconds, message) where status is 'ok',
+    'failed' (the model was rejected with TaoExcept) or 'error' (anything else,
+    e.g. a missing file)
+    """
+    start = time.perf_counter()
+    try:
+        cache = None
+        if cache_dir is not None:
+            if cache_dir not in caches:
+                from compile_cache import CompileCache
+                caches[cache_dir] = CompileCache(directory=cache_dir)
+            cache = caches[cache_dir]
+        # Options recorded for an earlier output no longer hold.
+        if os.path.exists(options_name(brep_name)):
+            os.remove(options_name(brep_name))
+        run(command_file_name, brep_name, batch=batch, binary=binary, cache=cache, storage=storage,
+            resolution=resolution)
+        if record_options:
+            with open(options_name(brep_name), 'w') as f:
+                f.write(compile_options(batch, binary, storage, resolution))
+        status, message = 'ok', brep_name
+        if cache is not None and cache.resumed:
+            message += ' (resumed after {} commands)'.format(cache.resumed)
+    except TaoExcept:
+        status, message = 'failed', 'invalid model'
+    except Exception as e:
+        status, message = 'error', '{}: {}'.format(type(e).__name__, e)
+    return command_file_name, status, time.perf_counter() - start, message
+
+def available_cores():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+def compile_files(command_file_names, jobs=None, batch=True, binary=False, incremental=False, cache_dir=None,
+                  storage='python', resolution=None, out=sys.stdout):
+    # Compile the files in a pool of jobs processes, reporting each result as
+    # it completes. With incremental, files whose output is newer and was
+    # compiled with the same options are skipped. Returns the number of files
+    # that failed.
+    options = compile_options(batch, binary, storage, resolution)
+    todo = []
+    for name in command_file_names:
+        brep_name = output_name(name, binary)
+        if incremental and up_to_date(name, brep_name, options):
+            out.write('skipped {} (up to date)\n'.format(name))
+        else:
+            todo.append((name, brep_name))
+    if jobs is None:
+        jobs = available_cores()
+    jobs = max(1, min(jobs, len(todo)))
 
-                self.execute_command(line)
+    counts = {'ok': 0, 'failed': 0, 'error': 0}
+    def report(result):
+        name, status, seconds, message = result
+        counts[status] += 1
+        out.write('{:<7} {} ({:.3f}s): {}\n'.format(status, name, seconds, message))
+        out.flush()
 
-def run(command_file_name, brep_name):
-    model = SimpleBrep()
-    model.execute_command_file(command_file_name)
-    model.save_brep(brep_name)
+    if jobs == 1:
+        for name, brep_name in todo:
+            report(compile_file(name, brep_name, batch, binary, cache_dir, storage, resolution, incremental))
+    else:
+        from concurrent.futures import ProcessPoolExecutor, as_completed
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            futures = [pool.submit(compile_file, name, brep_name, batch, binary, cache_dir, storage, resolution,
+                                   incremental)
+                       for name, brep_name in todo]
+            for future in as_completed(futures):
+                report(future.result())
+    out.write('{} compiled, {} skipped, {} failed, {} errors\n'.format(
+        counts['ok'], len(command_file_names) - len(todo), counts['failed'], counts['error']))
+    return counts['failed'] + counts['error']
 
 if __name__ == '__main__':
-    command_file_name = sys.argv[1]
-    name, ext = command_file_name.split('.')
-    brep_name = name + '.brep'
-    run(command_file_name, brep_name)
+    parser = argparse.ArgumentParser(description='Compile .lang files into .brep files.')
+    parser.add_argument('command_file_names', nargs='*', metavar='command_file_name',
+                        help='.lang files or glob patterns; a/b.lang is compiled into a/b.brep')
+    parser.add_argument('--manifest', help='a file listing more .lang files or patterns, one per line')
+    parser.add_argument('-j', '--jobs', type=int,
+                        help='number of processes (default: the available cores)')
+    parser.add_argument('--incremental', action='store_true',
+                        help='skip the files whose output is newer than the source and was compiled '
+                             'with the same options (recorded in a .options file next to it)')
+    parser.add_argument('--no-batch', action='store_true',
+                        help='validate after every command instead of once per file')
+    parser.add_argument('--binary', action='store_true',
+                        help='write the binary format (see binary_brep.py) to a .brepb file')
+    parser.add_argument('--cache', metavar='DIR',
+                        help='keep checkpoints in DIR to only recompile what changed in edited files')
+    parser.add_argument('--storage', choices=['python', 'dict', 'columnar'], default='python',
+                        help='how the model is stored (see SimpleBrep); all give the same output')
+    parser.add_argument('--resolution', type=float,
+                        help='snap every coordinate to a multiple of this and compare them exactly (no arcs)')
+    parser.add_argument('--profile', action='store_true',
+                        help='print the time spent in each phase of the compilation')
+    parser.add_argument('--trace', metavar='FILE',
+                        help="write a JSON record per command to FILE ('-' for stdout)")
+    args = parser.parse_args()
+    command_file_names = expand_inputs(args.command_file_names, args.manifest)
+    if not command_file_names:
+        parser.error('no input files')
+    if args.profile or args.trace:
+        # Profile a single file, in this process.
+        if len(command_file_names) != 1:
+            parser.error('--profile and --trace take a single input file')
+        command_file_name = command_file_names[0]
+        cache = None
+        if args.cache:
+            from compile_cache import CompileCache
+            cache = CompileCache(directory=args.cache)
+        run(command_file_name, output_name(command_file_name, args.binary), batch=not args.no_batch,
+            binary=args.binary, profile=args.profile, trace=args.trace, cache=cache, storage=args.storage,
+            resolution=args.resolution)
+    else:
+        failures = compile_files(command_file_names, args.jobs, batch=not args.no_batch,
+                                 binary=args.binary, incremental=args.incremental, cache_dir=args.cache,
+                                 storage=args.storage, resolution=args.resolution)
+        sys.exit(1 if failures else 0)
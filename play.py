@@ -1,9 +1,12 @@
 import sys
-import numpy as np
-import matplotlib.pyplot as plt
-from display import display_brep
+from concurrent.futures import ThreadPoolExecutor
+from arc_geometry import arc_polyline
 from model import SimpleBrep, same_model
 
+# The models are stored without NumPy, and NumPy and matplotlib are only
+# imported once a Renderer is created, so that everything up to the first
+# drawing starts quickly.
+
 def print_error(*message):
     print('\033[91m', 'ERROR ', *message, '\033[0m')
 
@@ -13,30 +16,180 @@ def print_ok(*message):
 def print_warning(*message):
     print('\033[93m', *message, '\033[0m')
 
+class Renderer(object):
+    # Draws the current and the target model side by side into a PNG file. The
+    # figure is created once: the target panel is drawn once, and each frame
+    # only updates the current panel with what was added or removed since the
+    # previous one. Vertex, line and arc names are assumed to keep their geometry
+    # while they exist, which holds as a model never moves them.
+    #
+    # With background, the PNG is written by a worker thread so that the next
+    # command can be typed meanwhile; the figure is not touched until the
+    # previous write is done.
+    def __init__(self, target_model, name='haha.png', background=True):
+        import numpy as np
+        from matplotlib.figure import Figure
+        from matplotlib.collections import LineCollection
+        from display import model_geometry, model_arcs, set_view, VERTEX_COLOR, LINE_COLORS, ARC_COLOR
+        self.name = name
+        self.figure = Figure()
+        self.axes_current, self.axes_target = self.figure.subplots(1, 2)
+
+        xy, segments = model_geometry(target_model)
+        arcs = model_arcs(target_model)
+        self.axes_target.scatter(xy[:, 0], xy[:, 1], c=VERTEX_COLOR, zorder=2)
+        for t, color in LINE_COLORS.items():
+            self.axes_target.add_collection(LineCollection(segments[t], colors=color))
+        self.axes_target.add_collection(LineCollection(arcs, colors=ARC_COLOR))
+        set_view(self.axes_target, np.concatenate([xy] + arcs) if arcs else xy)
+        self.axes_target.set_title('target')
+
+        # What the current panel shows: vertex name -> (x, y), line name ->
+        # type, per line type, line name -> ((x0, y0), (x1, y1)), and arc name
+        # -> polyline.
+        self.points = {}
+        self.line_types = {}
+        self.segments = dict((t, {}) for t in LINE_COLORS)
+        self.arcs = {}
+        self.scatter = self.axes_current.scatter([], [], c=VERTEX_COLOR, zorder=2)
+        self.collections = {}
+        for t, color in LINE_COLORS.items():
+            self.collections[t] = LineCollection([], colors=color)
+            self.axes_current.add_collection(self.collections[t])
+        self.arc_collection = LineCollection([], colors=ARC_COLOR)
+        self.axes_current.add_collection(self.arc_collection)
+        self.axes_current.set_title('current')
+
+        self.executor = ThreadPoolExecutor(max_workers=1) if background else None
+        self.pending = None
+
+    def update(self, model):
+        # Bring the current panel up to date with model. Returns whether
+        # anything changed.
+        import numpy as np
+        from display import set_view
+        vertices, lines = model.vertices, model.lines
+        removed = self.points.keys() - vertices.keys()
+        added = vertices.keys() - self.points.keys()
+        for n in removed:
+            del self.points[n]
+        for n in added:
+            x, y = vertices[n]
+            self.points[n] = (float(x), float(y))
+        changed = bool(removed or added)
+
+        for l in self.line_types.keys() - lines.keys():
+            del self.segments[self.line_types.pop(l)][l]
+            changed = True
+        for l in lines.keys() - self.line_types.keys():
+            v0, v1, t = lines[l]
+            self.line_types[l] = t
+            self.segments[t][l] = (self.points[v0], self.points[v1])
+            changed = True
+
+        for a in self.arcs.keys() - model.arcs.keys():
+            del self.arcs[a]
+            changed = True
+        for a in model.arcs.keys() - self.arcs.keys():
+            self.arcs[a] = np.array(arc_polyline(model.arcs[a][2]))
+            changed = True
+
+        if changed:
+            xy = np.array(list(self.points.values()), dtype=np.float64).reshape(-1, 2)
+            self.scatter.set_offsets(xy)
+            for t, segments in self.segments.items():
+                self.collections[t].set_segments(list(segments.values()))
+            arcs = list(self.arcs.values())
+            self.arc_collection.set_segments(arcs)
+            set_view(self.axes_current, np.concatenate([xy] + arcs) if arcs else xy)
+        return changed
+
+    def render(self, model):
+        # Update the current panel and write the figure.
+        self.wait()
+        self.update(model)
+        if self.executor is None:
+            self.figure.savefig(self.name)
+        else:
+            self.pending = self.executor.submit(self.figure.savefig, self.name)
+
+    def wait(self):
+        # Wait for the PNG being written, if any.
+        if self.pending is not None:
+            self.pending.result()
+            self.pending = None
+
+    def close(self):
+        self.wait()
+        if self.executor is not None:
+            self.executor.shutdown()
+
+class Listing(object):
+    # The vertices, lines and arcs of the current model, printed as they change.
+    # Each turn prints what was removed, the new lines and arcs, and the vertices
+    # that are new or that lines and arcs were added to or removed from, with
+    # the lines leaving them, which the model's index gives without scanning
+    # the lines (see SimpleBrep.neighbours).
+    def __init__(self):
+        # What was printed: line or arc name -> its end vertices.
+        self.vertices = set()
+        self.lines = {}
+        self.arcs = {}
+
+    def update(self, model):
+        changed = set()
+        removed = []
+        for printed, current in ((self.lines, model.lines), (self.arcs, model.arcs)):
+            for name in printed.keys() - current.keys():
+                changed.update(printed.pop(name))
+                removed.append(name)
+        for v in self.vertices - model.vertices.keys():
+            self.vertices.discard(v)
+            removed.append(v)
+        added_lines = sorted(model.lines.keys() - self.lines.keys())
+        added_arcs = sorted(model.arcs.keys() - self.arcs.keys())
+        for name in added_lines:
+            self.lines[name] = model.lines[name][:2]
+            changed.update(self.lines[name])
+        for name in added_arcs:
+            self.arcs[name] = model.arcs[name][:2]
+            changed.update(self.arcs[name])
+        added_vertices = model.vertices.keys() - self.vertices
+        self.vertices.update(added_vertices)
+        changed = sorted((changed | added_vertices) & model.vertices.keys())
+
+        if removed:
+            print('removed:', *sorted(removed))
+        if changed:
+            print('new or changed vertices:')
+            for v in changed:
+                x, y = model.vertices[v]
+                lines = ', '.join('{} {}'.format(d, e) for d, e, _ in model.neighbours(v))
+                print('name:', v, 'val:', x, y, 'lines:', lines or 'none')
+        if added_lines:
+            print('new lines:')
+            for l in added_lines:
+                v0, v1, t = model.lines[l]
+                print('name:', l, 'end points:', v0, v1, 'type:', t)
+        if added_arcs:
+            print('new arcs:')
+            for a in added_arcs:
+                v0, v1, (x, y, r, start, end) = model.arcs[a]
+                print('name:', a, 'end points:', v0, v1, 'center:', x, y, 'radius:', r, 'angles:', start, end)
+
 def display(current_model, target_model, name='haha.png'):
-    fig, (axes_current, axes_target) = plt.subplots(1, 2)
-    def display_model(ax, model, title):
-        vertices = model.vertices
-        lines = model.lines
-        for _, (x, y) in vertices.items():
-            ax.plot(x, y, 'bo')
-        for _, (v0, v1, t) in lines.items():
-            x0, y0 = vertices[v0]
-            x1, y1 = vertices[v1]
-            color = 'r' if t == 'v' else 'g'
-            ax.plot([x0, x1], [y0, y1], color)
-        ax.set_title(title)
-    display_model(axes_current, current_model, 'current')
-    display_model(axes_target, target_model, 'target')
-    plt.savefig(name)
-    plt.clf()
+    # Draw both models once. The play loop keeps a Renderer instead.
+    renderer = Renderer(target_model, name, background=False)
+    renderer.render(current_model)
+    renderer.close()
 
 def run(target_file):
-    target_model = SimpleBrep()
+    target_model = SimpleBrep(storage='python')
     target_model.load_brep(target_file)
 
     # Start playing interactively.
-    current_model = SimpleBrep()
+    current_model = SimpleBrep(storage='python')
+    current_model.enable_history()
     print('all vertices in the target model:')
     for v, (x, y) in enumerate(target_model.vertices.items()):
         print('name:', v, 'val:', x, y)
@@ -55,6 +208,12 @@ def run(target_file):
     print('to create a new line by mixing numerical values and references, type the following command:')
     print_ok('l2 <name> <v|h> <x> <y> <vertex or line name>')
     print_ok('l3 <name> <v|h> <vertex name> <length>')
+    print('to create a new arc of the circle of center (x, y) and radius r, going counterclockwise')
+    print('from theta_start to theta_end (in degrees), type the following command:')
+    print_ok('a0 <name> <x> <y> <r> <theta_start> <theta_end>')
+    print('to take back the last command, or to do it again after taking it back, type:')
+    print_ok('undo')
+    print_ok('redo')
     print('your goal is to replicate the target model while minimizing the number of commands you type')
 
     print_ok('sample solution for square.brep')
@@ -69,33 +228,39 @@ def run(target_file):
     print('l3 right v n2 -1')
     print('l3 bottom h n3 left')
 
+    print_ok('sample solution for curve_flag.brep')
+    print('l0 left v 0 0 2')
+    print('l0 right v 1 1 1')
+    print('a0 top 0.5 2.5 0.7071067811865476 225 315')
+    print('a0 bottom 0.5 1.5 0.7071067811865476 225 315')
+
+    renderer = Renderer(target_model)
+    listing = Listing()
     while True:
         # Show the current progress.
         print('displaying the current progress. press alt + f4 to continue...')
-        display(current_model, target_model)
-
-        # Enumerate all vertices and lines.
-        print('all vertices:')
-        for v, (x, y) in current_model.vertices.items():
-            print('name:', v, 'val:', x, y)
-        print('all lines:')
-        for l, (v0, v1, t) in current_model.lines.items():
-            print('name:', l, 'end points:', v0, v1, 'type:', t)
+        renderer.render(current_model)
+
+        # List what changed since the last turn.
+        listing.update(current_model)
         print('type in your command:')
         s = input()
-        #TODO use parse_command here
-        tokens = s.strip().split()
-        try:
-            if tokens[0] in ['v0', 'v1', 'v2', 'v3']:
-                command = ' '.join(tokens[1:])
-            else:
-                command = ' '.join(tokens[1:3] + ['start'] + tokens[3:-1] + ['end', tokens[-1]])
-            current_model.execute_command(command)
-        except:
-            print_error('invalid command, please retry.')
+        if s.strip() in ['undo', 'redo']:
+            done = current_model.undo() if s.strip() == 'undo' else current_model.redo()
+            if not done:
+                print_warning('nothing to ' + s.strip() + '.')
+        else:
+            try:
+                command = SimpleBrep.parse_command(s)
+                # A failed command is rolled back, leaving the model as it was.
+                with current_model.transaction():
+                    current_model.execute_command(command)
+            except:
+                print_error('invalid command, please retry.')
         if same_model(current_model, target_model):
             print('you have solved the problem!')
             break
+    renderer.close()
 
 if __name__ == '__main__':
     if len(sys.argv) < 2:
@@ -0,0 +1,145 @@
+import json
+import time
+import types
+
+# Per-phase timers and counters for SimpleBrep, see SimpleBrep.enable_profiling.
+#
+# While a profiler is attached, the methods listed in PHASES are replaced on
+# the model instance by wrappers that time them. Nothing is replaced otherwise,
+# so a model that is not profiled runs exactly the same code as before.
+
+PHASES = [
+    'execute_command',
+    'execute_vertex_command',
+    'execute_line_command',
+    'execute_arc_command',
+    'try_new_vertex',
+    'insert_vertex',
+    'split_line',
+    'split_arc',
+    'new_name',
+    'resolve_overlap_lines',
+    'resolve_cross_lines',
+    'find_cross_lines',
+    'resolve_arc_crossings',
+    'commit',
+    'validate',
+    'check_brep',
+    'check_brep_incremental',
+]
+
+# Phase -> (counter, function of the result giving the increment). Phases
+# without a function count their calls. intersections counts the crossings
+# found between lines and those found on arcs, whether with a line or with
+# another arc, including those that land on an existing vertex.
+COUNTERS = {
+    'split_line': ('splits', None),
+    'split_arc': ('splits', None),
+    'new_name': ('generated_names', None),
+    'find_cross_lines': ('intersections', len),
+    'resolve_arc_crossings': ('intersections', len),
+}
+
+class Profiler(object):
+    def __init__(self, trace=False):
+        # Phase -> calls, total seconds, and seconds spent in other phases
+        # called from it.
+        self.calls = {}
+        self.total = {}
+        self.inner = {}
+        self.counters = dict((counter, 0) for counter, _ in COUNTERS.values())
+        # With trace, one record per executed command (see traced).
+        self.records = [] if trace else None
+        self.stack = []
+
+    def __deepcopy__(self, memo):
+        # Copies of a profiled model share its profiler, see attach.
+        return self
+
+    def attach(self, model):
+        # The wrappers are bound to the model, so that a copy of it (e.g. by
+        # copy.deepcopy) runs its own methods, still timed by this profiler.
+        for phase in PHASES:
+            method = getattr(type(model), phase)
+            if phase == 'execute_command' and self.records is not None:
+                wrapper = self.traced(method)
+            else:
+                wrapper = self.timed(phase, method)
+            setattr(model, phase, types.MethodType(wrapper, model))
+
+    def detach(self, model):
+        for phase in PHASES:
+            delattr(model, phase)
+
+    def timed(self, phase, method):
+        counter, increment = COUNTERS.get(phase, (None, None))
+        def wrapper(*args, **kwargs):
+            self.stack.append(0.0)
+            start = time.perf_counter()
+            try:
+                result = method(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                inner = self.stack.pop()
+                if self.stack:
+                    self.stack[-1] += elapsed
+                self.calls[phase] = self.calls.get(phase, 0) + 1
+                self.total[phase] = self.total.get(phase, 0.0) + elapsed
+                self.inner[phase] = self.inner.get(phase, 0.0) + inner
+            if counter is not None:
+                self.counters[counter] += 1 if increment is None else increment(result)
+            return result
+        return wrapper
+
+    def traced(self, method):
+        # execute_command, timed and recorded with what happened inside it.
+        timed = self.timed('execute_command', method)
+        def wrapper(model, command, source=None):
+            total = dict(self.total)
+            counters = dict(self.counters)
+            if source is not None:
+                # As written in the command file.
+                record = {'line': source[0], 'command': source[1]}
+            else:
+                record = {'command': command if isinstance(command, str) else command.to_lang()}
+            start = time.perf_counter()
+            try:
+                timed(model, command, source)
+                record['ok'] = True
+            except Exception:
+                record['ok'] = False
+                raise
+            finally:
+                record['seconds'] = time.perf_counter() - start
+                record['phases'] = dict((phase, t - total.get(phase, 0.0))
+                                        for phase, t in self.total.items()
+                                        if phase != 'execute_command' and t != total.get(phase))
+                record['counters'] = dict((c, n - counters[c])
+                                          for c, n in self.counters.items() if n != counters[c])
+                self.records.append(record)
+        return wrapper
+
+    def report(self):
+        """
+        Output the phases, hottest first by the time spent in the phase itself,
+        and the counters, as text
+        """
+        rows = []
+        for phase in self.calls:
+            own = self.total[phase] - self.inner[phase]
+            rows.append((own, phase))
+        rows.sort(reverse=True)
+        lines = ['{:<24}{:>10}{:>12}{:>12}{:>12}'.format('phase', 'calls', 'own (s)', 'total (s)', 'mean (ms)')]
+        for own, phase in rows:
+            calls, total = self.calls[phase], self.total[phase]
+            lines.append('{:<24}{:>10}{:>12.4f}{:>12.4f}{:>12.4f}'.format(
+                phase, calls, own, total, 1000.0 * total / calls))
+        lines.append('')
+        for counter in sorted(self.counters):
+            lines.append('{:<24}{:>10}'.format(counter, self.counters[counter]))
+        return '\n'.join(lines)
+
+    def dump_trace(self, f):
+        # One JSON object per line and command.
+        for record in self.records or []:
+            f.write(json.dumps(record) + '\n')
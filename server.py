@@ -0,0 +1,366 @@
+import sys
+import os
+import io
+import json
+import socket
+import asyncio
+import threading
+import argparse
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from model import SimpleBrep, Program, TaoExcept, same_model, available_cores
+from compile_cache import CompileCache
+
+# A long-running server hosting named modeling sessions, so that tools making
+# many small requests pay for starting Python and importing NumPy once.
+#
+#   python server.py --socket /tmp/brep.sock
+#   python server.py --stdio
+#
+# Requests and responses are JSON objects, one per line. A request has an
+# "op", and optionally an "id" that its response repeats. Responses are
+# {"id": ..., "ok": true, ...} or {"id": ..., "ok": false, "error": ...}.
+# Requests on different sessions run concurrently, so responses may come back
+# out of order; the requests of one session run one after the other.
+#
+#   open        session, and optionally storage ('dict', 'python' or
+#               'columnar') and resolution (see SimpleBrep): a new empty model
+#   close       session
+#   sessions    the names of the open sessions
+#   command     session, command (in the .lang or play.py syntax) or commands
+#               (a list of them, executed as one transaction)
+#   compile     session, lang (the text of a .lang file) or lang_path: the
+#               session's model becomes the compiled program
+#   load_brep   session, path (.brepb files are read as binary)
+#   save_brep   session, path (.brepb files are written as binary)
+#   brep        session: the .brep text of the model
+#   same_model  session, and other (a session) or path (a .brep file)
+#   undo, redo  session
+#   shutdown
+#
+# Failed commands leave the model as it was. Responses about a model carry its
+# numbers of vertices, lines and arcs.
+#
+# Programs and command lists longer than INLINE_COMMANDS, and files larger
+# than INLINE_BYTES, are run, compiled and loaded in a pool of worker
+# processes, so that they do not hold up the other sessions.
+#
+# On shutdown, the requests already running are answered before the server
+# stops; requests arriving after it get an error.
+
+INLINE_COMMANDS = 256
+INLINE_BYTES = 1 << 16
+# Models loaded by same_model from files, kept by path.
+TARGET_CACHE_SIZE = 64
+# The longest request line accepted.
+LINE_LIMIT = 1 << 30
+
+# In the worker processes: checkpoint caches by directory (None: memory only).
+worker_caches = {}
+
+def compile_model(lang_text, options, batch=True, cache_dir=None):
+    # Run in a worker process; the model is pickled back. options are the
+    # arguments of SimpleBrep.
+    if cache_dir not in worker_caches:
+        worker_caches[cache_dir] = CompileCache(directory=cache_dir)
+    model = SimpleBrep(**options)
+    worker_caches[cache_dir].compile(Program.from_lines(lang_text.splitlines()), model, batch)
+    return model
+
+def execute_commands(model, commands):
+    # Run in a worker process on a copy of the model, which is pickled back.
+    with model.transaction():
+        for command in commands:
+            model.execute_command(command)
+    return model
+
+def load_model(path, options):
+    model = SimpleBrep(**options)
+    if path.endswith('.brepb'):
+        model.load_brep_binary(path)
+    else:
+        model.load_brep(path)
+    return model
+
+class Session(object):
+    def __init__(self, name, storage='dict', resolution=None):
+        self.name = name
+        self.options = {'storage': storage, 'resolution': resolution}
+        self.lock = asyncio.Lock()
+        self.set_model(SimpleBrep(**self.options))
+
+    def set_model(self, model):
+        self.model = model
+        self.model.enable_history()
+
+class Server(object):
+    def __init__(self, jobs=None, cache_dir=None):
+        self.jobs = jobs or available_cores()
+        self.cache_dir = cache_dir
+        self.pool = None
+        self.sessions = {}
+        # path -> (modification time, model), least recently used first.
+        self.targets = OrderedDict()
+        self.stopped = None
+        # The requests being answered, of all clients.
+        self.pending = set()
+
+    def start(self):
+        # Workers forked from the server would inherit the sockets of its
+        # clients, and keep them open after the server closes them.
+        context = multiprocessing.get_context('forkserver')
+        self.pool = ProcessPoolExecutor(max_workers=self.jobs, mp_context=context)
+        self.stopped = asyncio.Event()
+
+    def stop(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+
+    async def offload(self, function, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.pool, function, *args)
+
+    async def respond(self, line):
+        # The response line to a request line.
+        request_id = None
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise ValueError('a request must be a JSON object')
+            request_id = request.get('id')
+            if self.stopped.is_set():
+                raise RuntimeError('the server is shutting down')
+            response = await self.handle(request)
+            response['ok'] = True
+        except TaoExcept:
+            response = {'ok': False, 'error': 'invalid model'}
+        except Exception as e:
+            response = {'ok': False, 'error': '{}: {}'.format(type(e).__name__, e)}
+        response['id'] = request_id
+        return json.dumps(response) + '\n'
+
+    def session(self, request):
+        name = request.get('session')
+        if name not in self.sessions:
+            raise KeyError('unknown session: {}'.format(name))
+        return self.sessions[name]
+
+    async def handle(self, request):
+        op = request.get('op')
+        if op == 'open':
+            name = request['session']
+            if name in self.sessions:
+                raise KeyError('session exists: {}'.format(name))
+            self.sessions[name] = Session(name, request.get('storage', 'dict'), request.get('resolution'))
+            return {}
+        if op == 'sessions':
+            return {'sessions': sorted(self.sessions)}
+        if op == 'shutdown':
+            self.stopped.set()
+            return {}
+        handler = getattr(self, 'op_' + str(op), None)
+        if handler is None:
+            raise ValueError('unknown op: {}'.format(op))
+        session = self.session(request)
+        async with session.lock:
+            response = await handler(session, request)
+        return response
+
+    @staticmethod
+    def counts(model):
+        return {'vertices': len(model.vertices), 'lines': len(model.lines), 'arcs': len(model.arcs)}
+
+    async def op_close(self, session, request):
+        del self.sessions[session.name]
+        return {}
+
+    async def op_command(self, session, request):
+        commands = request['commands'] if 'commands' in request else [request['command']]
+        if len(commands) <= INLINE_COMMANDS:
+            model = session.model
+            with model.transaction():
+                for command in commands:
+                    model.execute_command(command)
+        else:
+            # The copy comes back with its history, so it is not set_model.
+            session.model = await self.offload(execute_commands, session.model, commands)
+        return self.counts(session.model)
+
+    async def op_compile(self, session, request):
+        if 'lang' in request:
+            text = request['lang']
+        else:
+            with open(request['lang_path'], 'r') as f:
+                text = f.read()
+        batch = request.get('batch', True)
+        program = Program.from_lines(text.splitlines())
+        if len(program.commands) <= INLINE_COMMANDS:
+            model = SimpleBrep(**session.options)
+            program.execute(model, batch=batch)
+        else:
+            model = await self.offload(compile_model, text, session.options, batch, self.cache_dir)
+        session.set_model(model)
+        return self.counts(model)
+
+    async def op_load_brep(self, session, request):
+        session.set_model(await self.load(request['path'], session.options))
+        return self.counts(session.model)
+
+    async def load(self, path, options):
+        if os.path.getsize(path) <= INLINE_BYTES:
+            return load_model(path, options)
+        return await self.offload(load_model, path, options)
+
+    async def op_save_brep(self, session, request):
+        path = request['path']
+        if path.endswith('.brepb'):
+            session.model.save_brep_binary(path)
+        else:
+            session.model.save_brep(path)
+        return self.counts(session.model)
+
+    async def op_brep(self, session, request):
+        f = io.StringIO()
+        session.model.write_brep(f)
+        return {'brep': f.getvalue()}
+
+    async def op_same_model(self, session, request):
+        if 'other' in request:
+            other = self.session({'session': request['other']}).model
+        else:
+            other = await self.target(request['path'])
+        return {'same': same_model(session.model, other)}
+
+    async def target(self, path):
+        # The model of a .brep file, reloaded when the file changes.
+        mtime = os.path.getmtime(path)
+        cached = self.targets.get(path)
+        if cached is not None and cached[0] == mtime:
+            self.targets.move_to_end(path)
+            return cached[1]
+        model = await self.load(path, {'storage': 'dict'})
+        self.targets[path] = (mtime, model)
+        self.targets.move_to_end(path)
+        while len(self.targets) > TARGET_CACHE_SIZE:
+            self.targets.popitem(last=False)
+        return model
+
+    async def op_undo(self, session, request):
+        done = session.model.undo()
+        return dict(self.counts(session.model), done=done)
+
+    async def op_redo(self, session, request):
+        done = session.model.redo()
+        return dict(self.counts(session.model), done=done)
+
+    async def serve(self, read_line, write):
+        # Answer the requests of one client until it disconnects, each in its
+        # own task. read_line returns b'' at the end.
+        tasks = set()
+        async def answer(line):
+            await write(await self.respond(line))
+        while True:
+            line = await read_line()
+            if not line:
+                break
+            if not line.strip():
+                continue
+            task = asyncio.ensure_future(answer(line))
+            for running in (tasks, self.pending):
+                running.add(task)
+                task.add_done_callback(running.discard)
+        if tasks:
+            # Unlike gather, wait leaves them running if this is cancelled.
+            await asyncio.wait(tasks)
+
+    async def drain(self):
+        # Wait for the requests being answered, including any they let in.
+        while self.pending:
+            await asyncio.wait(set(self.pending))
+
+    async def serve_socket(self, path):
+        # The connected clients, by the task serving each.
+        clients = {}
+        async def client(reader, writer):
+            async def write(text):
+                writer.write(text.encode('utf-8'))
+                await writer.drain()
+            clients[asyncio.current_task()] = writer
+            try:
+                await self.serve(reader.readline, write)
+            finally:
+                del clients[asyncio.current_task()]
+                writer.close()
+        if os.path.exists(path):
+            os.remove(path)
+        server = await asyncio.start_unix_server(client, path, limit=LINE_LIMIT)
+        try:
+            await self.stopped.wait()
+            await self.drain()
+            # Hang up on the clients that are still connected, which ends
+            # their tasks as if they had disconnected.
+            if clients:
+                for writer in clients.values():
+                    writer.close()
+                await asyncio.wait(list(clients))
+        finally:
+            server.close()
+            await server.wait_closed()
+            os.remove(path)
+
+    async def serve_stdio(self):
+        # stdin may be a file, which the event loop cannot wait on, so lines
+        # are read by a thread. It is a daemon, left blocked on stdin when the
+        # server is shut down.
+        loop = asyncio.get_running_loop()
+        lines = asyncio.Queue()
+        def reader():
+            try:
+                for line in iter(sys.stdin.buffer.readline, b''):
+                    loop.call_soon_threadsafe(lines.put_nowait, line)
+                loop.call_soon_threadsafe(lines.put_nowait, b'')
+            except RuntimeError:
+                # The loop is closed.
+                pass
+        threading.Thread(target=reader, daemon=True).start()
+        async def write(text):
+            sys.stdout.write(text)
+            sys.stdout.flush()
+        serving = asyncio.ensure_future(self.serve(lines.get, write))
+        stopping = asyncio.ensure_future(self.stopped.wait())
+        await asyncio.wait([serving, stopping], return_when=asyncio.FIRST_COMPLETED)
+        if stopping.done():
+            await self.drain()
+        for task in (serving, stopping):
+            task.cancel()
+
+    async def run(self, socket_path=None):
+        self.start()
+        try:
+            if socket_path is None:
+                await self.serve_stdio()
+            else:
+                await self.serve_socket(socket_path)
+        finally:
+            self.stop()
+
+def request(socket_path, **message):
+    # Send one request to a server over its socket and return the response,
+    # for scripts.
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+        s.connect(socket_path)
+        s.sendall(json.dumps(message).encode('utf-8') + b'\n')
+        s.shutdown(socket.SHUT_WR)
+        with s.makefile('rb') as f:
+            return json.loads(f.readline())
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve modeling sessions over JSON lines.')
+    transport = parser.add_mutually_exclusive_group(required=True)
+    transport.add_argument('--socket', metavar='PATH', help='listen on a Unix socket')
+    transport.add_argument('--stdio', action='store_true', help='read requests from stdin, answer on stdout')
+    parser.add_argument('-j', '--jobs', type=int, help='number of worker processes (default: the available cores)')
+    parser.add_argument('--cache', metavar='DIR', help='keep compile checkpoints in DIR (see compile_cache.py)')
+    args = parser.parse_args()
+    asyncio.run(Server(args.jobs, args.cache).run(args.socket))
@@ -0,0 +1,199 @@
+import sys
+import math
+import argparse
+from model import SimpleBrep, VertexCommand, LineCommand, TaoExcept, same_model
+
+# The fewest play.py commands rebuilding a target model, to score solutions.
+#
+#   python solver.py flag.brep                  prints a shortest script
+#   python solver.py flag.brep --score my.txt   checks a script against it
+#
+# No search is needed, as the optimum has a closed form. A line command draws
+# one segment, and the model splits whatever it meets or crosses and merges
+# overlapping collinear lines. So the target falls into runs, maximal chains of
+# collinear lines meeting end to end, and every segment drawn lies within one
+# run. Most vertices of a run come for free, where perpendicular lines cross it
+# or end on it. The others are its two ends, and its interior vertices that no
+# perpendicular line reaches. Each of them must be an end of a segment of the
+# run, or be made by a vertex command, which makes one vertex for the price of
+# a segment making two. A run needing n such points therefore takes at least
+# s = ceil(n / 2) commands, and s overlapping segments are enough: with the
+# points q_0 < ... < q_{n-1}, the segments from q_i to q_{i+n-s}, for i < s.
+# Drawn in that order, each one reaches past the ones before, so none of them
+# duplicates a line. An isolated vertex takes a vertex command. The sum of these
+# lower bounds is reached, so it is the optimum.
+#
+# Targets with arcs are not supported: solver.py exits with status 2, as for
+# invalid .brep files.
+
+def positions(model):
+    # Vertex name -> (x, y), in the units of the commands.
+    if model.resolution is None:
+        return dict((v, (float(x), float(y))) for v, (x, y) in model.vertices.items())
+    d = model.dequantize
+    return dict((v, (d(x), d(y))) for v, (x, y) in model.vertices.items())
+
+def runs(model):
+    # (type, vertex names in order along the run) for every run of the model.
+    found = []
+    for t in ['h', 'v']:
+        following = dict((v0, v1) for v0, v1, lt in model.lines.values() if lt == t)
+        ending = set(following.values())
+        for v in following:
+            if v in ending:
+                continue
+            run = [v]
+            while run[-1] in following:
+                run.append(following[run[-1]])
+            found.append((t, run))
+    return found
+
+def plan(model):
+    """
+    Input a valid SimpleBrep without arcs
+    Output a shortest list of steps rebuilding it: ('vertex', (x, y)) for a
+    vertex command, and (type, (x0, y0), (x1, y1)) for a line command
+    """
+    if model.arcs:
+        raise ValueError('targets with arcs are not supported')
+    points = positions(model)
+    ends = {'h': set(), 'v': set()}
+    for v0, v1, t in model.lines.values():
+        ends[t].update((v0, v1))
+    steps = [('vertex', points[v]) for v in model.vertices if v not in ends['h'] and v not in ends['v']]
+    for t, run in runs(model):
+        other = ends['v' if t == 'h' else 'h']
+        q = [run[0]] + [v for v in run[1:-1] if v not in other] + [run[-1]]
+        n = len(q)
+        s = (n + 1) // 2
+        for i in range(s):
+            steps.append((t, points[q[i]], points[q[i + n - s]]))
+    return steps
+
+def optimum(model):
+    # The fewest commands rebuilding the model.
+    return len(plan(model))
+
+def exact_length(start, end):
+    # A length taking start to end exactly in floating point, or None.
+    length = end - start
+    for _ in range(64):
+        total = start + length
+        if total == end:
+            return length
+        length = math.nextafter(length, math.inf if total < end else -math.inf)
+    return None
+
+def line_command(name, t, p0, p1):
+    # An l0 command drawing the segment from p0 to p1 (or from p1 to p0), or
+    # None if no length reaches the other end exactly.
+    along = 0 if t == 'h' else 1
+    for start, end in [(p0, p1), (p1, p0)]:
+        length = exact_length(start[along], end[along])
+        if length is not None:
+            return LineCommand(name, t, start, length)
+    return None
+
+def end_reference(model, t, p):
+    # The name of a vertex of the model at p, or of a line across the line of
+    # type t through p, which ends a line command there; or None.
+    v = model.index.vertex_at(*p)
+    if v is not None:
+        return v
+    along = 0 if t == 'h' else 1
+    for name, (v0, _, lt) in model.lines.items():
+        if lt != t and model.vertices[v0][along] == p[along]:
+            return name
+    return None
+
+def execute(model, command):
+    # Execute one command the way play.py does: a failed command changes nothing.
+    with model.transaction():
+        model.execute_command(command)
+
+def solve(target):
+    """
+    Input a valid SimpleBrep without arcs
+    Output the play.py commands of a shortest script rebuilding it. The script
+    is checked by running it. A segment whose ends no length joins exactly
+    ends at a vertex or line named instead, or failing that costs an extra
+    vertex command, so the script can be longer than the optimum
+    """
+    model = SimpleBrep(storage='python')
+    commands = []
+    def emit(command):
+        execute(model, command)
+        commands.append(command.to_play())
+    for step in plan(target):
+        if step[0] == 'vertex':
+            emit(VertexCommand('p{}'.format(len(commands)), *step[1]))
+            continue
+        t, p0, p1 = step
+        command = line_command('s{}'.format(len(commands)), t, p0, p1)
+        if command is None:
+            # Start at one end and name the other, made first if needed.
+            for start, end in [(p0, p1), (p1, p0)]:
+                end_name = end_reference(model, t, end)
+                if end_name is not None:
+                    break
+            else:
+                end_name = 'p{}'.format(len(commands))
+                emit(VertexCommand(end_name, *end))
+            command = LineCommand('s{}'.format(len(commands)), t, start, end_name)
+        emit(command)
+    assert same_model(model, target), 'the script does not rebuild the target'
+    return commands
+
+def score(target, lines):
+    """
+    Input a target SimpleBrep and the lines typed into play.py
+    Output (whether they rebuild the target, the number of commands typed).
+    As in play.py, invalid commands are rejected (but counted), and undo and
+    redo take back and repeat commands
+    """
+    model = SimpleBrep(storage='python')
+    model.enable_history()
+    typed = 0
+    for line in lines:
+        line = line.split('#')[0].strip()
+        if not line:
+            continue
+        typed += 1
+        if line == 'undo':
+            model.undo()
+        elif line == 'redo':
+            model.redo()
+        else:
+            try:
+                execute(model, line)
+            except TaoExcept:
+                pass
+    return same_model(model, target), typed
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Find the fewest play.py commands rebuilding a .brep file.')
+    parser.add_argument('brep_file_name')
+    parser.add_argument('--score', metavar='FILE',
+                        help='instead, check the commands in FILE (one per line) against the optimum')
+    args = parser.parse_args()
+    target = SimpleBrep(storage='python')
+    try:
+        target.load_brep(args.brep_file_name)
+        best = optimum(target)
+    except TaoExcept:
+        print('{}: invalid model'.format(args.brep_file_name), file=sys.stderr)
+        sys.exit(2)
+    except ValueError as e:
+        print('{}: {}'.format(args.brep_file_name, e), file=sys.stderr)
+        sys.exit(2)
+    if args.score:
+        with open(args.score, 'r') as f:
+            solved, typed = score(target, f)
+        if solved:
+            print('solved with {} commands, the optimum is {}'.format(typed, best))
+        else:
+            print('not solved after {} commands, the optimum is {}'.format(typed, best))
+        sys.exit(0 if solved else 1)
+    commands = solve(target)
+    print('\n'.join(commands))
+    print('# {} commands, the optimum is {}'.format(len(commands), best), file=sys.stderr)
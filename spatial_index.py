@@ -0,0 +1,307 @@
+import math
+from bisect import bisect_left, bisect_right, insort
+
+# A coordinate-hashed index over the vertices and lines of a SimpleBrep. It is
+# owned by the model and updated on every mutation so that lookups that used to
+# scan the whole model become hash lookups or bisects.
+#
+# - positions: (x, y) -> vertex name.
+# - rows/cols: vertices sharing a y (x) coordinate, sorted by x (y).
+# - hlines/vlines: horizontal (vertical) lines bucketed by y (x), each bucket
+#   sorted by the interval the line covers along the other axis. The bucket
+#   keys are also kept sorted to find the lines within a coordinate range.
+# - arcs: the bounding boxes of the arcs, see BoxIndex.
+# - incident: vertex name -> the names of the lines and arcs ending at it, for
+#   the topology queries of SimpleBrep.
+
+class PointRow(object):
+    # Vertices on one horizontal (vertical) line, sorted by x (y).
+    def __init__(self):
+        self.coords = []
+        self.names = []
+
+    def __len__(self):
+        return len(self.coords)
+
+    def add(self, c, name):
+        i = bisect_right(self.coords, c)
+        self.coords.insert(i, c)
+        self.names.insert(i, name)
+
+    def remove(self, c, name):
+        i = bisect_left(self.coords, c)
+        while self.names[i] != name:
+            i += 1
+        del self.coords[i]
+        del self.names[i]
+
+    def count(self, c):
+        return bisect_right(self.coords, c) - bisect_left(self.coords, c)
+
+    def between(self, lo, hi):
+        # All (coord, name) pairs with lo < coord < hi, sorted by coord.
+        i = bisect_right(self.coords, lo)
+        j = bisect_left(self.coords, hi)
+        return list(zip(self.coords[i:j], self.names[i:j]))
+
+class IntervalBucket(object):
+    # Collinear lines, each stored as (start, end, name) with start <= end and
+    # kept sorted. In a valid model the intervals in a bucket never overlap
+    # (except for exact duplicates, which check_brep rejects).
+    def __init__(self):
+        self.starts = []
+        self.entries = []
+
+    def __len__(self):
+        return len(self.entries)
+
+    def add(self, start, end, name):
+        i = bisect_right(self.entries, (start, end, name))
+        self.entries.insert(i, (start, end, name))
+        self.starts.insert(i, start)
+
+    def remove(self, start, end, name):
+        i = bisect_left(self.entries, (start, end, name))
+        del self.entries[i]
+        del self.starts[i]
+
+    def containing(self, p):
+        # Names of the lines with start < p < end.
+        found = []
+        i = bisect_left(self.starts, p) - 1
+        while i >= 0:
+            start, end, name = self.entries[i]
+            if end <= p:
+                break
+            found.append(name)
+            i -= 1
+        found.reverse()
+        return found
+
+    def overlapping(self, lo, hi):
+        # Names of the lines with start <= hi and end >= lo.
+        found = []
+        i = bisect_right(self.starts, hi) - 1
+        while i >= 0:
+            start, end, name = self.entries[i]
+            if end < lo:
+                break
+            found.append(name)
+            i -= 1
+        found.reverse()
+        return found
+
+    def find(self, start, end):
+        # Names of the lines covering exactly [start, end].
+        found = []
+        i = bisect_left(self.starts, start)
+        while i < len(self.entries) and self.entries[i][0] == start:
+            if self.entries[i][1] == end:
+                found.append(self.entries[i][2])
+            i += 1
+        return found
+
+def boxes_overlap(a, b):
+    return a[0] <= b[2] and b[0] <= a[2] and a[1] <= b[3] and b[1] <= a[3]
+
+class BoxIndex(object):
+    # Named boxes (x0, y0, x1, y1) in a hierarchy of grids. A box goes to the
+    # grid whose cells are the smallest power of two at least as large as the
+    # box, into the (at most four) cells it overlaps, so boxes of any size are
+    # found by looking at a few cells per grid.
+    def __init__(self):
+        # Level -> {(i, j): set of names}, and name -> (level, box).
+        self.grids = {}
+        self.boxes = {}
+
+    def __len__(self):
+        return len(self.boxes)
+
+    @staticmethod
+    def cells(level, box):
+        size = 2.0 ** level
+        return (int(math.floor(box[0] / size)), int(math.floor(box[1] / size)),
+                int(math.floor(box[2] / size)), int(math.floor(box[3] / size)))
+
+    def add(self, name, box):
+        level = math.frexp(max(box[2] - box[0], box[3] - box[1]))[1]
+        grid = self.grids.setdefault(level, {})
+        i0, j0, i1, j1 = self.cells(level, box)
+        for i in range(i0, i1 + 1):
+            for j in range(j0, j1 + 1):
+                grid.setdefault((i, j), set()).add(name)
+        self.boxes[name] = (level, box)
+
+    def remove(self, name):
+        level, box = self.boxes.pop(name)
+        grid = self.grids[level]
+        i0, j0, i1, j1 = self.cells(level, box)
+        for i in range(i0, i1 + 1):
+            for j in range(j0, j1 + 1):
+                cell = grid[(i, j)]
+                cell.discard(name)
+                if not cell:
+                    del grid[(i, j)]
+        if not grid:
+            del self.grids[level]
+
+    def overlapping(self, box):
+        # Names of the boxes overlapping box, sorted.
+        found = set()
+        for level, grid in self.grids.items():
+            i0, j0, i1, j1 = self.cells(level, box)
+            if (i1 - i0 + 1) * (j1 - j0 + 1) > len(grid):
+                keys = [k for k in grid if i0 <= k[0] <= i1 and j0 <= k[1] <= j1]
+            else:
+                keys = [(i, j) for i in range(i0, i1 + 1) for j in range(j0, j1 + 1) if (i, j) in grid]
+            for k in keys:
+                found.update(grid[k])
+        return sorted(n for n in found if boxes_overlap(self.boxes[n][1], box))
+
+class SpatialIndex(object):
+    def __init__(self):
+        self.positions = {}
+        self.rows = {}
+        self.cols = {}
+        self.hlines = {}
+        self.vlines = {}
+        self.hkeys = []
+        self.vkeys = []
+        # Line name -> (type, fixed coord, start, end) so that removal does not
+        # depend on the vertices of the line.
+        self.line_keys = {}
+        # The row keys, sorted on demand for vertices_in_box.
+        self.row_keys = None
+        self.arcs = BoxIndex()
+        self.incident = {}
+
+    def add_vertex(self, name, x, y):
+        x, y = float(x), float(y)
+        self.positions[(x, y)] = name
+        if y not in self.rows:
+            self.row_keys = None
+        self.rows.setdefault(y, PointRow()).add(x, name)
+        self.cols.setdefault(x, PointRow()).add(y, name)
+
+    def remove_vertex(self, name, x, y):
+        x, y = float(x), float(y)
+        if self.positions.get((x, y)) == name:
+            del self.positions[(x, y)]
+        for table, key, c in ((self.rows, y, x), (self.cols, x, y)):
+            table[key].remove(c, name)
+            if not table[key]:
+                del table[key]
+                self.row_keys = None
+
+    def connect(self, name, v0, v1):
+        # The line or arc name now ends at v0 and v1.
+        self.incident.setdefault(v0, set()).add(name)
+        self.incident.setdefault(v1, set()).add(name)
+
+    def disconnect(self, name, v0, v1):
+        # v0 and v1 are the same for degenerate lines, until check_brep rejects
+        # them.
+        for v in set((v0, v1)):
+            edges = self.incident[v]
+            edges.discard(name)
+            if not edges:
+                del self.incident[v]
+
+    def vertex_at(self, x, y):
+        return self.positions.get((float(x), float(y)))
+
+    def count_vertices_at(self, x, y):
+        row = self.rows.get(float(y))
+        if row is None:
+            return 0
+        return row.count(float(x))
+
+    def vertices_inside(self, t, fixed, lo, hi):
+        # Vertices lying strictly inside the segment of type t at the fixed
+        # coordinate, as (coord, name) pairs sorted along the segment.
+        table = self.rows if t == 'h' else self.cols
+        row = table.get(float(fixed))
+        if row is None:
+            return []
+        return row.between(float(lo), float(hi))
+
+    def vertices_in_box(self, box):
+        # Vertices inside the box (x0, y0, x1, y1), borders included, as
+        # (x, y, name).
+        if self.row_keys is None:
+            self.row_keys = sorted(self.rows)
+        x0, y0, x1, y1 = box
+        found = []
+        for y in self.row_keys[bisect_left(self.row_keys, y0):bisect_right(self.row_keys, y1)]:
+            row = self.rows[y]
+            i, j = bisect_left(row.coords, x0), bisect_right(row.coords, x1)
+            found.extend((x, y, n) for x, n in zip(row.coords[i:j], row.names[i:j]))
+        return found
+
+    def line_key(self, t, p0, p1):
+        fixed_idx = 1 if t == 'h' else 0
+        start, end = float(p0[1 - fixed_idx]), float(p1[1 - fixed_idx])
+        if start > end:
+            start, end = end, start
+        return float(p0[fixed_idx]), start, end
+
+    def add_line(self, name, t, p0, p1):
+        fixed, start, end = self.line_key(t, p0, p1)
+        table = self.hlines if t == 'h' else self.vlines
+        if fixed not in table:
+            table[fixed] = IntervalBucket()
+            insort(self.hkeys if t == 'h' else self.vkeys, fixed)
+        table[fixed].add(start, end, name)
+        self.line_keys[name] = (t, fixed, start, end)
+
+    def remove_line(self, name):
+        t, fixed, start, end = self.line_keys.pop(name)
+        table = self.hlines if t == 'h' else self.vlines
+        bucket = table[fixed]
+        bucket.remove(start, end, name)
+        if not bucket:
+            del table[fixed]
+            keys = self.hkeys if t == 'h' else self.vkeys
+            del keys[bisect_left(keys, fixed)]
+
+    def lines_containing(self, t, x, y):
+        # Lines of type t that pass strictly through (x, y).
+        if t == 'h':
+            bucket, p = self.hlines.get(float(y)), float(x)
+        else:
+            bucket, p = self.vlines.get(float(x)), float(y)
+        if bucket is None:
+            return []
+        return bucket.containing(p)
+
+    def lines_crossing(self, t, fixed, lo, hi):
+        # Lines crossing the segment of type t at the fixed coordinate going
+        # from lo to hi, strictly inside both, as (their fixed coord, name).
+        # Every perpendicular bucket between lo and hi is visited, so this
+        # costs the buckets in range plus the crossings, not the crossings
+        # alone: on a dense grid a long segment visits every column.
+        table, keys = (self.vlines, self.vkeys) if t == 'h' else (self.hlines, self.hkeys)
+        found = []
+        for k in keys[bisect_right(keys, float(lo)):bisect_left(keys, float(hi))]:
+            for name in table[k].containing(float(fixed)):
+                found.append((k, name))
+        return found
+
+    def lines_in_box(self, t, box):
+        # Lines of type t that meet the box (x0, y0, x1, y1), borders included.
+        x0, y0, x1, y1 = box
+        table, keys = (self.hlines, self.hkeys) if t == 'h' else (self.vlines, self.vkeys)
+        lo, hi, along_lo, along_hi = (y0, y1, x0, x1) if t == 'h' else (x0, x1, y0, y1)
+        found = []
+        for k in keys[bisect_left(keys, lo):bisect_right(keys, hi)]:
+            found.extend(table[k].overlapping(along_lo, along_hi))
+        return found
+
+    def find_lines(self, t, p0, p1):
+        # Lines of type t going exactly from p0 to p1 (in either direction).
+        fixed, start, end = self.line_key(t, p0, p1)
+        table = self.hlines if t == 'h' else self.vlines
+        bucket = table.get(fixed)
+        if bucket is None:
+            return []
+        return bucket.find(start, end)
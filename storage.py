@@ -0,0 +1,189 @@
+from collections.abc import Mapping
+import numpy as np
+
+# Columnar storage for SimpleBrep, selected with SimpleBrep(storage='columnar').
+# Vertex coordinates live in one contiguous float64 array and lines in int32
+# arrays of endpoint rows and type codes, instead of a dict entry (and a
+# 2-element array) per entity. Both stores read like the dicts they replace, so
+# code reading model.vertices and model.lines keeps working, but they are
+# read-only views: the model changes them through set and remove, and the
+# arrays they hand out cannot be written.
+#
+# What this buys is speed on whole-model passes (check_brep_columnar, binary
+# loads, canonical forms, tiles), which run over the arrays. It does not buy
+# memory while the spatial index exists, as the index keeps every vertex and
+# line by name in its own buckets; models that are only loaded, checked,
+# compared or saved never build it, see SimpleBrep.index.
+
+TYPES = ['h', 'v', 'u']
+TYPE_CODES = {'h': 0, 'v': 1, 'u': 2}
+
+def grow(array, size):
+    # Return array with room for at least size rows, doubling the capacity.
+    if size <= len(array):
+        return array
+    new = np.zeros((max(size, 2 * len(array)),) + array.shape[1:], dtype=array.dtype)
+    new[:len(array)] = array
+    return new
+
+def read_only(array):
+    view = array.view()
+    view.flags.writeable = False
+    return view
+
+class ColumnarVertices(Mapping):
+    # name -> (x, y). Rows are appended in insertion order, and rows is a dict
+    # so it iterates in that order too. remove only drops the name, and the
+    # dead rows are squeezed out by compact, when they make up half of the rows
+    # or before the arrays are read as a whole.
+    def __init__(self):
+        self.xy = np.zeros((16, 2), dtype=np.float64)
+        self.names = []
+        self.rows = {}
+        self.lines = None
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def __contains__(self, name):
+        return name in self.rows
+
+    def __getitem__(self, name):
+        return read_only(self.xy[self.rows[name]])
+
+    def set(self, name, value):
+        row = self.rows.get(name)
+        if row is None:
+            row = len(self.names)
+            self.xy = grow(self.xy, row + 1)
+            self.names.append(name)
+            self.rows[name] = row
+        self.xy[row] = value
+
+    def remove(self, name):
+        row = self.rows.pop(name)
+        value = self.xy[row].copy()
+        self.names[row] = None
+        if 2 * len(self.rows) < len(self.names):
+            self.compact()
+        return value
+
+    def compact(self):
+        # Renumber the live rows 0, 1, ... in order, and the line ends with them.
+        if len(self.rows) == len(self.names):
+            return
+        live = np.fromiter(self.rows.values(), dtype=np.int64, count=len(self.rows))
+        renumber = np.full(len(self.names), -1, dtype=np.int32)
+        renumber[live] = np.arange(len(live), dtype=np.int32)
+        self.xy = grow(self.xy[live], 16)
+        self.names = list(self.rows)
+        self.rows = dict(zip(self.names, range(len(self.names))))
+        if self.lines is not None:
+            self.lines.renumber_vertices(renumber)
+
+    def coords(self):
+        # The coordinates of the vertices, in order, as an n x 2 array.
+        self.compact()
+        return read_only(self.xy[:len(self.names)])
+
+class ColumnarLines(Mapping):
+    # name -> (vertex name, vertex name, type). Rows freed by deleted lines are
+    # reused, so the arrays are only meaningful where alive is set.
+    def __init__(self, vertices):
+        self.vertices = vertices
+        vertices.lines = self
+        self.ends = np.zeros((16, 2), dtype=np.int32)
+        self.types = np.zeros(16, dtype=np.int32)
+        self.alive = np.zeros(16, dtype=bool)
+        self.names = []
+        self.rows = {}
+        self.free = []
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def __contains__(self, name):
+        return name in self.rows
+
+    def __getitem__(self, name):
+        row = self.rows[name]
+        v0, v1 = self.ends[row].tolist()
+        names = self.vertices.names
+        return (names[v0], names[v1], TYPES[self.types[row]])
+
+    def set(self, name, value):
+        v0, v1, t = value
+        row = self.rows.get(name)
+        if row is None:
+            if self.free:
+                row = self.free.pop()
+                self.names[row] = name
+            else:
+                row = len(self.names)
+                self.ends = grow(self.ends, row + 1)
+                self.types = grow(self.types, row + 1)
+                self.alive = grow(self.alive, row + 1)
+                self.names.append(name)
+            self.rows[name] = row
+            self.alive[row] = True
+        self.ends[row] = (self.vertices.rows[v0], self.vertices.rows[v1])
+        self.types[row] = TYPE_CODES[t]
+
+    def remove(self, name):
+        row = self.rows.pop(name)
+        self.alive[row] = False
+        self.names[row] = None
+        self.free.append(row)
+
+    def renumber_vertices(self, renumber):
+        rows = np.flatnonzero(self.alive[:len(self.names)])
+        self.ends[rows] = renumber[self.ends[rows]]
+
+    def columns(self):
+        # (names, endpoint rows, type codes) of the live lines, the rows being
+        # those of vertices.coords(). The arrays are copies; use set_columns
+        # to write them back.
+        self.vertices.compact()
+        rows = np.flatnonzero(self.alive[:len(self.names)])
+        return [self.names[r] for r in rows], self.ends[rows], self.types[rows]
+
+    def set_columns(self, ends, types):
+        rows = np.flatnonzero(self.alive[:len(self.names)])
+        self.ends[rows] = ends
+        self.types[rows] = types
+
+def to_columnar(vertices, lines):
+    # Build columnar stores from plain dicts.
+    cv = ColumnarVertices()
+    names = list(vertices)
+    cv.xy = np.zeros((max(len(names), 16), 2), dtype=np.float64)
+    if names:
+        cv.xy[:len(names)] = [vertices[n] for n in names]
+    cv.names = names
+    cv.rows = dict((n, i) for i, n in enumerate(names))
+    cl = ColumnarLines(cv)
+    for l, value in lines.items():
+        cl.set(l, value)
+    return cv, cl
+
+def wrap_columnar(vertex_names, xy, line_names, ends, types):
+    # Build columnar stores around existing arrays (e.g. a mapped binary
+    # .brep file, see binary_brep.py) without copying them. Names must be
+    # unique and ends must be rows of xy.
+    cv = ColumnarVertices()
+    cv.xy = xy
+    cv.names = list(vertex_names)
+    cv.rows = dict((n, i) for i, n in enumerate(cv.names))
+    cl = ColumnarLines(cv)
+    cl.ends = ends
+    cl.types = types
+    cl.alive = np.ones(len(line_names), dtype=bool)
+    cl.names = list(line_names)
+    cl.rows = dict((n, i) for i, n in enumerate(cl.names))
+    return cv, cl
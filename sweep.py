@@ -0,0 +1,65 @@
+from bisect import bisect_left, bisect_right
+
+# Intersection engine for axis-aligned segments. A sweep over x keeps the
+# horizontal segments that span the current x in an ordered active set (sorted
+# by y), and each vertical segment queries the active set for the y range it
+# covers. All k crossings among L segments are reported in O((L + k) log L).
+#
+# Only proper crossings are reported: the crossing point must lie strictly
+# inside both segments. Touching at an endpoint is not a crossing.
+
+# Event kinds, in the order they are processed at equal x so that horizontal
+# segments starting or ending at the x of a vertical segment do not cross it.
+_REMOVE, _QUERY, _INSERT = 0, 1, 2
+
+class ActiveSet(object):
+    # Horizontal segments spanning the sweep position, sorted by y.
+    def __init__(self):
+        self.ys = []
+        self.ids = []
+
+    def insert(self, y, i):
+        k = bisect_right(self.ys, y)
+        self.ys.insert(k, y)
+        self.ids.insert(k, i)
+
+    def remove(self, y, i):
+        k = bisect_left(self.ys, y)
+        while self.ids[k] != i:
+            k += 1
+        del self.ys[k]
+        del self.ids[k]
+
+    def between(self, lo, hi):
+        # (y, id) pairs with lo < y < hi.
+        k = bisect_right(self.ys, lo)
+        m = bisect_left(self.ys, hi)
+        return list(zip(self.ys[k:m], self.ids[k:m]))
+
+def find_crossings(hsegs, vsegs):
+    """
+    hsegs: (y, x0, x1) for each horizontal segment, x0 <= x1
+    vsegs: (x, y0, y1) for each vertical segment, y0 <= y1
+    Output a list of (h index, v index, x, y) for every proper crossing
+    """
+    events = []
+    for i, (y, x0, x1) in enumerate(hsegs):
+        if x0 < x1:
+            events.append((x0, _INSERT, i))
+            events.append((x1, _REMOVE, i))
+    for j, (x, _, _) in enumerate(vsegs):
+        events.append((x, _QUERY, j))
+    events.sort()
+
+    crossings = []
+    active = ActiveSet()
+    for x, kind, i in events:
+        if kind == _INSERT:
+            active.insert(hsegs[i][0], i)
+        elif kind == _REMOVE:
+            active.remove(hsegs[i][0], i)
+        else:
+            _, y0, y1 = vsegs[i]
+            for y, h in active.between(y0, y1):
+                crossings.append((h, i, x, y))
+    return crossings
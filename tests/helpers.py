@@ -0,0 +1,76 @@
+import io
+import random
+from model import TaoExcept
+
+# Shared by the tests: random command sequences and models.
+
+STORAGES = ['dict', 'python', 'columnar']
+
+def random_commands(rng, n, grid=6, model=None):
+    # n random .lang commands on a small grid, so that lines meet, cross and
+    # overlap often. With a model, some of them refer to its vertices and
+    # lines (read as the commands are consumed).
+    def number():
+        if rng.random() < 0.15:
+            return str(rng.randint(0, 2 * grid) / 2.0)
+        return str(rng.randint(0, grid))
+    for i in range(n):
+        vertices = list(model.vertices) if model is not None else []
+        lines = list(model.lines) if model is not None else []
+        name = 'a{}'.format(i)
+        if rng.random() < 0.2:
+            def coord():
+                if vertices and rng.random() < 0.3:
+                    return rng.choice(vertices + lines)
+                return number()
+            yield '{} {} {}'.format(name, coord(), coord())
+            continue
+        t = rng.choice('hv')
+        if vertices and rng.random() < 0.4:
+            start = rng.choice(vertices)
+        else:
+            start = '{} {}'.format(number(), number())
+        if vertices and rng.random() < 0.3:
+            end = rng.choice(vertices + lines)
+        else:
+            end = str(rng.choice([-1, 1]) * rng.randint(1, grid))
+        yield '{} {} start {} end {}'.format(name, t, start, end)
+
+def random_arc_commands(rng, n, grid=4):
+    # n random commands that mix arcs with lines and vertices on a small grid,
+    # so that arcs cross lines and each other, touch them and share centres.
+    for i in range(n):
+        r = rng.random()
+        x, y = rng.randint(0, grid), rng.randint(0, grid)
+        if r < 0.15:
+            yield 'p{} {} {}'.format(i, x, y)
+        elif r < 0.55:
+            yield 'a0 c{} {} {} {} {} {}'.format(i, x, y, rng.randint(1, 3),
+                                                 15 * rng.randint(0, 23), 15 * rng.randint(1, 25))
+        else:
+            yield 'l0 l{} {} {} {} {}'.format(i, rng.choice('hv'), x, y,
+                                              rng.choice([1, 2, 3, 4, -2]))
+
+def execute_random(model, seed, n=40, grid=6):
+    # Run random commands on model, each as its own transaction, and return
+    # the ones that succeeded.
+    rng = random.Random(seed)
+    done = []
+    for command in random_commands(rng, n, grid, model):
+        try:
+            with model.transaction():
+                model.execute_command(command)
+            done.append(command)
+        except TaoExcept:
+            pass
+    return done
+
+def random_segments(rng, n, grid=8):
+    # (type, x, y, length) segments, as in benchmark.py.
+    return [(rng.choice('hv'), rng.randint(0, grid), rng.randint(0, grid), rng.randint(1, grid))
+            for _ in range(n)]
+
+def brep_text(model):
+    f = io.StringIO()
+    model.write_brep(f)
+    return f.getvalue()
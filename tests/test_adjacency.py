@@ -0,0 +1,82 @@
+import random
+import pytest
+from model import SimpleBrep, TaoExcept
+from helpers import STORAGES
+
+# The incident lines of the index, and the topology queries built on them,
+# against brute force over all the lines and arcs of the model.
+
+def brute_incident(model):
+    incident = {}
+    for e, (v0, v1, _) in list(model.lines.items()) + list(model.arcs.items()):
+        incident.setdefault(v0, set()).add(e)
+        incident.setdefault(v1, set()).add(e)
+    return incident
+
+def brute_components(model):
+    parent = dict((v, v) for v in model.vertices)
+    def find(v):
+        while parent[v] != v:
+            v = parent[v]
+        return v
+    for v0, v1, _ in list(model.lines.values()) + list(model.arcs.values()):
+        parent[find(v0)] = find(v1)
+    groups = {}
+    for v in model.vertices:
+        groups.setdefault(find(v), []).append(v)
+    return sorted(sorted(g) for g in groups.values())
+
+def check(model):
+    incident = brute_incident(model)
+    assert model.index.incident == incident
+    for v in model.vertices:
+        assert model.degree(v) == len(incident.get(v, ()))
+        for direction, e, other in model.neighbours(v):
+            if direction == 'arc':
+                continue
+            (x0, y0), (x1, y1) = model.vertices[v], model.vertices[other]
+            t = model.lines[e][2]
+            assert direction == {'h': 'right' if x1 > x0 else 'left', 'v': 'up' if y1 > y0 else 'down'}[t]
+    for l, (v0, v1, t) in model.lines.items():
+        chain = model.chain(l)
+        assert l in chain
+        for a, b in zip(chain, chain[1:]):
+            assert model.lines[a][1] == model.lines[b][0]
+        # No collinear line continues the chain at either end.
+        fixed = 1 if t == 'h' else 0
+        same = [n for n, (a, _, u) in model.lines.items()
+                if u == t and model.vertices[a][fixed] == model.vertices[v0][fixed]]
+        assert not any(model.lines[n][1] == model.lines[chain[0]][0] for n in same)
+        assert not any(model.lines[n][0] == model.lines[chain[-1]][1] for n in same)
+    assert model.components() == brute_components(model)
+
+@pytest.mark.parametrize('seed', range(60))
+def test_topology_matches_brute_force(tmp_path, seed):
+    rng = random.Random(seed)
+    model = SimpleBrep(storage=STORAGES[seed % 3])
+    model.enable_history()
+    for i in range(rng.randint(1, 25)):
+        r = rng.random()
+        if r < 0.1:
+            model.undo()
+        elif r < 0.15:
+            model.redo()
+        else:
+            x, y = rng.randrange(6), rng.randrange(6)
+            if r < 0.25:
+                command = 'v0 p{} {} {}'.format(i, x, y)
+            elif r < 0.3 and seed % 2:
+                command = 'a0 c{} {} {} 1 0 90'.format(i, x, y)
+            else:
+                command = 'l0 a{} {} {} {} {}'.format(i, rng.choice('hv'), x, y, rng.choice([1, 2, 3, -2]))
+            try:
+                with model.transaction():
+                    model.execute_command(command)
+            except TaoExcept:
+                pass
+        check(model)
+    name = str(tmp_path / 'model.brep')
+    model.save_brep(name)
+    loaded = SimpleBrep(storage=model.storage)
+    loaded.load_brep(name)
+    check(loaded)
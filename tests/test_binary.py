@@ -0,0 +1,48 @@
+import pytest
+from model import SimpleBrep, TaoExcept
+from binary_brep import read_brep_binary, HEADER
+from helpers import STORAGES, execute_random, brep_text
+
+@pytest.mark.parametrize('storage', STORAGES)
+@pytest.mark.parametrize('seed', range(10))
+def test_checked_round_trip(tmp_path, storage, seed):
+    model = SimpleBrep(storage=storage)
+    execute_random(model, seed)
+    name = str(tmp_path / 'm.brepb')
+    model.save_brep_binary(name)
+    assert read_brep_binary(name)[-1]
+    loaded = SimpleBrep(storage=storage)
+    loaded.load_brep_binary(name)
+    assert brep_text(loaded) == brep_text(model)
+    # The index is built on the first mutation, from the loaded model.
+    with loaded.transaction():
+        loaded.execute_command('zz 1000 1000')
+    with model.transaction():
+        model.execute_command('zz 1000 1000')
+    assert brep_text(loaded) == brep_text(model)
+
+def test_unchecked_saves(tmp_path):
+    # Inside a transaction, the commands are not validated yet.
+    model = SimpleBrep()
+    name = str(tmp_path / 'm.brepb')
+    with model.transaction():
+        model.execute_command('a 0 0')
+        model.save_brep_binary(name)
+        assert not read_brep_binary(name)[-1]
+    model.save_brep_binary(name)
+    assert read_brep_binary(name)[-1]
+
+def test_corrupt_checked_file(tmp_path):
+    model = SimpleBrep()
+    with model.transaction():
+        model.execute_command('a 0 0')
+        model.execute_command('b 1 0')
+    name = str(tmp_path / 'm.brepb')
+    model.save_brep_binary(name)
+    with open(name, 'r+b') as f:
+        # Move b onto a.
+        f.seek(HEADER.size + 16)
+        f.write(b'\0' * 8)
+    assert not read_brep_binary(name)[-1]
+    with pytest.raises(TaoExcept):
+        SimpleBrep().load_brep_binary(name)
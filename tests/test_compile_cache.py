@@ -0,0 +1,59 @@
+import random
+import pytest
+from model import SimpleBrep, TaoExcept, run, same_model
+from compile_cache import CompileCache
+from benchmark import random_segments, to_lang
+
+def compile_lang(lines, directory, name, cache=None, storage='python'):
+    # The saved .brep bytes, or None if the model is invalid.
+    lang = directory / (name + '.lang')
+    brep = directory / (name + '.brep')
+    lang.write_text('\n'.join(lines) + '\n')
+    try:
+        run(str(lang), str(brep), cache=cache, storage=storage)
+    except TaoExcept:
+        return None
+    return brep.read_bytes()
+
+def edit(rng, lines, i):
+    # Change a line length, insert a vertex or delete a command.
+    k = rng.randrange(len(lines))
+    action = rng.choice(['edit', 'insert', 'delete'])
+    if action == 'edit' and ' end ' in lines[k]:
+        lines[k] = lines[k].rsplit(' ', 1)[0] + ' ' + str(rng.randint(1, 6))
+    elif action == 'delete':
+        del lines[k]
+    else:
+        lines.insert(k, 'z{} {}.5 {}.5'.format(i, rng.randint(0, 40), rng.randint(0, 40)))
+
+@pytest.mark.parametrize('storage', ['python', 'columnar'])
+@pytest.mark.parametrize('level', ['memory', 'disk'])
+def test_cached_compile_matches_full_compile(tmp_path, storage, level):
+    rng = random.Random(storage + level)
+    lines = to_lang(random_segments(160, seed=1)).splitlines()
+    checkpoints = tmp_path / 'cache'
+    cache = CompileCache(interval=20, directory=str(checkpoints) if level == 'disk' else None)
+    resumed = 0
+    for i in range(12):
+        if i:
+            edit(rng, lines, i)
+        if level == 'disk':
+            # A new process: only the checkpoints on disk are left.
+            cache = CompileCache(interval=20, directory=str(checkpoints))
+        cached = compile_lang(lines, tmp_path, 'cached', cache, storage)
+        full = compile_lang(lines, tmp_path, 'full', storage=storage)
+        assert cached == full
+        resumed += cache.resumed
+        if full is not None:
+            models = []
+            for name in ['cached', 'full']:
+                model = SimpleBrep(storage=storage)
+                model.load_brep(str(tmp_path / (name + '.brep')))
+                models.append(model)
+            assert same_model(*models)
+    assert resumed > 0
+    # A vertex on the start of a segment makes the program invalid.
+    x, y = [line for line in lines if ' start ' in line][-1].split()[3:5]
+    lines.append('dup {} {}'.format(x, y))
+    assert compile_lang(lines, tmp_path, 'cached', cache, storage) is None
+    assert cache.resumed > 0
@@ -0,0 +1,31 @@
+import io
+import os
+import shutil
+from model import compile_files, output_name
+
+FLAG = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'flag.lang')
+
+def compile_flag(name, **options):
+    out = io.StringIO()
+    assert compile_files([name], jobs=1, out=out, **options) == 0
+    return out.getvalue()
+
+def test_skipping_is_opt_in(tmp_path):
+    name = str(tmp_path / 'flag.lang')
+    shutil.copy(FLAG, name)
+    assert '0 skipped' in compile_flag(name)
+    assert '0 skipped' in compile_flag(name)
+    assert '0 skipped' in compile_flag(name, incremental=True)
+    assert '1 skipped' in compile_flag(name, incremental=True)
+
+def test_options_change_recompiles(tmp_path):
+    name = str(tmp_path / 'flag.lang')
+    shutil.copy(FLAG, name)
+    compile_flag(name, incremental=True)
+    assert '0 skipped' in compile_flag(name, incremental=True, resolution=0.5)
+    assert '0 skipped' in compile_flag(name, incremental=True, storage='columnar')
+    assert '1 skipped' in compile_flag(name, incremental=True, storage='columnar')
+    # A compile that does not record its options forgets the recorded ones.
+    compile_flag(name, resolution=0.5)
+    assert '0 skipped' in compile_flag(name, incremental=True, storage='columnar')
+    assert os.path.exists(output_name(name))
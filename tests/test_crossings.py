@@ -0,0 +1,63 @@
+import random
+import pytest
+from sweep import find_crossings
+from benchmark import unresolved_model, random_segments as benchmark_random
+from helpers import STORAGES, random_segments, brep_text
+
+def crossings_pairwise(hsegs, vsegs):
+    found = []
+    for h, (y, x0, x1) in enumerate(hsegs):
+        for v, (x, y0, y1) in enumerate(vsegs):
+            if x0 < x < x1 and y0 < y < y1:
+                found.append((h, v, x, y))
+    return sorted(found)
+
+@pytest.mark.parametrize('seed', range(50))
+def test_sweep_matches_pairwise(seed):
+    rng = random.Random(seed)
+    size = rng.randint(2, 10)
+    def segment():
+        a, b = sorted([rng.randint(0, size), rng.randint(0, size)])
+        return (rng.randint(0, size) * 0.5, a * 0.5, b * 0.5)
+    hsegs = [segment() for _ in range(rng.randint(0, 30))]
+    vsegs = [segment() for _ in range(rng.randint(0, 30))]
+    assert sorted(find_crossings(hsegs, vsegs)) == crossings_pairwise(hsegs, vsegs)
+
+def test_touching_is_not_crossing():
+    # Endpoints on the other segment, and segments meeting at their ends.
+    hsegs = [(1.0, 0.0, 2.0), (0.0, 0.0, 1.0)]
+    vsegs = [(0.0, 0.0, 2.0), (2.0, 1.0, 3.0), (1.0, 0.0, 1.0)]
+    assert find_crossings(hsegs, vsegs) == []
+
+@pytest.mark.parametrize('storage', STORAGES)
+@pytest.mark.parametrize('seed', range(15))
+def test_find_cross_lines_matches_pairwise(storage, seed):
+    # Every segment on a row (column) of its own: the index assumes that
+    # collinear lines do not overlap, as in a valid model.
+    rng = random.Random(seed)
+    model = unresolved_model(benchmark_random(rng.randint(2, 40), seed), storage=storage)
+    expected = model.find_cross_lines_pairwise()
+    assert model.find_cross_lines() == expected
+    # Through the index, for given lines.
+    assert model.find_cross_lines(list(model.lines)) == expected
+    lines = rng.sample(sorted(model.lines), len(model.lines) // 2)
+    involved = []
+    for h, (h0, h1, ht) in model.lines.items():
+        for v, (v0, v1, vt) in model.lines.items():
+            if ht != 'h' or vt != 'v' or (h not in lines and v not in lines):
+                continue
+            (x0, y), (x1, _) = model.vertices[h0], model.vertices[h1]
+            (x, y0), (_, y1) = model.vertices[v0], model.vertices[v1]
+            if x0 < x < x1 and y0 < y < y1:
+                involved.append((x, y))
+    assert sorted(model.find_cross_lines(lines)) == sorted(involved)
+
+@pytest.mark.parametrize('storage', STORAGES)
+@pytest.mark.parametrize('seed', range(15))
+def test_resolve_cross_lines_matches_pairwise(storage, seed):
+    segments = random_segments(random.Random(seed), 25)
+    swept = unresolved_model(segments, storage=storage)
+    swept.resolve_cross_lines()
+    pairwise = unresolved_model(segments, storage=storage)
+    pairwise.resolve_cross_lines(pairwise=True)
+    assert brep_text(swept) == brep_text(pairwise)
@@ -0,0 +1,25 @@
+from model import SimpleBrep, Program
+
+def test_trace_records_source_lines():
+    program = Program.from_lines(['a 0 0  # origin\n', '\n', '# comment\n', 'l1 h start a  end   5\n'])
+    model = SimpleBrep()
+    profiler = model.enable_profiling(trace=True)
+    program.execute(model)
+    assert [(r['line'], r['command']) for r in profiler.records] == \
+        [(1, 'a 0 0  # origin'), (4, 'l1 h start a  end   5')]
+
+def test_trace_without_source():
+    model = SimpleBrep()
+    profiler = model.enable_profiling(trace=True)
+    model.execute_command('a 0 0')
+    assert profiler.records[0]['command'] == 'a 0 0'
+    assert 'line' not in profiler.records[0]
+
+def test_intersections_count_arc_crossings():
+    # c3 crosses l1 at (0, 0) and c2 at (0.5, 0.87), c2 meets l1 only at its
+    # ends, and l4 crosses l1 at (1.5, 0).
+    model = SimpleBrep()
+    profiler = model.enable_profiling()
+    for command in ['l0 l1 h -2 0 4', 'a0 c2 0 0 1 0 180', 'a0 c3 1 0 1 90 270', 'l0 l4 v 1.5 -1 2']:
+        model.execute_command(command)
+    assert profiler.counters['intersections'] == 3
@@ -0,0 +1,36 @@
+import io
+import os
+import sys
+import json
+import subprocess
+from model import SimpleBrep
+from server import INLINE_COMMANDS
+from benchmark import random_segments, to_lang
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def serve(requests):
+    # The responses of a --stdio server to the requests, by id.
+    text = ''.join(json.dumps(dict(request, id=i)) + '\n' for i, request in enumerate(requests))
+    result = subprocess.run([sys.executable, os.path.join(ROOT, 'server.py'), '--stdio', '-j', '1'],
+                            input=text, capture_output=True, text=True, timeout=120, check=True)
+    responses = [json.loads(line) for line in result.stdout.splitlines()]
+    return dict((response['id'], response) for response in responses)
+
+def test_offloaded_commands_are_answered_before_shutdown():
+    commands = to_lang(random_segments(INLINE_COMMANDS + 50, seed=3)).splitlines()
+    responses = serve([
+        {'op': 'open', 'session': 's'},
+        {'op': 'command', 'session': 's', 'commands': commands},
+        {'op': 'brep', 'session': 's'},
+        {'op': 'shutdown'},
+    ])
+    assert sorted(responses) == [0, 1, 2, 3]
+    assert all(response['ok'] for response in responses.values())
+    model = SimpleBrep()
+    with model.transaction():
+        for command in commands:
+            model.execute_command(command)
+    f = io.StringIO()
+    model.write_brep(f)
+    assert responses[2]['brep'] == f.getvalue()
@@ -0,0 +1,40 @@
+import random
+import pytest
+from model import SimpleBrep
+from helpers import brep_text, execute_random
+
+@pytest.mark.parametrize('seed', range(30))
+def test_columnar_matches_dict(seed):
+    # Removed vertices leave dead rows behind; the output must not show it.
+    models = [SimpleBrep(storage=storage) for storage in ('dict', 'columnar')]
+    for model in models:
+        execute_random(model, seed, n=60)
+    assert brep_text(models[0]) == brep_text(models[1])
+
+def test_columnar_views_are_read_only():
+    model = SimpleBrep(storage='columnar')
+    execute_random(model, 0)
+    v = next(iter(model.vertices))
+    l = next(iter(model.lines))
+    with pytest.raises(TypeError):
+        model.vertices[v] = (0, 0)
+    with pytest.raises(TypeError):
+        del model.lines[l]
+    with pytest.raises(ValueError):
+        model.vertices[v][0] = 1
+    with pytest.raises(ValueError):
+        model.vertices.coords()[0, 0] = 1
+
+def test_columnar_remove_compacts():
+    model = SimpleBrep(storage='columnar')
+    names = ['p{}'.format(i) for i in range(100)]
+    for i, n in enumerate(names):
+        model.add_vertex(n, i, 0)
+    rng = random.Random(0)
+    removed = rng.sample(names, 70)
+    for n in removed:
+        model.remove_vertex(n)
+    kept = [n for n in names if n not in removed]
+    assert list(model.vertices) == kept
+    assert len(model.vertices.names) < 100
+    assert model.vertices.coords()[:, 0].tolist() == [float(n[1:]) for n in kept]
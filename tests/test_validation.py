@@ -0,0 +1,126 @@
+import random
+import pytest
+from model import SimpleBrep, TaoExcept
+from arc_geometry import point_tolerance
+from helpers import STORAGES, random_commands, random_arc_commands, brep_text
+
+# check_brep_incremental, which commands run, against the full check_brep.
+
+def run_commands(model, commands):
+    # Outcome of each command, each as its own transaction.
+    outcomes = []
+    for command in commands:
+        try:
+            with model.transaction():
+                model.execute_command(command)
+            outcomes.append(True)
+        except TaoExcept:
+            outcomes.append(False)
+    return outcomes
+
+@pytest.mark.parametrize('storage', STORAGES)
+@pytest.mark.parametrize('seed', range(20))
+def test_incremental_agrees_with_full_check(storage, seed):
+    # debug_check runs both checks after every command and asserts that they
+    # agree; paranoid only runs the full one.
+    rng = random.Random(seed)
+    checked = SimpleBrep(storage=storage, debug_check=True)
+    commands, outcomes = [], []
+    for command in random_commands(rng, 40, model=checked):
+        commands.append(command)
+        outcomes += run_commands(checked, [command])
+    paranoid = SimpleBrep(storage=storage, paranoid=True)
+    default = SimpleBrep(storage=storage)
+    assert run_commands(paranoid, commands) == outcomes
+    assert run_commands(default, commands) == outcomes
+    assert brep_text(paranoid) == brep_text(default) == brep_text(checked)
+
+@pytest.mark.parametrize('storage', STORAGES)
+@pytest.mark.parametrize('seed', range(10))
+def test_batch_agrees_with_full_check(storage, seed):
+    # A whole program as one transaction, validated once at the end.
+    rng = random.Random(seed)
+    commands = list(random_commands(rng, 15, grid=4))
+    results = []
+    for options in ({'paranoid': True}, {}):
+        model = SimpleBrep(storage=storage, **options)
+        try:
+            with model.transaction():
+                for command in commands:
+                    model.execute_command(command)
+            results.append(brep_text(model))
+        except TaoExcept:
+            results.append(None)
+    assert results[0] == results[1]
+
+def test_full_check_rejects():
+    for commands in (['a 0 0', 'b 0 0'],
+                     ['l h start 0 0 end 2', 'm h start 0 0 end 2']):
+        model = SimpleBrep()
+        with pytest.raises(TaoExcept):
+            with model.transaction():
+                for command in commands:
+                    model.execute_command(command)
+        assert not model.vertices and not model.lines
+
+@pytest.mark.parametrize('storage', STORAGES)
+@pytest.mark.parametrize('options', [{}, {'paranoid': True}, {'debug_check': True}])
+@pytest.mark.parametrize('coordinate', ['nan', 'inf', '-inf'])
+def test_non_finite_coordinates_are_rejected(tmp_path, storage, options, coordinate):
+    name = str(tmp_path / 'model.brep')
+    with open(name, 'w') as f:
+        f.write('a {} 0\nb 1 0\n'.format(coordinate))
+    with pytest.raises(TaoExcept):
+        SimpleBrep(storage=storage, **options).load_brep(name)
+    model = SimpleBrep(storage=storage, **options)
+    with pytest.raises(TaoExcept):
+        with model.transaction():
+            model.execute_command('a {} 0'.format(coordinate))
+    assert not model.vertices
+
+def near_vertices(model):
+    # Pairs of vertices within point_tolerance of each other.
+    points = sorted((float(x), float(y), n) for n, (x, y) in model.vertices.items())
+    pairs = []
+    for i, (x, y, n) in enumerate(points):
+        eps = point_tolerance(x, y)
+        for x2, y2, n2 in points[i + 1:]:
+            if x2 - x > eps:
+                break
+            if abs(y2 - y) <= eps:
+                pairs.append((n, n2))
+    return pairs
+
+@pytest.mark.parametrize('storage', STORAGES)
+@pytest.mark.parametrize('seed', range(100))
+def test_arcs_incremental_agrees_with_full_check(storage, seed):
+    # As above, with arcs: any failure other than TaoExcept fails the test.
+    rng = random.Random(seed)
+    commands = list(random_arc_commands(rng, rng.randint(3, 14)))
+    checked = SimpleBrep(storage=storage, debug_check=True)
+    outcomes = run_commands(checked, commands)
+    paranoid = SimpleBrep(storage=storage, paranoid=True)
+    default = SimpleBrep(storage=storage)
+    assert run_commands(paranoid, commands) == outcomes
+    assert run_commands(default, commands) == outcomes
+    assert brep_text(paranoid) == brep_text(default) == brep_text(checked)
+    assert near_vertices(checked) == []
+
+@pytest.mark.parametrize('storage', STORAGES)
+def test_arcs_split_at_one_angle(storage):
+    # c0 and c1 leave vertices a hair apart on x = 0, which l5 used to pick
+    # up as two; c7 then had two splits at one angle and crashed split_arc.
+    commands = ['a0 c0 0 4 2 90 360', 'a0 c1 0 2 2 90 360', 'a0 c2 1 2 1 90 270',
+                'l0 l3 h 1 1 4', 'a0 c4 4 4 2 180 135', 'l0 l5 v 0 2 4',
+                'a0 c7 0 0 2 30 135']
+    model = SimpleBrep(storage=storage, debug_check=True)
+    assert run_commands(model, commands) == [True, True, True, True, True, False, True]
+    assert near_vertices(model) == []
+
+def test_snap_point_picks_the_nearest_line():
+    model = SimpleBrep()
+    with model.transaction():
+        model.execute_command('l0 l1 h 0 0 4')
+        model.execute_command('l0 l2 h 0 2e-10 4')
+    assert model.snap_point(2.0, 1.5e-10, 1e-9) == (2.0, 2e-10, None)
+    assert model.snap_point(2.0, 0.5e-10, 1e-9) == (2.0, 0.0, None)
@@ -0,0 +1,168 @@
+import numpy as np
+from contextlib import contextmanager
+from multiprocessing import shared_memory
+from concurrent.futures import ProcessPoolExecutor
+from sweep import find_crossings
+from model import TaoExcept, check_geometry
+
+# Tiled versions of the operations over a whole SimpleBrep, for very large
+# models; see SimpleBrep(jobs=...).
+#
+# The plane is cut into vertical strips, the tiles, holding about as many
+# vertices (or vertical lines) each. A vertex or a vertical line belongs to the
+# tile containing its x, and a horizontal line is clipped to every tile it
+# spans. Whatever happens at a point (two lines crossing, a vertex inside a
+# line) is then seen by the tile containing the point, and by no other one, so
+# the tiles are processed independently, in a pool of processes reading the
+# coordinates from shared memory. Their results are stitched back in tile
+# order, which is the order along horizontal lines. The model applies them as
+# the serial code does, so generated names, and the whole result, are the same.
+
+def tile_bounds(xs, count):
+    # (lo, hi) of up to count tiles covering the plane, splitting the sorted xs
+    # evenly. Tile k holds the x with lo <= x < hi.
+    xs = np.sort(np.asarray(xs, dtype=np.float64))
+    cuts = []
+    if len(xs):
+        cuts = np.unique(xs[[len(xs) * k // count for k in range(1, count)]]).tolist()
+    bounds = [-np.inf] + cuts + [np.inf]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+@contextmanager
+def shared_arrays(arrays):
+    # Copy the named arrays to shared memory, for attached. Yields the specs to
+    # pass to the workers.
+    blocks, specs = [], {}
+    try:
+        for key, array in arrays.items():
+            array = np.ascontiguousarray(array)
+            block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+            blocks.append(block)
+            np.ndarray(array.shape, array.dtype, buffer=block.buf)[...] = array
+            specs[key] = (block.name, array.shape, array.dtype.str)
+        yield specs
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
+
+@contextmanager
+def attached(specs):
+    # In a worker: the arrays of shared_arrays, by name. They are only valid
+    # inside the block.
+    blocks, arrays = [], {}
+    try:
+        for key, (name, shape, dtype) in specs.items():
+            block = shared_memory.SharedMemory(name=name)
+            blocks.append(block)
+            arrays[key] = np.ndarray(shape, dtype, buffer=block.buf)
+        yield arrays
+    finally:
+        arrays.clear()
+        for block in blocks:
+            block.close()
+
+def run_tiles(function, arrays, bounds, jobs):
+    # function(specs, lo, hi) for every tile, in a pool of jobs processes. The
+    # results are in tile order.
+    with shared_arrays(arrays) as specs:
+        with ProcessPoolExecutor(max_workers=min(jobs, len(bounds))) as pool:
+            return list(pool.map(function, [specs] * len(bounds), *zip(*bounds)))
+
+def expand(starts, stops):
+    # (k, i) for every k and starts[k] <= i < stops[k], in order.
+    counts = np.maximum(stops - starts, 0)
+    owners = np.repeat(np.arange(len(starts)), counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    return owners, starts[owners] + offsets
+
+def select_tile(xy, ends, types, lo, hi):
+    # The lines meeting the tile, and the rows of the vertices the tile needs
+    # (its own, and the ends of those lines), sorted. Lines must be normalized.
+    x = xy[:, 0]
+    s, e = ends[:, 0], ends[:, 1]
+    inside = (x >= lo) & (x < hi)
+    lines = np.flatnonzero(np.where(types == 0, (x[s] < hi) & (x[e] > lo), inside[s]))
+    rows = np.unique(np.concatenate([np.flatnonzero(inside), s[lines], e[lines]]))
+    return inside, lines, rows
+
+def crossings_tile(specs, lo, hi):
+    # The crossings of the vertical lines of the tile, as (h index, v index).
+    with attached(specs) as a:
+        hsegs, vsegs = a['h'], a['v']
+        hs = np.flatnonzero((hsegs[:, 1] < hi) & (hsegs[:, 2] > lo))
+        vs = np.flatnonzero((vsegs[:, 0] >= lo) & (vsegs[:, 0] < hi))
+        found = find_crossings(hsegs[hs].tolist(), vsegs[vs].tolist())
+        return [(int(hs[h]), int(vs[v])) for h, v, _, _ in found]
+
+def find_crossings_tiled(hsegs, vsegs, jobs):
+    # sweep.find_crossings on tiles, as a list of (h index, v index, x, y).
+    # The order differs; the coordinates are the objects in the segments.
+    if not hsegs or not vsegs:
+        return []
+    arrays = {'h': np.array(hsegs, dtype=np.float64), 'v': np.array(vsegs, dtype=np.float64)}
+    bounds = tile_bounds(arrays['v'][:, 0], jobs)
+    found = []
+    for pairs in run_tiles(crossings_tile, arrays, bounds, jobs):
+        found.extend((h, v, vsegs[v][0], hsegs[h][0]) for h, v in pairs)
+    return found
+
+def inside_tile(specs, lo, hi):
+    # The vertices of the tile lying strictly inside lines, as (line, vertex
+    # row) sorted by line, then along it.
+    with attached(specs) as a:
+        xy, ends, types = a['xy'], a['ends'], a['types']
+        inside, lines, rows = select_tile(xy, ends, types, lo, hi)
+        x, y = xy[rows, 0], xy[rows, 1]
+        _, rx = np.unique(x, return_inverse=True)
+        _, ry = np.unique(y, return_inverse=True)
+        nx, ny = rx.max(initial=0) + 1, ry.max(initial=0) + 1
+        found_lines, found_rows = [], []
+        for t, keys in ((0, ry * nx + rx), (1, rx * ny + ry)):
+            sel = lines[types[lines] == t]
+            # The vertices are in row order, so equal keys keep it.
+            order = np.argsort(keys, kind='stable')
+            sorted_keys = keys[order]
+            starts = np.searchsorted(sorted_keys, keys[np.searchsorted(rows, ends[sel, 0])], 'right')
+            stops = np.searchsorted(sorted_keys, keys[np.searchsorted(rows, ends[sel, 1])], 'left')
+            owners, positions = expand(starts, stops)
+            found = rows[order[positions]]
+            keep = inside[found]
+            found_lines.append(sel[owners][keep])
+            found_rows.append(found[keep])
+        found_lines = np.concatenate(found_lines)
+        found_rows = np.concatenate(found_rows)
+        order = np.argsort(found_lines, kind='stable')
+        return found_lines[order], found_rows[order]
+
+def vertices_inside_tiled(xy, ends, types, jobs):
+    """
+    Input the vertex coordinates (n x 2), normalized line ends (vertex rows) and
+    type codes of a model (see storage.py)
+    Output line index -> the rows of the vertices strictly inside the line,
+    sorted along it, for the lines that have any
+    """
+    inside = {}
+    for lines, rows in run_tiles(inside_tile, {'xy': xy, 'ends': ends, 'types': types},
+                                 tile_bounds(xy[:, 0], jobs), jobs):
+        for l, v in zip(lines.tolist(), rows.tolist()):
+            inside.setdefault(l, []).append(v)
+    return inside
+
+def check_tile(specs, lo, hi):
+    # Whether check_geometry accepts what the tile sees.
+    with attached(specs) as a:
+        xy, ends, types = a['xy'], a['ends'], a['types']
+        _, lines, rows = select_tile(xy, ends, types, lo, hi)
+        sub = np.searchsorted(rows, ends[lines])
+        try:
+            check_geometry(xy[rows, 0], xy[rows, 1], sub[:, 0], sub[:, 1], types[lines])
+        except TaoExcept:
+            return False
+        return True
+
+def check_geometry_tiled(xy, ends, types, jobs):
+    # check_geometry on tiles.
+    bounds = tile_bounds(xy[:, 0], jobs)
+    if not all(run_tiles(check_tile, {'xy': xy, 'ends': ends, 'types': types}, bounds, jobs)):
+        raise TaoExcept()